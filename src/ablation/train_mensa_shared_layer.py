@@ -15,12 +15,11 @@ import torch
 import random
 import warnings
 import argparse
-from SurvivalEVAL.Evaluator import LifelinesEvaluator
 
 # Local
 from utility.survival import (make_time_bins, preprocess_data)
 from utility.config import load_config
-from utility.evaluation import global_C_index, local_C_index
+from utility.evaluation import global_C_index, local_C_index, MultiEventEvaluator
 from mensa.model import MENSA
 
 # SOTA
@@ -110,10 +109,9 @@ if __name__ == "__main__":
     
     # Make predictions
     all_preds = []
+    model_preds = model.predict_survival(test_dict['X'].to(device), time_bins)
     for i in range(n_events):
-        model_preds = model.predict(test_dict['X'].to(device), time_bins, risk=i+1)
-        model_preds = pd.DataFrame(model_preds, columns=time_bins.cpu().numpy())
-        all_preds.append(model_preds)
+        all_preds.append(pd.DataFrame(model_preds[:, i], columns=time_bins.cpu().numpy()))
     
     # Calculate local and global CI
     all_preds_arr = [df.to_numpy() for df in all_preds]
@@ -122,23 +120,13 @@ if __name__ == "__main__":
     local_ci = local_C_index(all_preds_arr, test_dict['T'].cpu().numpy(),
                             test_dict['E'].cpu().numpy())
     
-    # Make evaluation for each event
+    # Make evaluation for all events in one pass
+    evaluator = MultiEventEvaluator(all_preds_arr, all_preds[0].columns.to_numpy(dtype=float),
+                                    test_dict['T'].cpu().numpy(), test_dict['E'].cpu().numpy(),
+                                    train_dict['T'].cpu().numpy(), train_dict['E'].cpu().numpy())
+    event_metrics = evaluator.evaluate()[['CI', 'IBS', 'MAEM', 'DCalib']]
     model_results = pd.DataFrame()
-    for event_id, surv_pred in enumerate(all_preds):
-        n_train_samples = len(train_dict['X'])
-        n_test_samples= len(test_dict['X'])
-        y_train_time = train_dict['T'][:,event_id]
-        y_train_event = train_dict['E'][:,event_id]
-        y_test_time = test_dict['T'][:,event_id]
-        y_test_event = test_dict['E'][:,event_id]
-        
-        lifelines_eval = LifelinesEvaluator(surv_pred.T, y_test_time, y_test_event,
-                                            y_train_time, y_train_event)
-        
-        ci = lifelines_eval.concordance()[0]
-        ibs = lifelines_eval.integrated_brier_score()
-        mae = lifelines_eval.mae(method="Margin")
-        d_calib = lifelines_eval.d_calibration()[0]
+    for event_id, (ci, ibs, mae, d_calib) in enumerate(event_metrics.to_numpy()):
         
         metrics = [ci, ibs, mae, d_calib, global_ci, local_ci]
         print(metrics)
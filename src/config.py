@@ -11,6 +11,10 @@ MENSA_CONFIGS_DIR = Path.joinpath(CONFIGS_DIR, 'mensa')
 RESULTS_DIR = Path.joinpath(ROOT_DIR, 'results')
 PLOTS_DIR = Path.joinpath(ROOT_DIR, 'plots')
 MODELS_DIR = Path.joinpath(ROOT_DIR, 'models')
+DATA_CACHE_DIR = Path.joinpath(DATA_DIR, 'cache')
+
+# Cache the parsed real-world datasets in DATA_CACHE_DIR
+USE_DATA_CACHE = True
 
 # This contains default parameters for the models
 HIERARCH_PARAMS = {
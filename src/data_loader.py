@@ -12,6 +12,7 @@ from dgp import DGP_Weibull_linear, DGP_Weibull_nonlinear
 import torch
 import random
 from data import mimic_feature_selection 
+from utility.data_cache import cached_dataset
 
 class BaseDataLoader(ABC):
     """
@@ -371,6 +372,7 @@ class PROACTMultiDataLoader(BaseDataLoader):
     """
     Data loader for ALS dataset (ME). Use the PRO-ACT dataset.
     """
+    @cached_dataset('proact_processed.csv')
     def load_data(self, n_samples:int = None):
         df = pd.read_csv(f'{cfg.DATA_DIR}/proact_processed.csv', index_col=0)
         if n_samples:
@@ -430,6 +432,7 @@ class MimicMultiDataLoader(BaseDataLoader):
     """
     Data loader for MIMIC dataset (ME)
     """
+    @cached_dataset('mimic.csv.gz', mimic_feature_selection.__file__)
     def load_data(self, n_samples:int = None):
         '''
         t and e order, followed by arf, shock, death
@@ -495,6 +498,7 @@ class SeerSingleDataLoader(BaseDataLoader):
     """
     Data loader for SEER dataset (SE)
     """
+    @cached_dataset('seer_processed.csv')
     def load_data(self, n_samples:int = None):
         df = pd.read_csv(f'{cfg.DATA_DIR}/seer_processed.csv')
         
@@ -549,6 +553,7 @@ class MimicSingleDataLoader(BaseDataLoader):
     """
     Data loader for MIMIC dataset (SE)
     """
+    @cached_dataset('mimic.csv.gz', mimic_feature_selection.__file__)
     def load_data(self, n_samples:int = None):
         '''
         t and e order, followed by death
@@ -608,6 +613,7 @@ class SeerCompetingDataLoader(BaseDataLoader):
     """
     Data loader for SEER dataset (CR)
     """
+    @cached_dataset('seer_processed.csv')
     def load_data(self, n_samples:int = None):
         df = pd.read_csv(f'{cfg.DATA_DIR}/seer_processed.csv')
         
@@ -658,10 +664,28 @@ class SeerCompetingDataLoader(BaseDataLoader):
             
         return dicts[0], dicts[1], dicts[2]
         
+def get_rotterdam_competing_events(df):
+    '''
+    First event and its time of the Rotterdam rows: 0 censor, 1 death, 2 recur
+    Keep it in this module: the dataset cache stamps this file, so a change rebuilds the cached
+    entries (see utility.data_cache).
+    '''
+    no_event = (df['recur'] == 0) & (df['death'] == 0)
+    recur_first = (df['rtime'] <= df['dtime']) & (df['recur'] == 1)
+    death_first = (df['dtime'] <= df['rtime']) & (df['death'] == 1)
+    death_only = (df['death'] == 1) & (df['recur'] == 0) #some scenaro, recur time censor but earlier than death.
+    event = np.select([no_event, recur_first, death_first | death_only], [0, 2, 1], default=-1)
+    if (event == -1).any():
+        raise ValueError("error in event")
+    time = np.select([event == 0, event == 1, event == 2],
+                     [np.minimum(df['rtime'], df['dtime']), df['dtime'], df['rtime']])
+    return event, time
+
 class RotterdamCompetingDataLoader(BaseDataLoader):
     """
     Data loader for Rotterdam dataset (CR)
     """
+    @cached_dataset('rotterdam.csv')
     def load_data(self, n_samples:int = None):
         '''
         Events: 0 censor, 1 death, 2 recur
@@ -677,30 +701,7 @@ class RotterdamCompetingDataLoader(BaseDataLoader):
         # Apply mapping
         df['size_map'] = df['size'].replace(size_mapping)
         
-        def get_time(row):
-            if row['event'] == 0:
-                return min(row['rtime'], row['dtime'])
-            elif row['event'] == 1:
-                return row['dtime']
-            elif row['event'] == 2:
-                return row['rtime']
-            else:
-                raise ValueError("error in time")
- 
-        def get_event(row):
-            if row['recur'] == 0 and row['death'] == 0:
-                return 0
-            elif row['rtime'] <= row['dtime'] and row['recur'] == 1:
-                return 2
-            elif row['dtime'] <= row['rtime'] and row['death'] == 1:
-                return 1
-            elif row['death'] == 1 and row['recur'] == 0: #some scenaro, recur time censor but earlier than death.
-                return 1
-            else:
-                raise ValueError("error in event")
-        
-        df['event'] = df.apply(get_event, axis=1)
-        df['time'] = df.apply(get_time, axis=1)
+        df['event'], df['time'] = get_rotterdam_competing_events(df)
         self.X = df.drop(['pid', 'size', 'rtime', 'recur', 'dtime', 'death', 'time', 'event'], axis=1)
         self.columns = list(self.X.columns)
         self.num_features = self._get_num_features(self.X)
@@ -731,10 +732,30 @@ class RotterdamCompetingDataLoader(BaseDataLoader):
             
         return dicts[0], dicts[1], dicts[2]
 
+def get_mimic_competing_events(df):
+    '''
+    First event and its time of the MIMIC rows: 0 censor, 1 ARF, 2 shock, 3 death
+    Keep it in this module: the dataset cache stamps this file, so a change rebuilds the cached
+    entries (see utility.data_cache).
+    '''
+    event_times = df[['ARF_time', 'shock_time', 'death_time']]
+    no_event = (df['ARF_event'] == 0) & (df['shock_event'] == 0) & (df['death_event'] == 0)
+    death_first = (df['death_event'] == 1) & (event_times.min(axis=1) == df['death_time'])
+    shock_first = (df['shock_event'] == 1) & (df[['ARF_time', 'shock_time']].min(axis=1) == df['shock_time'])
+    arf = df['ARF_event'] == 1
+    event = np.select([no_event, death_first, shock_first, arf], [0, 3, 2, 1], default=-1)
+    if (event == -1).any():
+        print(df[event == -1])
+        raise ValueError("error in event")
+    time = np.select([event == 0, event == 3, event == 2, event == 1],
+                     [event_times.max(axis=1), df['death_time'], df['shock_time'], df['ARF_time']])
+    return event, time
+
 class MimicCompetingDataLoader(BaseDataLoader):
     """
     Data loader for MIMIC dataset (CR)
     """
+    @cached_dataset('mimic.csv.gz', mimic_feature_selection.__file__)
     def load_data(self, n_samples:int = None):
         '''
         t and e order, followed by death
@@ -759,33 +780,7 @@ class MimicCompetingDataLoader(BaseDataLoader):
         self.num_features = self._get_num_features(self.X)
         self.cat_features = self._get_cat_features(self.X)
 
-        def get_time(row):
-            if row['event'] == 0:
-                return max([row['ARF_time'], row['death_time'], row['shock_time']])
-            elif row['event'] == 3:
-                return row['death_time']
-            elif row['event'] == 2:
-                return row['shock_time']
-            elif row['event'] == 1:
-                return row['ARF_time']        
-            else:
-                raise ValueError("error in time")
-        
-        def get_event(row):
-            if row['ARF_event'] == 0 and row['shock_event'] == 0 and row['death_event'] == 0:
-                return 0
-            elif row['death_event'] == 1 and min([row['ARF_time'], row['death_time'], row['shock_time']]) == row['death_time']:
-                return 3
-            elif row['shock_event'] == 1 and min([row['ARF_time'], row['shock_time']]) == row['shock_time']:
-                return 2
-            elif row['ARF_event'] == 1:
-                return 1
-            else:
-                print (row)
-                raise ValueError("error in event")
-        
-        df['event'] = df.apply(get_event, axis=1)
-        df['time'] = df.apply(get_time, axis=1)
+        df['event'], df['time'] = get_mimic_competing_events(df)
         
         self.y_t = df[f'time'].values 
         self.y_e = df[f'event'].values # 0 (censored), 1 ARF, 2 shock, 3 death
@@ -822,6 +817,7 @@ class EBMTDataLoader(BaseDataLoader):
     """
     Data loader for EBMT dataset (ME)
     """
+    @cached_dataset('ebmt.csv')
     def load_data(self, n_samples:int = None):
         '''
         t and e order, followed by arf, shock, death
@@ -875,6 +871,7 @@ class RotterdamMultiDataLoader(BaseDataLoader):
     """
     Data loader for Rotterdam dataset (ME)
     """
+    @cached_dataset('rotterdam.csv')
     def load_data(self, n_samples:int = None):
         '''
         Events: 0 censor, 1 death, 2 recur
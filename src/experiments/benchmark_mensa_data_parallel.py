@@ -0,0 +1,79 @@
+"""
+benchmark_mensa_data_parallel.py
+====================================
+Trains MENSA with 1, 2, 4 and 8 local gloo ranks on SEER and MIMIC
+and reports the training time and the best validation loss.
+"""
+
+# 3rd party
+import pandas as pd
+import numpy as np
+import sys, os
+sys.path.append(os.path.abspath('../'))
+
+import config as cfg
+import torch
+import random
+import time
+import warnings
+
+# Local
+from utility.survival import preprocess_data
+from utility.config import load_config
+from mensa.model import MENSA
+from mensa.distributed import run_data_parallel
+from data_loader import get_data_loader
+
+warnings.filterwarnings("ignore", message=".*The 'nopython' keyword.*")
+
+SEED = 0
+DATASETS = ['seer_se', 'mimic_se']
+WORLD_SIZES = [1, 2, 4, 8]
+
+def load_dataset(dataset_name, dtype):
+    dl = get_data_loader(dataset_name)
+    dl = dl.load_data()
+    train_dict, valid_dict, test_dict = dl.split_data(train_size=0.7, valid_size=0.1, test_size=0.2,
+                                                      random_state=SEED)
+    X_train = pd.DataFrame(train_dict['X'], columns=dl.columns)
+    X_valid = pd.DataFrame(valid_dict['X'], columns=dl.columns)
+    X_test = pd.DataFrame(test_dict['X'], columns=dl.columns)
+    X_train, X_valid, X_test = preprocess_data(X_train, X_valid, X_test, dl.cat_features,
+                                               dl.num_features, as_array=True)
+    for data_dict, X in zip([train_dict, valid_dict], [X_train, X_valid]):
+        data_dict['X'] = torch.tensor(X, dtype=dtype)
+        data_dict['E'] = torch.tensor(data_dict['E'], dtype=torch.int64)
+        data_dict['T'] = torch.tensor(data_dict['T'], dtype=torch.int64)
+    return dl, train_dict, valid_dict
+
+def train_rank(rank, world_size, dataset_name):
+    # Every rank loads the same split, fit() shards it
+    dtype = torch.float64
+    torch.set_default_dtype(dtype)
+    np.random.seed(SEED + rank)
+    torch.manual_seed(SEED + rank)
+    random.seed(SEED + rank)
+
+    dl, train_dict, valid_dict = load_dataset(dataset_name, dtype)
+    config = load_config(cfg.MENSA_CONFIGS_DIR, f"{dataset_name.partition('_')[0]}.yaml")
+    model = MENSA(train_dict['X'].shape[1], layers=config['layers'], dropout_rate=config['dropout_rate'],
+                  n_events=dl.n_events, n_dists=config['n_dists'], device='cpu')
+    start_time = time.perf_counter()
+    history = model.fit(train_dict, valid_dict, learning_rate=config['lr'], n_epochs=config['n_epochs'],
+                        weight_decay=config['weight_decay'], patience=10,
+                        batch_size=config['batch_size'], data_parallel=True)
+    return {'train_time': time.perf_counter() - start_time,
+            'best_valid_loss': min(history['valid_loss'])}
+
+if __name__ == "__main__":
+    results = pd.DataFrame()
+    for dataset_name in DATASETS:
+        for world_size in WORLD_SIZES:
+            result = run_data_parallel(train_rank, world_size, dataset_name)
+            print(dataset_name, world_size, result)
+            res_sr = pd.Series([dataset_name, world_size, result['train_time'], result['best_valid_loss']],
+                               index=["DatasetName", "WorldSize", "TrainTime", "BestValidLoss"])
+            results = pd.concat([results, res_sr.to_frame().T], ignore_index=True)
+
+    filename = f"{cfg.RESULTS_DIR}/data_parallel_benchmark.csv"
+    results.to_csv(filename, index=False)
@@ -0,0 +1,121 @@
+"""
+benchmark_mensa_precision.py
+====================================
+Compares MENSA precision policies (float64, mixed, bfloat16) on the
+Rotterdam and synthetic multi-event datasets. Reports training time and
+the accuracy delta relative to the float64 baseline.
+"""
+
+# 3rd party
+import pandas as pd
+import numpy as np
+import sys, os
+sys.path.append(os.path.abspath('../'))
+
+import config as cfg
+import torch
+import random
+import time
+import warnings
+
+# Local
+from utility.survival import (make_time_bins, preprocess_data)
+from utility.config import load_config
+from utility.evaluation import global_C_index, MultiEventEvaluator
+from mensa.model import MENSA
+from data_loader import get_data_loader, MultiEventSyntheticDataLoader
+
+warnings.filterwarnings("ignore", message=".*The 'nopython' keyword.*")
+
+# Data is prepared in double precision, the policies decide what MENSA computes in
+dtype = torch.float64
+torch.set_default_dtype(dtype)
+
+# Setup device
+device = torch.device('cpu')
+
+SEED = 0
+DATASETS = ['rotterdam_me', 'synthetic_me']
+POLICIES = ['float64', 'mixed', 'bfloat16']
+
+def load_dataset(dataset_name):
+    if dataset_name == "synthetic_me":
+        data_config = load_config(cfg.DGP_CONFIGS_DIR, f"synthetic_me.yaml")
+        dl = MultiEventSyntheticDataLoader().load_data(data_config=data_config,
+                                                       linear=True, copula_names=None,
+                                                       k_taus=0, device=device, dtype=dtype)
+        train_dict, valid_dict, test_dict = dl.split_data(train_size=0.7, valid_size=0.1, test_size=0.2,
+                                                          random_state=SEED)
+        return dl, train_dict, valid_dict, test_dict
+
+    dl = get_data_loader(dataset_name)
+    dl = dl.load_data()
+    train_dict, valid_dict, test_dict = dl.split_data(train_size=0.7, valid_size=0.1, test_size=0.2,
+                                                      random_state=SEED)
+    X_train = pd.DataFrame(train_dict['X'], columns=dl.columns)
+    X_valid = pd.DataFrame(valid_dict['X'], columns=dl.columns)
+    X_test = pd.DataFrame(test_dict['X'], columns=dl.columns)
+    X_train, X_valid, X_test = preprocess_data(X_train, X_valid, X_test, dl.cat_features,
+                                               dl.num_features, as_array=True)
+    for data_dict, X in zip([train_dict, valid_dict, test_dict], [X_train, X_valid, X_test]):
+        data_dict['X'] = torch.tensor(X, device=device, dtype=dtype)
+        data_dict['E'] = torch.tensor(data_dict['E'], device=device, dtype=torch.int64)
+        data_dict['T'] = torch.tensor(data_dict['T'], device=device, dtype=torch.int64)
+    return dl, train_dict, valid_dict, test_dict
+
+if __name__ == "__main__":
+    results = pd.DataFrame()
+    for dataset_name in DATASETS:
+        dl, train_dict, valid_dict, test_dict = load_dataset(dataset_name)
+        n_events = dl.n_events
+        n_features = train_dict['X'].shape[1]
+        trajectories = getattr(dl, 'trajectories', [])
+
+        # Make time bins
+        time_bins = make_time_bins(train_dict['T'].cpu(), event=None, dtype=dtype).to(device)
+        time_bins = torch.cat((torch.tensor([0]).to(device), time_bins))
+
+        config = load_config(cfg.MENSA_CONFIGS_DIR, f"{dataset_name.partition('_')[0]}.yaml")
+        baseline_preds = None
+        for policy in POLICIES:
+            # Reset seeds
+            np.random.seed(SEED)
+            torch.manual_seed(SEED)
+            random.seed(SEED)
+
+            model = MENSA(n_features, layers=config['layers'], dropout_rate=config['dropout_rate'],
+                          n_events=n_events, n_dists=config['n_dists'], trajectories=trajectories,
+                          device=device, precision=policy)
+            start_time = time.perf_counter()
+            model.fit(dict(train_dict), dict(valid_dict), learning_rate=config['lr'],
+                      n_epochs=config['n_epochs'], weight_decay=config['weight_decay'],
+                      patience=10, batch_size=config['batch_size'], verbose=False)
+            train_time = time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            model_preds = model.predict_survival(test_dict['X'], time_bins)
+            predict_time = time.perf_counter() - start_time
+
+            # Accuracy delta relative to the double precision model
+            if baseline_preds is None:
+                baseline_preds = model_preds
+            max_abs_diff = np.max(np.abs(model_preds - baseline_preds))
+
+            all_preds = [model_preds[:, i] for i in range(n_events)]
+            global_ci = global_C_index(all_preds, test_dict['T'].cpu().numpy(),
+                                       test_dict['E'].cpu().numpy())
+
+            evaluator = MultiEventEvaluator(all_preds, time_bins.cpu().numpy(),
+                                            test_dict['T'].cpu().numpy(), test_dict['E'].cpu().numpy(),
+                                            train_dict['T'].cpu().numpy(), train_dict['E'].cpu().numpy())
+            event_metrics = evaluator.evaluate()[['CI', 'IBS']]
+            for event_id, (ci, ibs) in enumerate(event_metrics.to_numpy()):
+                metrics = [ci, ibs, global_ci, max_abs_diff, train_time, predict_time]
+                print(dataset_name, policy, event_id+1, metrics)
+                res_sr = pd.Series([dataset_name, policy, event_id+1] + metrics,
+                                   index=["DatasetName", "Precision", "EventId", "CI", "IBS", "GlobalCI",
+                                          "MaxAbsDiff", "TrainTime", "PredictTime"])
+                results = pd.concat([results, res_sr.to_frame().T], ignore_index=True)
+
+    filename = f"{cfg.RESULTS_DIR}/precision_benchmark.csv"
+    results.to_csv(filename, index=False)
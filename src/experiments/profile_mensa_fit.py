@@ -0,0 +1,92 @@
+"""
+profile_mensa_fit.py
+====================================
+Profiles MENSA.fit per dataset config, batch size and thread count.
+Writes the per-phase timing breakdown to results/profile_mensa_fit.csv
+and the per-step records of every run to results/profiles/.
+"""
+
+# 3rd party
+import pandas as pd
+import numpy as np
+import sys, os
+sys.path.append(os.path.abspath('../'))
+
+import config as cfg
+import torch
+import random
+import warnings
+
+# Local
+from utility.survival import preprocess_data
+from utility.config import load_config
+from mensa.model import MENSA
+from mensa.callbacks import ProfilerCallback
+from data_loader import get_data_loader
+
+warnings.filterwarnings("ignore", message=".*The 'nopython' keyword.*")
+
+# Setup precision
+dtype = torch.float64
+torch.set_default_dtype(dtype)
+
+# Setup device
+device = torch.device('cpu')
+
+SEED = 0
+N_EPOCHS = 5
+DATASETS = ['seer_se', 'mimic_cr', 'rotterdam_me', 'ebmt_me']
+BATCH_SIZES = [128, 1024, 4096]
+N_THREADS = [1, 4, 16]
+
+def load_dataset(dataset_name):
+    dl = get_data_loader(dataset_name)
+    dl = dl.load_data()
+    train_dict, valid_dict, test_dict = dl.split_data(train_size=0.7, valid_size=0.1, test_size=0.2,
+                                                      random_state=SEED)
+    X_train = pd.DataFrame(train_dict['X'], columns=dl.columns)
+    X_valid = pd.DataFrame(valid_dict['X'], columns=dl.columns)
+    X_test = pd.DataFrame(test_dict['X'], columns=dl.columns)
+    X_train, X_valid, X_test = preprocess_data(X_train, X_valid, X_test, dl.cat_features,
+                                               dl.num_features, as_array=True)
+    for data_dict, X in zip([train_dict, valid_dict], [X_train, X_valid]):
+        data_dict['X'] = torch.tensor(X, device=device, dtype=dtype)
+        data_dict['E'] = torch.tensor(data_dict['E'], device=device, dtype=torch.int64)
+        data_dict['T'] = torch.tensor(data_dict['T'], device=device, dtype=torch.int64)
+    return dl, train_dict, valid_dict
+
+if __name__ == "__main__":
+    os.makedirs(f"{cfg.RESULTS_DIR}/profiles", exist_ok=True)
+    results = pd.DataFrame()
+    for dataset_name in DATASETS:
+        dl, train_dict, valid_dict = load_dataset(dataset_name)
+        n_events = dl.n_events
+        n_features = train_dict['X'].shape[1]
+        trajectories = getattr(dl, 'trajectories', [])
+        config = load_config(cfg.MENSA_CONFIGS_DIR, f"{dataset_name.partition('_')[0]}.yaml")
+        for batch_size in BATCH_SIZES:
+            for n_threads in N_THREADS:
+                torch.set_num_threads(n_threads)
+                np.random.seed(SEED)
+                torch.manual_seed(SEED)
+                random.seed(SEED)
+
+                model = MENSA(n_features, layers=config['layers'], dropout_rate=config['dropout_rate'],
+                              n_events=n_events, n_dists=config['n_dists'], trajectories=trajectories,
+                              device=device)
+                profiler = ProfilerCallback()
+                model.fit(train_dict, valid_dict, learning_rate=config['lr'], n_epochs=N_EPOCHS,
+                          weight_decay=config['weight_decay'], batch_size=batch_size,
+                          callbacks=[profiler])
+                profiler.to_json(f"{cfg.RESULTS_DIR}/profiles/{dataset_name}_{batch_size}_{n_threads}.json")
+
+                for phase, stats in profiler.summary().items():
+                    res_sr = pd.Series([dataset_name, batch_size, n_threads, phase, stats['total'],
+                                        stats['mean'], stats['fraction'], profiler.peak_memory_mb],
+                                       index=["DatasetName", "BatchSize", "NThreads", "Phase", "TotalTime",
+                                              "MeanTime", "Fraction", "PeakMemoryMB"])
+                    results = pd.concat([results, res_sr.to_frame().T], ignore_index=True)
+                print(dataset_name, batch_size, n_threads, profiler.summary())
+
+    filename = f"{cfg.RESULTS_DIR}/profile_mensa_fit.csv"
+    results.to_csv(filename, index=False)
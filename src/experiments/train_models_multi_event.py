@@ -17,7 +17,6 @@ import warnings
 import argparse
 import os
 from scipy.interpolate import interp1d
-from SurvivalEVAL.Evaluator import LifelinesEvaluator
 
 # Local
 from utility.mtlr import make_mtlr_prediction, mtlr, train_mtlr_model
@@ -25,7 +24,7 @@ from utility.survival import (convert_to_structured, make_time_bins, preprocess_
 from utility.data import dotdict, format_data_deephit_multi, format_data_deephit_single
 from utility.config import load_config
 from utility.data import calculate_layer_size_hierarch
-from utility.evaluation import global_C_index, local_C_index
+from utility.evaluation import global_C_index, local_C_index, MultiEventEvaluator
 from mensa.model import MENSA
 
 # SOTA
@@ -271,10 +270,9 @@ if __name__ == "__main__":
                     all_preds.append(preds)
             elif model_name == "mensa":
                 all_preds = []
+                model_preds = model.predict_survival(test_dict['X'].to(device), time_bins)
                 for i in range(n_events):
-                    model_preds = model.predict(test_dict['X'].to(device), time_bins, risk=i+1)
-                    model_preds = pd.DataFrame(model_preds, columns=time_bins.cpu().numpy())
-                    all_preds.append(model_preds)
+                    all_preds.append(pd.DataFrame(model_preds[:, i], columns=time_bins.cpu().numpy()))
             else:
                 raise NotImplementedError()
             
@@ -289,26 +287,13 @@ if __name__ == "__main__":
             global_ci = 0.5 if np.isnan(global_ci) or np.isinf(global_ci) else global_ci
             local_ci = 0.5 if np.isnan(local_ci) or np.isinf(local_ci) else local_ci
             
-            # Make evaluation for each event
+            # Make evaluation for all events in one pass
+            evaluator = MultiEventEvaluator(all_preds_arr, all_preds[0].columns.to_numpy(dtype=float),
+                                            y_test_time, y_test_event, train_dict['T'].cpu().numpy(),
+                                            train_dict['E'].cpu().numpy())
+            event_metrics = evaluator.evaluate()
             model_results = pd.DataFrame()
-            for event_id, surv_pred in enumerate(all_preds):
-                n_train_samples = len(train_dict['X'])
-                n_test_samples= len(test_dict['X'])
-                y_train_time = train_dict['T'][:,event_id]
-                y_train_event = train_dict['E'][:,event_id]
-                y_test_time = test_dict['T'][:,event_id]
-                y_test_event = test_dict['E'][:,event_id]
-                
-                lifelines_eval = LifelinesEvaluator(surv_pred.T, y_test_time, y_test_event,
-                                                    y_train_time, y_train_event)
-                
-                ci = lifelines_eval.concordance()[0]
-                ibs = lifelines_eval.integrated_brier_score()
-                mae_hinge = lifelines_eval.mae(method="Hinge")
-                mae_margin = lifelines_eval.mae(method="Margin")
-                mae_pseudo = lifelines_eval.mae(method="Pseudo_obs")
-                d_calib = lifelines_eval.d_calibration()[0]
-                
+            for event_id, (ci, ibs, mae_hinge, mae_margin, mae_pseudo, d_calib) in enumerate(event_metrics.to_numpy()):
                 metrics = [ci, ibs, mae_hinge, mae_margin, mae_pseudo, d_calib, global_ci, local_ci]
                 print(metrics)
                 res_sr = pd.Series([model_name, dataset_name, seed, event_id+1] + metrics,
@@ -16,7 +16,6 @@ import warnings
 import argparse
 import os
 from scipy.interpolate import interp1d
-from SurvivalEVAL.Evaluator import LifelinesEvaluator
 
 # Local
 from utility.survival import (make_time_bins, preprocess_data, convert_to_structured)
@@ -24,6 +23,7 @@ from utility.data import dotdict
 from utility.config import load_config
 from mensa.model import MENSA
 from utility.data import format_data_deephit_single
+from utility.evaluation import MultiEventEvaluator
 from data_loader import get_data_loader
 
 # SOTA
@@ -210,19 +210,10 @@ if __name__ == "__main__":
         model_results = pd.DataFrame()
         surv_preds = pd.DataFrame(model_preds, columns=time_bins.cpu().numpy())
         
-        y_train_time = train_dict['T']
-        y_train_event = (train_dict['E'])*1.0
-        y_test_time = test_dict['T']
-        y_test_event = (test_dict['E'])*1.0
-        lifelines_eval = LifelinesEvaluator(surv_preds.T, y_test_time, y_test_event,
-                                            y_train_time, y_train_event)
-        
-        ci = lifelines_eval.concordance()[0]
-        ibs = lifelines_eval.integrated_brier_score()
-        mae_hinge = lifelines_eval.mae(method="Hinge")
-        mae_margin = lifelines_eval.mae(method="Margin")
-        mae_pseudo = lifelines_eval.mae(method="Pseudo_obs")
-        d_calib = lifelines_eval.d_calibration()[0]
+        evaluator = MultiEventEvaluator([surv_preds.to_numpy()], surv_preds.columns.to_numpy(dtype=float),
+                                        test_dict['T'].cpu().numpy(), test_dict['E'].cpu().numpy(),
+                                        train_dict['T'].cpu().numpy(), train_dict['E'].cpu().numpy())
+        ci, ibs, mae_hinge, mae_margin, mae_pseudo, d_calib = evaluator.evaluate().to_numpy()[0]
         
         metrics = [ci, ibs, mae_hinge, mae_margin, mae_pseudo, d_calib]
         print(f'{model_name}: ' + f'{metrics}')
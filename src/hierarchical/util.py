@@ -8,7 +8,6 @@ import matplotlib.pyplot as plt
 import matplotlib
 
 from sklearn.model_selection import KFold
-from sklearn.utils import resample
 from sklearn.metrics import roc_auc_score
 
 import torch
@@ -19,6 +18,7 @@ from hierarchical import preprocess
 from hierarchical import simulation
 from hierarchical import hierarch
 from hierarchical import direct
+from utility import bootstrap
 
 
 ###################################################################################################
@@ -407,26 +407,15 @@ def produce_sim(test_package, settings):
     #return 1
 
 
-def bootstrap_results(mod_out, times, labs, num_events, num_bin, num_extra_bin, term_events, event_ranks, num_boots=1000):
-    c_glob = np.zeros((num_boots, num_events + 1))
-    prop_glob = np.zeros((num_boots, num_events + 1))
-    
-    prop_loc = np.zeros((num_boots,))
-    
+def bootstrap_results(mod_out, times, labs, num_events, num_bin, num_extra_bin, term_events, event_ranks, num_boots=1000,
+                      n_workers=None, seed=0):
+    data = {'mod_out': mod_out, 'event_times': times, 'labs': labs, 'num_bins': num_bin, 'num_extra_bin': num_extra_bin}
     traj_labs = preprocess.get_trajectory_labels(labs)
-    num_data = mod_out[0].shape[0]
-    for i in range(num_boots):
-        if i % 20 == 0:
-            print(i)
-        boot_ind = resample(np.arange(num_data), n_samples=num_data, replace=True, stratify=traj_labs)
-        mod_out_boot = [mod_out[j][boot_ind, :] for j in range(num_events)]
-        boot_times = times[boot_ind, :]
-        boot_labs = labs[boot_ind, :]
-        results = eval_overall(mod_out_boot, boot_times, boot_labs, num_events, num_bin, num_extra_bin, term_events, event_ranks)
-        
-        c_glob[i, :] = results['C index']
-        prop_glob[i, :] = results['Proposed']
-        prop_loc[i] = results['Local proposed']
+    _, _, replicates = bootstrap.bootstrap_replicates(data, ['C index', 'Proposed', 'Local proposed'], num_boots,
+                                                      strata=traj_labs, n_workers=n_workers, seed=seed)
+    c_glob = replicates[:, :num_events + 1]
+    prop_glob = replicates[:, num_events + 1:2 * (num_events + 1)]
+    prop_loc = replicates[:, -1]
     
     print('C index: ', np.percentile(c_glob, [2.5, 50, 97.5], axis=0), np.average(c_glob, axis=0))
     print('Proposed: ', np.percentile(prop_glob, [2.5, 50, 97.5], axis=0), np.average(prop_glob, axis=0))
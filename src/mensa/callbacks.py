@@ -0,0 +1,151 @@
+import csv
+import json
+import time
+import resource
+import torch
+
+class Callback:
+    """
+    Base class for MENSA.fit hooks. Subclasses override the events they need,
+    step counts optimizer steps over the whole run.
+    on_validation_end may return True to stop training.
+    """
+    def on_train_begin(self, model):
+        pass
+
+    def on_epoch_start(self, model, epoch):
+        pass
+
+    def on_batch_start(self, model, step):
+        pass
+
+    def on_forward_end(self, model, step):
+        pass
+
+    def on_loss_end(self, model, step, loss):
+        pass
+
+    def on_backward_end(self, model, step):
+        pass
+
+    def on_batch_end(self, model, step, loss):
+        pass
+
+    def on_epoch_end(self, model, epoch):
+        pass
+
+    def on_validation_start(self, model, epoch):
+        pass
+
+    def on_validation_end(self, model, epoch, valid_loss):
+        return False
+
+    def on_train_end(self, model, history):
+        pass
+
+class CallbackList:
+    """
+    Dispatches every event to a list of callbacks.
+    """
+    def __init__(self, callbacks=None):
+        self.callbacks = list(callbacks) if callbacks is not None else []
+
+    def __bool__(self):
+        return len(self.callbacks) > 0
+
+    def fire(self, event, *args):
+        stop = False
+        for callback in self.callbacks:
+            stop = bool(getattr(callback, event)(*args)) or stop
+        return stop
+
+class ProfilerCallback(Callback):
+    """
+    Records the wall time of data fetch, forward pass, loss (the Weibull mixture risks
+    and the trajectory penalty), backward pass, optimizer step and validation, plus the
+    peak memory. On GPU the device is synchronized at every boundary, so the timings
+    are exact but training runs slower while profiling.
+    """
+    PHASES = ['data', 'forward', 'loss', 'backward', 'optimizer', 'validation']
+
+    def __init__(self):
+        self.records = []
+        self.peak_memory_mb = None
+        self._epoch = 0
+        self._last = None
+        self._cuda = False
+
+    def _now(self):
+        if self._cuda:
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def _record(self, phase, step):
+        now = self._now()
+        self.records.append({'epoch': self._epoch, 'step': step, 'phase': phase,
+                             'time': now - self._last})
+        self._last = now
+
+    def on_train_begin(self, model):
+        self._cuda = torch.device(model.device).type == 'cuda'
+        if self._cuda:
+            torch.cuda.reset_peak_memory_stats()
+
+    def on_epoch_start(self, model, epoch):
+        self._epoch = epoch
+        self._last = self._now()
+
+    def on_batch_start(self, model, step):
+        self._record('data', step)
+
+    def on_forward_end(self, model, step):
+        self._record('forward', step)
+
+    def on_loss_end(self, model, step, loss):
+        self._record('loss', step)
+
+    def on_backward_end(self, model, step):
+        self._record('backward', step)
+
+    def on_batch_end(self, model, step, loss):
+        self._record('optimizer', step)
+
+    def on_validation_start(self, model, epoch):
+        self._last = self._now()
+
+    def on_validation_end(self, model, epoch, valid_loss):
+        self._record('validation', None)
+        return False
+
+    def on_train_end(self, model, history):
+        if self._cuda:
+            self.peak_memory_mb = torch.cuda.max_memory_allocated() / 2**20
+        else:
+            # ru_maxrss is the peak resident set size of the process in KB on Linux
+            self.peak_memory_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+    def summary(self):
+        """
+        Returns the total, mean and share of the wall time per phase.
+        """
+        totals = {phase: 0.0 for phase in self.PHASES}
+        counts = {phase: 0 for phase in self.PHASES}
+        for record in self.records:
+            totals[record['phase']] += record['time']
+            counts[record['phase']] += 1
+        total_time = sum(totals.values())
+        return {phase: {'total': totals[phase], 'count': counts[phase],
+                        'mean': totals[phase] / max(counts[phase], 1),
+                        'fraction': totals[phase] / total_time if total_time > 0 else 0.0}
+                for phase in self.PHASES}
+
+    def to_json(self, path):
+        with open(path, 'w') as f:
+            json.dump({'summary': self.summary(), 'peak_memory_mb': self.peak_memory_mb,
+                       'records': self.records}, f, indent=2)
+
+    def to_csv(self, path):
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=['epoch', 'step', 'phase', 'time'])
+            writer.writeheader()
+            writer.writerows(self.records)
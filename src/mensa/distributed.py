@@ -0,0 +1,94 @@
+import os
+import socket
+import tempfile
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+def get_world():
+    """
+    Returns (rank, world_size) of the initialized process group.
+    """
+    if not (dist.is_available() and dist.is_initialized()):
+        raise RuntimeError("Data-parallel training needs an initialized process group, "
+                           "e.g., start it with run_data_parallel()")
+    return dist.get_rank(), dist.get_world_size()
+
+def shard_tensors(tensors, rank, world_size):
+    """
+    Returns the rank's contiguous shard of the tensors. All shards have the same size,
+    so every rank runs the same number of batches, the last n % world_size rows are dropped.
+    """
+    n_shard = tensors[0].shape[0] // world_size
+    return [t[rank * n_shard:(rank + 1) * n_shard] for t in tensors]
+
+def broadcast_module(module, src=0):
+    # Start all ranks from the weights of rank 0
+    for tensor in module.state_dict().values():
+        dist.broadcast(tensor, src)
+
+def all_reduce_gradients(module, world_size):
+    """
+    Averages the gradients over all ranks with one all-reduce on a flat buffer.
+    Frozen parameters have no gradients and are skipped.
+    """
+    grads = [p.grad for p in module.parameters() if p.grad is not None]
+    if len(grads) == 0:
+        return
+    flat = torch.cat([g.reshape(-1) for g in grads])
+    dist.all_reduce(flat)
+    flat /= world_size
+    offset = 0
+    for g in grads:
+        g.copy_(flat[offset:offset + g.numel()].view_as(g))
+        offset += g.numel()
+
+def average_buffers(module, world_size):
+    # Averages the BatchNorm running statistics, which are updated per rank
+    for tensor in module.buffers():
+        if tensor.is_floating_point():
+            dist.all_reduce(tensor)
+            tensor /= world_size
+
+def all_reduce_mean(tensor, world_size):
+    dist.all_reduce(tensor)
+    return tensor / world_size
+
+def any_rank(flag):
+    """
+    Returns True on all ranks if flag is True on any rank, so stopping decisions agree.
+    """
+    flag = torch.tensor(float(flag))
+    dist.all_reduce(flag, op=dist.ReduceOp.MAX)
+    return bool(flag.item() > 0)
+
+def _find_free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+def _worker(rank, world_size, port, threads_per_rank, fn, args, result_path):
+    os.environ['MASTER_ADDR'] = 'localhost'
+    os.environ['MASTER_PORT'] = str(port)
+    torch.set_num_threads(threads_per_rank)
+    dist.init_process_group('gloo', rank=rank, world_size=world_size)
+    try:
+        result = fn(rank, world_size, *args)
+        if rank == 0:
+            torch.save(result, result_path)
+    finally:
+        dist.destroy_process_group()
+
+def run_data_parallel(fn, world_size, *args, threads_per_rank=1):
+    """
+    Runs fn(rank, world_size, *args) in world_size local processes joined by a gloo
+    process group and returns the result of rank 0. fn must be importable (defined
+    at module level) and typically builds a MENSA model and calls
+    fit(..., data_parallel=True). The result must be picklable, e.g., the history
+    or the model's state_dict, it is passed through torch.save.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        result_path = os.path.join(tmp_dir, 'result.pt')
+        mp.spawn(_worker, args=(world_size, _find_free_port(), threads_per_rank, fn, args, result_path),
+                 nprocs=world_size, join=True)
+        return torch.load(result_path)
@@ -0,0 +1,235 @@
+import torch
+import torch.nn as nn
+import numpy as np
+import math
+
+from tqdm import trange
+
+from mensa.model import add_transient_state, create_grouped_representation, GroupedLinear
+from mensa.loss import weibull_mixture_log_risks, trajectory_penalty
+from mensa.utility import weibull_mixture_log_survival
+
+class EnsembleMLP(torch.nn.Module):
+    """
+    E independent replicas of the MENSA MLP with stacked parameters, so all
+    members run in the same batched matmuls.
+    n_members: number of ensemble members (E).
+    Other arguments are the same as for MLP.
+    """
+    def __init__(self, n_members, input_dim, n_dists, layers, dropout_rate,
+                 temp, n_states):
+        super(EnsembleMLP, self).__init__()
+
+        self.n_members = n_members
+        self.n_dists = n_dists
+        self.temp = float(temp)
+        self.n_states = n_states
+
+        if layers is None: layers = []
+        self.layers = layers
+
+        if len(layers) == 0: lastdim = input_dim
+        else: lastdim = layers[-1]
+
+        self.act = nn.SELU()
+        self.shape = nn.Parameter(-torch.ones(n_members, 1, self.n_dists * n_states))
+        self.scale = nn.Parameter(-torch.ones(n_members, 1, self.n_dists * n_states))
+
+        self.gate = GroupedLinear(n_members, lastdim, self.n_dists * self.n_states, bias=False)
+        self.scaleg = GroupedLinear(n_members, lastdim, self.n_dists * self.n_states, bias=True)
+        self.shapeg = GroupedLinear(n_members, lastdim, self.n_dists * self.n_states, bias=True)
+
+        self.embedding = create_grouped_representation(n_members, input_dim, layers, dropout_rate, 'ReLU6')
+
+    def forward_stacked(self, x):
+        """
+        x: (N, n_features) shared by all members or (E, N, n_features).
+        Returns the shape, scale and gate parameters as tensors of size (E, N, n_states, n_dists).
+        """
+        dim = x.shape[-2]
+        xrep = self.embedding(x)
+        shape = torch.clamp(self.act(self.shapeg(xrep)) + self.shape, min=-10, max=10)
+        scale = torch.clamp(self.act(self.scaleg(xrep)) + self.scale, min=-10, max=10)
+        gate = self.gate(xrep) / self.temp
+        return (shape.view(self.n_members, dim, self.n_states, self.n_dists),
+                scale.view(self.n_members, dim, self.n_states, self.n_dists),
+                gate.view(self.n_members, dim, self.n_states, self.n_dists))
+
+class MENSAEnsemble:
+    """
+    Trains E independently initialized MENSA models in lockstep, e.g., to replace
+    a sequential loop over seeds. Each member has its own early stopping and
+    best-state snapshot.
+    n_members: number of ensemble members (E).
+    shuffle: 'independent' draws a different batch permutation per member,
+    'shared' feeds all members the same batches.
+    Other arguments are the same as for MENSA.
+    """
+    def __init__(self, n_features, n_events, n_members=5, n_dists=5,
+                 layers=[32, 32], dropout_rate=0.5, trajectories=[],
+                 shuffle='independent', device='cpu'):
+        if shuffle not in ['independent', 'shared']:
+            raise ValueError(f"Unknown shuffle mode: {shuffle}")
+        self.n_features = n_features
+        self.n_events = n_events
+        self.n_states = n_events + 1 # K + 1 states
+        self.n_members = n_members
+        self.device = device
+        self.shuffle = shuffle
+        self.trajectories = trajectories
+
+        self.model = EnsembleMLP(n_members, n_features, n_dists, layers, dropout_rate,
+                                 temp=1000, n_states=self.n_states)
+
+    def get_model(self):
+        return self.model
+
+    def compute_loss(self, xi, ti, ei, multi_event):
+        """
+        Returns the loss of every member as a tensor of size (E,).
+        xi, ti, ei have a leading member dimension (E, N, ...).
+        """
+        shape, scale, gate = self.model.forward_stacked(xi) # run forward pass
+        n_members, n_samples = shape.shape[0], shape.shape[1]
+        f, s = weibull_mixture_log_risks(shape.flatten(0, 1), scale.flatten(0, 1),
+                                         gate.flatten(0, 1), ti.flatten(0, 1))
+        f = f.view(n_members, n_samples, -1)
+        s = s.view(n_members, n_samples, -1)
+        if multi_event:
+            mask = (ei == 1)
+        else:
+            mask = (ei.unsqueeze(2) == torch.arange(self.n_states, device=ei.device))
+        loss = -torch.sum(torch.where(mask, f, s), dim=(1, 2)) / n_samples
+
+        if multi_event and len(self.trajectories) > 0:
+            trajectories = torch.tensor(self.trajectories, dtype=torch.long, device=shape.device).reshape(-1, 2)
+            penalty = trajectory_penalty(shape.flatten(0, 1), scale.flatten(0, 1), gate.flatten(0, 1),
+                                         ti.flatten(0, 1), ei.flatten(0, 1), trajectories)
+            loss = loss + torch.sum(penalty.view(n_members, n_samples), dim=1) / n_samples
+        return loss
+
+    def fit(self, train_dict, valid_dict, batch_size=1024, n_epochs=20000,
+            patience=100, optimizer='adam', weight_decay=0.001, learning_rate=5e-4,
+            betas=(0.9, 0.999), verbose=False):
+        """
+        Trains all members together. Adam/AdamW are element-wise, so optimizing
+        the summed member losses is equivalent to optimizing each member alone.
+        Returns the history of per-member train and validation losses.
+        """
+        optim_dict = [{'params': self.model.parameters(), 'lr': learning_rate}]
+
+        if optimizer == 'adam':
+            optimizer = torch.optim.Adam(optim_dict, betas=betas, weight_decay=weight_decay)
+        elif optimizer == 'adamw':
+            optimizer = torch.optim.AdamW(optim_dict, betas=betas, weight_decay=weight_decay)
+
+        multi_event = True if train_dict['T'].ndim > 1 else False
+
+        # Added transient state for multi-event scenarios
+        if multi_event:
+            train_dict = add_transient_state(dict(train_dict))
+            valid_dict = add_transient_state(dict(valid_dict))
+
+        train_data = [train_dict['X'].to(self.device), train_dict['T'].to(self.device),
+                      train_dict['E'].to(self.device)]
+        valid_data = [valid_dict['X'].to(self.device), valid_dict['T'].to(self.device),
+                      valid_dict['E'].to(self.device)]
+        n_train = train_data[0].shape[0]
+        n_valid = valid_data[0].shape[0]
+        n_train_batches = math.ceil(n_train / batch_size)
+        n_valid_batches = math.ceil(n_valid / batch_size)
+
+        self.model.to(self.device)
+        min_delta = 0.001
+        best_valid_loss = torch.full((self.n_members,), float('inf'), device=self.device)
+        epochs_no_improve = torch.zeros(self.n_members, dtype=torch.long, device=self.device)
+        best_state = {k: v.detach().clone() for k, v in self.model.state_dict().items()}
+        history = {'train_loss': [], 'valid_loss': []}
+
+        pbar = trange(n_epochs, disable=not verbose)
+
+        for itr in pbar:
+            self.model.train()
+            total_train_loss = torch.zeros(self.n_members, device=self.device)
+
+            if self.shuffle == 'independent':
+                perms = torch.stack([torch.randperm(n_train, device=self.device)
+                                     for _ in range(self.n_members)])
+            else:
+                perms = torch.randperm(n_train, device=self.device).expand(self.n_members, -1)
+
+            # Training step
+            for i in range(0, n_train, batch_size):
+                idx = perms[:, i:i+batch_size]
+                xi, ti, ei = (t[idx] for t in train_data)
+                optimizer.zero_grad()
+
+                loss = self.compute_loss(xi, ti, ei, multi_event)
+                loss.sum().backward()
+                optimizer.step()
+
+                total_train_loss += loss.detach()
+
+            # Validation step
+            self.model.eval()
+            total_valid_loss = torch.zeros(self.n_members, device=self.device)
+
+            with torch.no_grad():
+                for i in range(0, n_valid, batch_size):
+                    xi, ti, ei = (t[i:i+batch_size] for t in valid_data)
+                    ti = ti.unsqueeze(0).expand(self.n_members, *ti.shape)
+                    ei = ei.unsqueeze(0).expand(self.n_members, *ei.shape)
+                    total_valid_loss += self.compute_loss(xi, ti, ei, multi_event)
+
+            avg_train_loss = total_train_loss / n_train_batches
+            avg_valid_loss = total_valid_loss / n_valid_batches
+
+            # Check for early stopping per member
+            improved = avg_valid_loss < best_valid_loss - min_delta
+            best_valid_loss = torch.where(improved, avg_valid_loss, best_valid_loss)
+            epochs_no_improve = torch.where(improved, torch.zeros_like(epochs_no_improve), epochs_no_improve + 1)
+            for k, v in self.model.state_dict().items():
+                best_state[k][improved] = v[improved]
+
+            # Sync with the device once per epoch
+            history['train_loss'].append(avg_train_loss.cpu().tolist())
+            history['valid_loss'].append(avg_valid_loss.cpu().tolist())
+            pbar.set_description(f"[Epoch {itr+1:4}/{n_epochs}]")
+            pbar.set_postfix_str(f"Training loss = {np.mean(history['train_loss'][-1]):.4f}, "
+                                 f"Validation loss = {np.mean(history['valid_loss'][-1]):.4f}")
+
+            if bool((epochs_no_improve >= patience).all()):
+                print(f"Early stopping at iteration {itr}, best valid losses: {best_valid_loss.cpu().tolist()}")
+                break
+
+        self.model.load_state_dict(best_state)
+        self.model.eval()
+        return history
+
+    def predict_survival(self, x_test, time_bins, risks=None, reduce='mean', as_numpy=True):
+        """
+        Predicts the survival curves of all members.
+        reduce: 'mean' averages the members to (N, len(risks), len(time_bins)),
+        None returns the per-member curves (E, N, len(risks), len(time_bins)).
+        """
+        if risks is None:
+            risks = list(range(1, self.n_states))
+
+        self.model.eval()
+        with torch.no_grad():
+            shape, scale, gate = self.model.forward_stacked(x_test.to(self.device))
+            idx = torch.as_tensor(risks, dtype=torch.long, device=shape.device)
+            shape, scale, gate = shape[:, :, idx], scale[:, :, idx], gate[:, :, idx]
+            n_members, n_samples = shape.shape[0], shape.shape[1]
+            t = torch.as_tensor(time_bins, device=shape.device)
+            log_s = weibull_mixture_log_survival(shape.flatten(0, 1), scale.flatten(0, 1),
+                                                 gate.flatten(0, 1), t)
+            curves = torch.exp(log_s).view(n_members, n_samples, len(risks), -1)
+            if reduce == 'mean':
+                curves = curves.mean(dim=0)
+            elif reduce is not None:
+                raise ValueError(f"Unknown reduce: {reduce}")
+
+        if as_numpy:
+            return curves.cpu().numpy()
+        return curves
@@ -1,23 +1,92 @@
 import torch
 import itertools
+from typing import Optional
 
 def safe_log(x):
     return torch.log(x+1e-6*(x<1e-6))
 
+def _mixture_log_risks(shape, scale, rate, k, log_gate, t):
+    if t.dim() == 1:
+        t = t.unsqueeze(1)
+    t = t.unsqueeze(2).to(shape.dtype)
+    s = -torch.pow(rate*t, k)
+    f = shape + scale + (k-1)*(scale+safe_log(t)) + s
+    f = torch.logsumexp(f + log_gate, dim=2)
+    s = torch.logsumexp(s + log_gate, dim=2)
+    return f, s
+
+def _trajectory_penalty(rate, k, log_gate, t, e, trajectories):
+    i_idx = trajectories[:, 0]
+    j_idx = trajectories[:, 1]
+    t_j = t[:, j_idx].unsqueeze(2).to(rate.dtype) # (N, P, 1)
+    s = -torch.pow(rate[:, i_idx]*t_j, k[:, i_idx])
+    s = torch.logsumexp(s + log_gate[:, i_idx], dim=2) # log S_i(T_j)
+    condition = torch.logical_and(e[:, i_idx] == 1, e[:, j_idx] == 1)
+    return -torch.sum(condition*s, dim=1)
+
+def weibull_mixture_log_risks(shape, scale, gate, t):
+    """
+    Log-density and log-survival of the Weibull mixtures for all states at once.
+    shape, scale, gate: (N, n_states, n_dists) parameters from MLP.forward_stacked.
+    t: (N,) time shared by all states, or (N, n_states) time per state.
+    Returns f, s with shape (N, n_states).
+    """
+    log_gate = torch.log_softmax(gate, dim=2)
+    return _mixture_log_risks(shape, scale, torch.exp(scale), torch.exp(shape), log_gate, t)
+
+def trajectory_penalty(shape, scale, gate, t, e, trajectories):
+    """
+    Trajectory-ordering penalty for all (i, j) pairs in one pass, where j happens
+    before i: -log S_i(T_j) for samples that experienced both events.
+    trajectories: (P, 2) long tensor of (i, j) state pairs.
+    Returns the per-sample penalty summed over pairs, shape (N,).
+    """
+    log_gate = torch.log_softmax(gate, dim=2)
+    return _trajectory_penalty(torch.exp(scale), torch.exp(shape), log_gate, t, e, trajectories)
+
+def weibull_mixture_loss(shape, scale, gate, t, e, multi_event: bool,
+                         trajectories: Optional[torch.Tensor] = None):
+    """
+    Fused likelihood kernel: computes the mixture log-density and log-survival
+    for all states and reduces them to the masked negative log-likelihood.
+    If trajectories is given, the trajectory penalty is added, reusing the
+    mixture log-probabilities of the likelihood.
+    """
+    log_gate = torch.log_softmax(gate, dim=2)
+    rate = torch.exp(scale)
+    k = torch.exp(shape)
+    f, s = _mixture_log_risks(shape, scale, rate, k, log_gate, t)
+    if multi_event:
+        loss = conditional_weibull_loss_multi(f, s, e, f.shape[1])
+        if trajectories is not None:
+            loss = loss + torch.sum(_trajectory_penalty(rate, k, log_gate, t, e, trajectories)) / e.shape[0]
+        return loss
+    return conditional_weibull_loss(f, s, e, f.shape[1])
+
+def compile_kernel(fn, mode=None):
+    """
+    Optionally compiles a loss kernel, mode is None, 'script' (TorchScript) or 'compile' (torch.compile).
+    """
+    if mode is None:
+        return fn
+    elif mode == 'script':
+        return torch.jit.script(fn)
+    elif mode == 'compile':
+        if not hasattr(torch, 'compile'):
+            raise ValueError("torch.compile requires PyTorch 2.0 or later")
+        return torch.compile(fn)
+    else:
+        raise ValueError(f"Unknown compile mode: {mode}")
+
 def conditional_weibull_loss_multi(f, s, e, n_risks: int):
-    loss = 0.0
-    for k in range(n_risks):
-        temp = (e[:, k] == 1)
-        loss += torch.sum(temp*f[:, k].T)
-        loss += torch.sum(~temp*s[:, k].T)
+    mask = (e[:, :n_risks] == 1)
+    loss = torch.sum(torch.where(mask, f[:, :n_risks], s[:, :n_risks]))
     loss = -loss / e.shape[0]
     return loss
 
-def conditional_weibull_loss(f, s, e, n_risks: int):    
-    loss = 0.0
-    for k in range(n_risks):
-        temp = (e == k)
-        loss += torch.sum(temp*f[:, k].T)
-        loss += torch.sum(~temp*s[:, k].T)        
+def conditional_weibull_loss(f, s, e, n_risks: int):
+    states = torch.arange(n_risks, device=e.device)
+    mask = (e.reshape(-1, 1) == states)
+    loss = torch.sum(torch.where(mask, f[:, :n_risks], s[:, :n_risks]))
     loss = -loss / e.shape[0]
-    return loss
\ No newline at end of file
+    return loss
@@ -1,33 +1,48 @@
 import torch
 import torch.nn as nn
-from torch.utils.data import DataLoader, TensorDataset
 
-import wandb
 import numpy as np
+import os
+import time
+import math
 
-from tqdm import trange
+from tqdm import trange, tqdm
 
-from mensa.loss import conditional_weibull_loss, conditional_weibull_loss_multi, safe_log
+from mensa.loss import (conditional_weibull_loss, conditional_weibull_loss_multi, safe_log,
+                        weibull_mixture_log_risks, weibull_mixture_loss, trajectory_penalty,
+                        compile_kernel)
+from mensa.callbacks import CallbackList
+from mensa import distributed
+from mensa.streaming import StreamingSource
+from mensa.utility import (PrecisionPolicy, weibull_mixture_log_survival, weibull_mixture_log_density, iterate_chunks, iterate_batches,
+                           weibull_mixture_quantiles, weibull_mixture_rmst)
 
 def add_transient_state(data_dict):
+    data_dict['T'], data_dict['E'] = transient_state(data_dict['T'], data_dict['E'])
+    return data_dict
+
+def transient_state(T, E):
+    """
+    Prepends the transient state (state 0) to T and E, works on any batch of rows.
+    """
     # Modify 'E': Add 1 if all columns are 0, else 0
-    condition_e = (data_dict['E'] == 0).all(dim=1).unsqueeze(1)
+    condition_e = (E == 0).all(dim=1).unsqueeze(1)
     new_column_e = condition_e.long()
-    data_dict['E'] = torch.cat([new_column_e, data_dict['E']], dim=1)
+    E = torch.cat([new_column_e, E], dim=1)
     
     # Modify 'T': Add the maximum or minimum value based on 'E'
-    max_values = data_dict['T'].max(dim=1, keepdim=True).values
+    max_values = T.max(dim=1, keepdim=True).values
     
     # If all 'E' columns are 0, take the maximum; otherwise, take the minimum of active events
     new_column_t = torch.where(
         condition_e,  # Condition: all 'E' columns are 0
         max_values,   # If true, take maximum
-        torch.where(data_dict['E'][:, 1:] == 1, data_dict['T'], float('inf')).min(dim=1, keepdim=True).values
+        torch.where(E[:, 1:] == 1, T, float('inf')).min(dim=1, keepdim=True).values
     )
     
-    data_dict['T'] = torch.cat([new_column_t, data_dict['T']], dim=1)
+    T = torch.cat([new_column_t, T], dim=1)
     
-    return data_dict
+    return T, E
 
 def create_representation(input_dim, layers, dropout_rate, activation, bias=True):
     if activation == 'ReLU6':
@@ -51,6 +66,81 @@ def create_representation(input_dim, layers, dropout_rate, activation, bias=True
 
     return nn.Sequential(*modules)
 
+class GroupedLinear(nn.Module):
+    """
+    G independent linear layers applied as one batched matmul.
+    Input (G, N, in_features) or (N, in_features) shared by all groups, output (G, N, out_features).
+    """
+    def __init__(self, n_groups, in_features, out_features, bias=True):
+        super(GroupedLinear, self).__init__()
+        self.n_groups = n_groups
+        bound = 1 / math.sqrt(in_features) if in_features > 0 else 0
+        self.weight = nn.Parameter(torch.empty(n_groups, in_features, out_features).uniform_(-bound, bound))
+        if bias:
+            self.bias = nn.Parameter(torch.empty(n_groups, 1, out_features).uniform_(-bound, bound))
+        else:
+            self.register_parameter('bias', None)
+
+    def forward(self, x):
+        if x.dim() == 2:
+            out = torch.einsum('ni,gio->gno', x, self.weight)
+        else:
+            out = torch.bmm(x, self.weight)
+        if self.bias is not None:
+            out = out + self.bias
+        return out
+
+class GroupedBatchNorm(nn.Module):
+    """
+    Batch normalization with separate statistics and affine parameters per group.
+    Input and output (G, N, n_features), same semantics as nn.BatchNorm1d per group.
+    """
+    def __init__(self, n_groups, n_features, eps=1e-5, momentum=0.1):
+        super(GroupedBatchNorm, self).__init__()
+        self.eps = eps
+        self.momentum = momentum
+        self.weight = nn.Parameter(torch.ones(n_groups, 1, n_features))
+        self.bias = nn.Parameter(torch.zeros(n_groups, 1, n_features))
+        self.register_buffer('running_mean', torch.zeros(n_groups, 1, n_features))
+        self.register_buffer('running_var', torch.ones(n_groups, 1, n_features))
+
+    def forward(self, x):
+        if self.training:
+            mean = x.mean(dim=1, keepdim=True)
+            var = x.var(dim=1, unbiased=False, keepdim=True)
+            with torch.no_grad():
+                n = x.shape[1]
+                self.running_mean.mul_(1 - self.momentum).add_(self.momentum * mean)
+                self.running_var.mul_(1 - self.momentum).add_(self.momentum * var * n / max(n - 1, 1))
+        else:
+            mean, var = self.running_mean, self.running_var
+        return (x - mean) / torch.sqrt(var + self.eps) * self.weight + self.bias
+
+def create_grouped_representation(n_groups, input_dim, layers, dropout_rate, activation, bias=True):
+    """
+    Same as create_representation, but for G independent networks evaluated together.
+    """
+    if activation == 'ReLU6':
+        act = nn.ReLU6()
+    elif activation == 'ReLU':
+        act = nn.ReLU()
+    elif activation == 'SeLU':
+        act = nn.SELU()
+    elif activation == 'Tanh':
+        act = nn.Tanh()
+
+    modules = []
+    prevdim = input_dim
+
+    for hidden in layers:
+        modules.append(GroupedLinear(n_groups, prevdim, hidden, bias=bias))
+        modules.append(GroupedBatchNorm(n_groups, hidden))
+        modules.append(act)
+        modules.append(nn.Dropout(p=dropout_rate))
+        prevdim = hidden
+
+    return nn.Sequential(*modules)
+
 class MLP(torch.nn.Module):
     """"
     input_dim: the input dimension, i.e., number of features.
@@ -59,9 +149,10 @@ class MLP(torch.nn.Module):
     temp: 1000 default, temperature for softmax function.
     num_events: number of events (K).
     discount: not used yet.
+    precision: PrecisionPolicy, preset name or dict, defaults to the default dtype.
     """
     def __init__(self, input_dim, n_dists, layers, dropout_rate,
-                 temp, n_states, use_shared=True, discount=1.0):
+                 temp, n_states, use_shared=True, discount=1.0, precision=None):
         super(MLP, self).__init__()
 
         self.n_dists = n_dists
@@ -89,33 +180,77 @@ class MLP(torch.nn.Module):
         if self.use_shared:
             self.embedding = create_representation(input_dim, layers, dropout_rate, 'ReLU6')
         else:
-            self.embeddings = nn.ModuleList([
-                create_representation(input_dim, layers, 'ReLU6') for _ in range(n_states)
-            ])
+            self.embeddings = create_grouped_representation(n_states, input_dim, layers,
+                                                            dropout_rate, 'ReLU6')
+        
+        self.precision = PrecisionPolicy.from_config(precision)
+        self.to(self.precision.param_dtype)
 
-    def forward(self, x):
-        outcomes = []
+    def get_embedding(self):
+        return self.embedding if self.use_shared else self.embeddings
+
+    def forward_stacked(self, x):
+        """
+        Returns the shape, scale and gate parameters for all states as
+        tensors of size (N, n_states, n_dists). The body runs in the compute
+        dtype of the precision policy, the outputs are in its reduce dtype.
+        """
+        with self.precision.autocast(x.device.type):
+            shape, scale, gate = self._forward_heads(x.to(self.precision.param_dtype))
+        reduce_dtype = self.precision.reduce_dtype
+        return shape.to(reduce_dtype), scale.to(reduce_dtype), gate.to(reduce_dtype)
+
+    def _forward_heads(self, x):
+        dim = x.shape[0]
         if self.use_shared:
             xrep = self.embedding(x)
-            dim = x.shape[0]
             shape = torch.clamp(self.act(self.shapeg(xrep)) + self.shape.expand(dim, -1), min=-10, max=10)
             scale = torch.clamp(self.act(self.scaleg(xrep)) + self.scale.expand(dim, -1), min=-10, max=10)
             gate = self.gate(xrep) / self.temp
-            for i in range(self.n_states):
-                outcomes.append((shape[:,i*self.n_dists:(i+1)*self.n_dists],
-                                scale[:,i*self.n_dists:(i+1)*self.n_dists],
-                                gate[:,i*self.n_dists:(i+1)*self.n_dists]))
+            return (shape.view(dim, self.n_states, self.n_dists),
+                    scale.view(dim, self.n_states, self.n_dists),
+                    gate.view(dim, self.n_states, self.n_dists))
         else:
-            dim = x.shape[0]
-            for i in range(self.n_states):
-                xrep = self.embeddings[i](x)
-                shape = torch.clamp(self.act(self.shapeg(xrep)) + self.shape.expand(dim, -1), min=-10, max=10)
-                scale = torch.clamp(self.act(self.scaleg(xrep)) + self.scale.expand(dim, -1), min=-10, max=10)
-                gate = self.gate(xrep) / self.temp
-                outcomes.append((shape[:, i * self.n_dists:(i + 1) * self.n_dists],
-                                    scale[:, i * self.n_dists:(i + 1) * self.n_dists],
-                                    gate[:, i * self.n_dists:(i + 1) * self.n_dists]))
-        return outcomes
+            # All state embeddings run as one grouped network, (n_states, N, lastdim)
+            xrep = self.embeddings(x)
+            shape = torch.clamp(self.act(self._grouped_head(self.shapeg, xrep)) + self.shape.view(self.n_states, self.n_dists), min=-10, max=10)
+            scale = torch.clamp(self.act(self._grouped_head(self.scaleg, xrep)) + self.scale.view(self.n_states, self.n_dists), min=-10, max=10)
+            gate = self._grouped_head(self.gate, xrep) / self.temp
+            return shape, scale, gate
+
+    def _grouped_head(self, head, xrep):
+        # Apply only the head outputs of state i to the embedding of state i
+        weight = head.weight.view(self.n_states, self.n_dists, -1)
+        if xrep.dim() == 2:
+            out = torch.einsum('nh,sdh->nsd', xrep, weight)
+        else:
+            out = torch.einsum('snh,sdh->nsd', xrep, weight)
+        if head.bias is not None:
+            out = out + head.bias.view(self.n_states, self.n_dists)
+        return out
+
+    def forward(self, x):
+        shape, scale, gate = self.forward_stacked(x)
+        return [(shape[:, i], scale[:, i], gate[:, i]) for i in range(self.n_states)]
+
+class SurvivalModule(nn.Module):
+    """
+    Wraps a trained MLP with fixed time bins and states so that forward(x)
+    returns the survival curves, used for exporting the inference graph.
+    """
+    def __init__(self, model, time_bins, risks):
+        super(SurvivalModule, self).__init__()
+        self.model = model
+        dtype = next(model.parameters()).dtype
+        self.register_buffer('time_bins', torch.as_tensor(time_bins, dtype=dtype).reshape(-1))
+        self.register_buffer('risks', torch.as_tensor(risks, dtype=torch.long))
+
+    def forward(self, x):
+        shape, scale, gate = self.model.forward_stacked(x)
+        shape, scale, gate = shape[:, self.risks], scale[:, self.risks], gate[:, self.risks]
+        return torch.exp(weibull_mixture_log_survival(shape, scale, gate, self.time_bins))
+
+CHECKPOINT_VERSION = 1
         
 class MENSA:
     """
@@ -125,103 +260,193 @@ class MENSA:
     n_dists: number of Weibull distributions
     layers: layers and size of the network, e.g., [32, 32].
     device: device to use, e.g., cpu or cuda
+    compile_mode: None, 'script' or 'compile' to compile the likelihood kernel
+    precision: PrecisionPolicy, preset name ('float64', 'float32', 'mixed', 'bfloat16') or dict
     """
     def __init__(self, n_features, n_events, n_dists=5,
                  layers=[32, 32], dropout_rate=0.5,
-                 use_shared=True, trajectories=[], device='cpu'):
+                 use_shared=True, trajectories=[], device='cpu',
+                 compile_mode=None, precision=None):
         self.n_features = n_features
+        self.n_events = n_events
         self.n_states = n_events + 1 # K + 1 states
+        self.n_dists = n_dists
+        self.layers = layers
+        self.dropout_rate = dropout_rate
         self.device = device
+        self.compile_mode = compile_mode
+        self.time_bins = None
+        self.optimizer = None
+        self.freeze_embedding = False
         
         self.use_shared = use_shared
         self.trajectories = trajectories
+        if len(trajectories) > 0:
+            self.trajectory_index = torch.tensor(trajectories, dtype=torch.long, device=device).reshape(-1, 2)
+        else:
+            self.trajectory_index = None
         
         self.model = MLP(n_features, n_dists, layers, dropout_rate, temp=1000,
-                         n_states=self.n_states, use_shared=use_shared)
+                         n_states=self.n_states, use_shared=use_shared, precision=precision)
+        
+        self.loss_fn = compile_kernel(weibull_mixture_loss, compile_mode)
         
     def get_model(self):
         return self.model
     
+    def get_config(self):
+        return {'n_features': self.n_features,
+                'n_events': self.n_events,
+                'n_dists': self.n_dists,
+                'layers': list(self.layers),
+                'dropout_rate': self.dropout_rate,
+                'use_shared': self.use_shared,
+                'trajectories': [list(trajectory) for trajectory in self.trajectories],
+                'precision': self.model.precision.get_config()}
+    
+    def save(self, path, time_bins=None):
+        """
+        Saves the config and state_dict (and optionally the time bins) to a versioned checkpoint.
+        """
+        checkpoint = {'format_version': CHECKPOINT_VERSION,
+                      'config': self.get_config(),
+                      'dtype': str(next(self.model.parameters()).dtype).replace('torch.', ''),
+                      'time_bins': None if time_bins is None else torch.as_tensor(time_bins).cpu(),
+                      'state_dict': {k: v.cpu() for k, v in self.model.state_dict().items()}}
+        torch.save(checkpoint, path)
+    
+    @classmethod
+    def load(cls, path, device='cpu', compile_mode=None):
+        """
+        Loads a checkpoint written by save(). The time bins, if saved, are set as model.time_bins.
+        """
+        checkpoint = torch.load(path, map_location='cpu')
+        version = checkpoint.get('format_version')
+        if version != CHECKPOINT_VERSION:
+            raise ValueError(f"Unsupported checkpoint version: {version}")
+        model = cls(**checkpoint['config'], device=device, compile_mode=compile_mode)
+        model.model.to(getattr(torch, checkpoint['dtype']))
+        model.model.load_state_dict(checkpoint['state_dict'])
+        model.model.to(device)
+        model.model.eval()
+        model.time_bins = checkpoint['time_bins']
+        return model
+    
+    def export(self, path, time_bins, risks=None, format='torchscript'):
+        """
+        Exports the forward pass and survival computation as a standalone graph
+        that maps X (N, n_features) to survival curves (N, len(risks), len(time_bins)).
+        format: 'torchscript' (load with torch.jit.load) or 'onnx'.
+        """
+        if risks is None:
+            risks = list(range(1, self.n_states))
+        dtype = next(self.model.parameters()).dtype
+        module = SurvivalModule(self.model, time_bins, risks).to(self.device).eval()
+        example = torch.zeros((2, self.n_features), dtype=dtype, device=self.device)
+        with torch.no_grad():
+            if format == 'torchscript':
+                traced = torch.jit.trace(module, example)
+                traced.save(path)
+            elif format == 'onnx':
+                torch.onnx.export(module, example, path, input_names=['x'], output_names=['survival'],
+                                  dynamic_axes={'x': {0: 'n_samples'}, 'survival': {0: 'n_samples'}},
+                                  opset_version=13)
+            else:
+                raise ValueError(f"Unknown export format: {format}")
+    
     def fit(self, train_dict, valid_dict, batch_size=1024, n_epochs=20000, 
             patience=100, optimizer='adam', weight_decay=0.001, learning_rate=5e-4,
-            betas=(0.9, 0.999), use_wandb=False, verbose=False):
+            betas=(0.9, 0.999), use_wandb=False, verbose=False, valid_every=1,
+            valid_every_steps=None, restore_best=True, time_budget=None, valid_callback=None,
+            warm_start=False, freeze_embedding=False, callbacks=None,
+            data_parallel=False):
+        """
+        Trains the model with early stopping on the validation loss.
+        valid_every: validate every N epochs.
+        valid_every_steps: validate every M optimizer steps instead, if given.
+        patience: number of validations without improvement before stopping.
+        restore_best: restore the weights with the best validation loss when training stops.
+        time_budget: stop training after this many seconds.
+        valid_callback: called as valid_callback(epoch, valid_loss) after every validation,
+        training stops if it returns True (e.g., when a tuning trial is pruned).
+        warm_start: continue from the current weights with the optimizer state of the previous call.
+        freeze_embedding: keep the embedding fixed and only train the shapeg/scaleg/gate heads.
+        train_dict and valid_dict can also be a mensa.streaming.StreamingSource, e.g., sharded
+        .npy memmaps for cohorts larger than memory, which are read one shuffle buffer at a time.
+        callbacks: list of mensa.callbacks.Callback, e.g., a ProfilerCallback.
+        data_parallel: shard the data over the ranks of an initialized process group and
+        all-reduce the gradients, see mensa.distributed.run_data_parallel. batch_size stays
+        the global batch size and all ranks take the same early stopping decisions.
+        Returns the training history as a dict of lists.
+        """
 
-        optim_dict = [{'params': self.model.parameters(), 'lr': learning_rate}]
-        
-        if optimizer == 'adam':
-            optimizer = torch.optim.Adam(optim_dict, betas=betas, weight_decay=weight_decay)
-        elif optimizer == 'adamw':
-            optimizer = torch.optim.AdamW(optim_dict, betas=betas, weight_decay=weight_decay)
-        
-        multi_event = True if train_dict['T'].ndim > 1 else False
+        self.model.to(self.device)
+        self.set_freeze_embedding(freeze_embedding)
+        optimizer = self.get_optimizer(optimizer, learning_rate, weight_decay, betas, warm_start)
         
-        # Added transient state for multi-event scenarios
-        if multi_event:
-            train_dict = add_transient_state(train_dict)
-            valid_dict = add_transient_state(valid_dict)
+        if isinstance(train_dict, StreamingSource):
+            multi_event = train_dict.multi_event
+        else:
+            multi_event = True if train_dict['T'].ndim > 1 else False
+        train_data = self.prepare_data(train_dict, multi_event)
+        valid_data = self.prepare_data(valid_dict, multi_event)
         
-        train_loader = DataLoader(TensorDataset(train_dict['X'].to(self.device),
-                                                train_dict['T'].to(self.device),
-                                                train_dict['E'].to(self.device)),
-                                  batch_size=batch_size, shuffle=True)
-        valid_loader = DataLoader(TensorDataset(valid_dict['X'].to(self.device),
-                                                valid_dict['T'].to(self.device),
-                                                valid_dict['E'].to(self.device)),
-                                  batch_size=batch_size, shuffle=False)
+        rank, world_size = 0, 1
+        if data_parallel:
+            if isinstance(train_data, StreamingSource) or isinstance(valid_data, StreamingSource):
+                raise ValueError("Data-parallel training needs in-memory train and valid dicts")
+            rank, world_size = distributed.get_world()
+            distributed.broadcast_module(self.model)
+            train_data = distributed.shard_tensors(train_data, rank, world_size)
+            valid_data = distributed.shard_tensors(valid_data, rank, world_size)
+            batch_size = math.ceil(batch_size / world_size)
+            verbose = verbose and rank == 0
         
-        self.model.to(self.device)
         min_delta = 0.001
         best_valid_loss = float('inf')
-        epochs_no_improve = 0
-        
-        pbar = trange(n_epochs, disable=not verbose)
+        best_state = None
+        validations_no_improve = 0
+        history = {'epoch': [], 'step': [], 'train_loss': [], 'valid_loss': [], 'time': []}
         
-        for itr in pbar:
-            self.model.train()
-            total_train_loss = 0
-            
-            # Training step
-            for xi, ti, ei in train_loader:
-                optimizer.zero_grad()
-                
-                params = self.model.forward(xi) # run forward pass
-                if multi_event:
-                    f, s = self.compute_risks_multi(params, ti)
-                    loss = conditional_weibull_loss_multi(f, s, ei, self.model.n_states)
-                    for trajectory in self.trajectories:
-                        loss += self.compute_risk_trajectory(trajectory[0], trajectory[1], ti, ei, params) 
-                else:
-                    f, s = self.compute_risks(params, ti)
-                    loss = conditional_weibull_loss(f, s, ei, self.model.n_states)
-
-                loss.backward()
-                optimizer.step()
-                
-                total_train_loss += loss.item()
+        step = 0
+        stop = False
+        start_time = time.perf_counter()
+        total_train_loss = torch.zeros((), device=self.device)
+        n_train_batches = 0
+        callbacks = CallbackList(callbacks)
         
-            avg_train_loss = total_train_loss / len(train_loader)
-
-            # Validation step
+        def validate(itr):
+            nonlocal best_valid_loss, best_state, validations_no_improve, total_train_loss, n_train_batches
+            if callbacks:
+                callbacks.fire('on_validation_start', self, itr)
+            if data_parallel:
+                distributed.average_buffers(self.model, world_size)
             self.model.eval()
-            total_valid_loss = 0
+            total_valid_loss = torch.zeros((), device=self.device)
+            n_valid_batches = 0
             
             with torch.no_grad():
-                for xi, ti, ei in valid_loader:
-                    params = self.model.forward(xi) # run forward pass
-                    if multi_event:
-                        f, s = self.compute_risks_multi(params, ti)
-                        loss = conditional_weibull_loss_multi(f, s, ei, self.model.n_states)
-                        for trajectory in self.trajectories:
-                            loss += self.compute_risk_trajectory(trajectory[0], trajectory[1], ti, ei, params) 
-                    else:
-                        f, s = self.compute_risks(params, ti)
-                        loss = conditional_weibull_loss(f, s, ei, self.model.n_states)
-                    
-                    total_valid_loss += loss.item()
-                
-            avg_valid_loss = total_valid_loss / len(valid_loader)
+                for xi, ti, ei in self.iterate_data(valid_data, batch_size, multi_event):
+                    total_valid_loss += self.compute_loss(xi, ti, ei, multi_event)
+                    n_valid_batches += 1
+            
+            # Sync with the device once per validation
+            losses = torch.stack([total_train_loss / max(n_train_batches, 1),
+                                  total_valid_loss / n_valid_batches])
+            if data_parallel:
+                losses = distributed.all_reduce_mean(losses.cpu(), world_size)
+            avg_train_loss, avg_valid_loss = losses.tolist()
+            total_train_loss = torch.zeros((), device=self.device)
+            n_train_batches = 0
+            
+            history['epoch'].append(itr)
+            history['step'].append(step)
+            history['train_loss'].append(avg_train_loss)
+            history['valid_loss'].append(avg_valid_loss)
+            history['time'].append(time.perf_counter() - start_time)
                 
-            if use_wandb:
+            if use_wandb and rank == 0:
+                import wandb
                 wandb.log({"train_loss": avg_train_loss})
                 wandb.log({"valid_loss": avg_valid_loss})
                 
@@ -232,101 +457,354 @@ class MENSA:
             # Check for early stopping
             if avg_valid_loss < best_valid_loss - min_delta:
                 best_valid_loss = avg_valid_loss
-                epochs_no_improve = 0
+                validations_no_improve = 0
+                if restore_best:
+                    best_state = {k: v.detach().clone() for k, v in self.model.state_dict().items()}
             else:
-                epochs_no_improve += 1
-            if epochs_no_improve >= patience:
-                print(f"Early stopping at iteration {itr}, best valid loss: {best_valid_loss}")
+                validations_no_improve += 1
+            should_stop = False
+            if callbacks and callbacks.fire('on_validation_end', self, itr, avg_valid_loss):
+                should_stop = True
+            # Report every validation, also the one that triggers early stopping
+            if valid_callback is not None and valid_callback(itr, avg_valid_loss):
+                should_stop = True
+            if not should_stop and validations_no_improve >= patience:
+                if rank == 0:
+                    print(f"Early stopping at iteration {itr}, best valid loss: {best_valid_loss}")
+                should_stop = True
+            if data_parallel:
+                # Callbacks may only run on rank 0, stop all ranks together
+                should_stop = distributed.any_rank(should_stop)
+            return should_stop
+        
+        pbar = trange(n_epochs, disable=not verbose)
+        if callbacks:
+            callbacks.fire('on_train_begin', self)
+        
+        for itr in pbar:
+            self.train_mode()
+            if callbacks:
+                callbacks.fire('on_epoch_start', self, itr)
+            
+            # Training step
+            for xi, ti, ei in self.iterate_data(train_data, batch_size, multi_event, shuffle=True):
+                optimizer.zero_grad(set_to_none=True)
+                
+                if callbacks:
+                    callbacks.fire('on_batch_start', self, step)
+                loss = self.compute_loss(xi, ti, ei, multi_event, callbacks, step)
+                if callbacks:
+                    callbacks.fire('on_loss_end', self, step, loss)
+                loss.backward()
+                if data_parallel:
+                    distributed.all_reduce_gradients(self.model, world_size)
+                if callbacks:
+                    callbacks.fire('on_backward_end', self, step)
+                optimizer.step()
+                if callbacks:
+                    callbacks.fire('on_batch_end', self, step, loss)
+                
+                total_train_loss += loss.detach()
+                n_train_batches += 1
+                step += 1
+                
+                if time_budget is not None:
+                    over_budget = time.perf_counter() - start_time > time_budget
+                    if data_parallel:
+                        over_budget = distributed.any_rank(over_budget)
+                    if over_budget:
+                        if rank == 0:
+                            print(f"Time budget of {time_budget}s reached at iteration {itr}")
+                        stop = True
+                        break
+                if valid_every_steps is not None and step % valid_every_steps == 0:
+                    stop = validate(itr)
+                    if stop:
+                        break
+                    self.train_mode()
+            
+            if callbacks:
+                callbacks.fire('on_epoch_end', self, itr)
+            if stop:
                 break
+            if valid_every_steps is None and (itr + 1) % valid_every == 0:
+                if validate(itr):
+                    break
+        
+        if best_state is not None:
+            self.model.load_state_dict(best_state)
+        elif data_parallel:
+            distributed.average_buffers(self.model, world_size)
+        self.model.eval()
+        if callbacks:
+            callbacks.fire('on_train_end', self, history)
+        
+        return history
+        
+    def prepare_data(self, data_dict, multi_event):
+        """
+        Moves a data dict to the device as [X, T, E] and adds the transient state
+        for multi-event data. Streaming sources are returned as they are.
+        """
+        if isinstance(data_dict, StreamingSource):
+            return data_dict
+        if multi_event:
+            data_dict = add_transient_state(dict(data_dict))
+        return [data_dict['X'].to(self.device), data_dict['T'].to(self.device),
+                data_dict['E'].to(self.device)]
+    
+    def iterate_data(self, data, batch_size, multi_event, shuffle=False):
+        """
+        Yields (X, T, E) batches on the device. In-memory data is sliced from a per-epoch
+        permutation, streaming sources are read batch by batch and get the transient
+        state per batch.
+        """
+        if not isinstance(data, StreamingSource):
+            yield from iterate_batches(data, batch_size, shuffle=shuffle)
+            return
+        for xi, ti, ei in data.iterate(batch_size, shuffle=shuffle):
+            xi, ti, ei = xi.to(self.device), ti.to(self.device), ei.to(self.device)
+            if multi_event:
+                ti, ei = transient_state(ti, ei)
+            yield xi, ti, ei
+    
+    def partial_fit(self, batch_dict, n_steps=1, optimizer='adam', weight_decay=0.001,
+                    learning_rate=5e-4, betas=(0.9, 0.999), freeze_embedding=False):
+        """
+        Incrementally updates the model on a batch, e.g., a newly arriving cohort.
+        The optimizer state and BatchNorm statistics are kept between calls.
+        batch_dict: dict with 'X', 'T' and 'E' like in fit().
+        n_steps: number of optimizer steps on the batch.
+        Returns the training loss of the last step.
+        """
+        multi_event = True if batch_dict['T'].ndim > 1 else False
+        if multi_event:
+            batch_dict = add_transient_state(dict(batch_dict))
+        
+        self.model.to(self.device)
+        self.set_freeze_embedding(freeze_embedding)
+        optimizer = self.get_optimizer(optimizer, learning_rate, weight_decay, betas, warm_start=True)
+        xi, ti, ei = batch_dict['X'].to(self.device), batch_dict['T'].to(self.device), batch_dict['E'].to(self.device)
+        
+        self.train_mode()
+        for _ in range(n_steps):
+            optimizer.zero_grad(set_to_none=True)
+            loss = self.compute_loss(xi, ti, ei, multi_event)
+            loss.backward()
+            optimizer.step()
+        self.model.eval()
+        
+        return loss.item()
+    
+    def get_optimizer(self, optimizer, learning_rate, weight_decay, betas, warm_start=False):
+        """
+        Returns the optimizer over the trainable parameters. With warm_start, the optimizer
+        of the previous call is reused, so Adam's moment estimates are kept.
+        """
+        params = [p for p in self.model.parameters() if p.requires_grad]
+        if warm_start and self.optimizer is not None:
+            for group in self.optimizer.param_groups:
+                group['lr'] = learning_rate
+            known = {id(p) for group in self.optimizer.param_groups for p in group['params']}
+            missing = [p for p in params if id(p) not in known]
+            if len(missing) > 0:
+                self.optimizer.add_param_group({'params': missing, 'lr': learning_rate})
+            return self.optimizer
+        
+        optim_dict = [{'params': params, 'lr': learning_rate}]
+        
+        if optimizer == 'adam':
+            self.optimizer = torch.optim.Adam(optim_dict, betas=betas, weight_decay=weight_decay)
+        elif optimizer == 'adamw':
+            self.optimizer = torch.optim.AdamW(optim_dict, betas=betas, weight_decay=weight_decay)
+        else:
+            raise ValueError(f"Unknown optimizer: {optimizer}")
+        return self.optimizer
+    
+    def set_freeze_embedding(self, freeze):
+        """
+        Freezes or unfreezes the shared embedding (or the per-state embeddings).
+        Frozen parameters get no gradients and are skipped by the optimizer.
+        """
+        self.freeze_embedding = freeze
+        for param in self.model.get_embedding().parameters():
+            param.requires_grad_(not freeze)
+    
+    def train_mode(self):
+        # A frozen embedding stays in eval mode to keep its BatchNorm statistics
+        self.model.train()
+        if self.freeze_embedding:
+            self.model.get_embedding().eval()
+    
+    def compute_loss(self, xi, ti, ei, multi_event, callbacks=None, step=None):
+        shape, scale, gate = self.model.forward_stacked(xi) # run forward pass
+        if callbacks:
+            callbacks.fire('on_forward_end', self, step)
+        return self.loss_fn(shape, scale, gate, ti, ei, multi_event, self.trajectory_index)
         
     def compute_risks(self, params, ti):
-        f_risks = []
-        s_risks = []
-        ti = ti.reshape(-1,1).expand(-1, self.model.n_dists)
-        for i in range(self.model.n_states):
-            k = params[i][0]
-            b = params[i][1]
-            gate = nn.LogSoftmax(dim=1)(params[i][2])
-            s = - (torch.pow(torch.exp(b)*ti, torch.exp(k)))
-            f = k + b + ((torch.exp(k)-1)*(b+safe_log(ti)))
-            f = f + s
-            s = (s + gate)
-            s = torch.logsumexp(s, dim=1)
-            f = (f + gate)
-            f = torch.logsumexp(f, dim=1)
-            f_risks.append(f)
-            s_risks.append(s)
-        f = torch.stack(f_risks, dim=1)
-        s = torch.stack(s_risks, dim=1)
-        return f, s
+        shape, scale, gate = (torch.stack(p, dim=1) for p in zip(*params))
+        return weibull_mixture_log_risks(shape, scale, gate, ti.reshape(-1))
     
     def compute_risk_trajectory(self, i, j, ti, ei, params): 
         # eg: i = 2, j = 0, j happen before i, S_i(T_j)
-        t = ti[:,j].reshape(-1,1).expand(-1, self.model.n_dists) #(n, k)
-        k = params[i][0]
-        b = params[i][1]
-        gate = nn.LogSoftmax(dim=1)(params[i][2])
-        s = -(torch.pow(torch.exp(b)*t, torch.exp(k)))
-        s = (s + gate)
-        s = torch.logsumexp(s, dim=1)#log_survival
-        condition = torch.logical_and(ei[:, i] == 1, ei[:, j] == 1)
-        result = -torch.sum(condition*s) / ei.shape[0]
-        return result
+        shape, scale, gate = (torch.stack(p, dim=1) for p in zip(*params))
+        trajectories = torch.tensor([[i, j]], dtype=torch.long, device=shape.device)
+        return torch.sum(trajectory_penalty(shape, scale, gate, ti, ei, trajectories)) / ei.shape[0]
     
     def compute_risks_multi(self, params, ti):
-        f_risks = []
-        s_risks = []
-        for i in range(self.model.n_states):
-            t = ti[:,i].reshape(-1,1).expand(-1, self.model.n_dists)
-            k = params[i][0]
-            b = params[i][1]
-            gate = nn.LogSoftmax(dim=1)(params[i][2])
-            s = - (torch.pow(torch.exp(b)*t, torch.exp(k)))
-            f = k + b + ((torch.exp(k)-1)*(b+safe_log(t)))
-            f = f + s
-            s = (s + gate)
-            s = torch.logsumexp(s, dim=1)
-            f = (f + gate)
-            f = torch.logsumexp(f, dim=1)
-            f_risks.append(f)
-            s_risks.append(s)
-        f = torch.stack(f_risks, dim=1)
-        s = torch.stack(s_risks, dim=1)
-        return f, s
+        shape, scale, gate = (torch.stack(p, dim=1) for p in zip(*params))
+        return weibull_mixture_log_risks(shape, scale, gate, ti)
 
-    def predict(self, x_test, time_bins, risk=0):
+    def predict_params(self, x_test, risks=None):
         """
-        Courtesy of https://github.com/autonlab/DeepSurvivalMachines
+        Runs the model in eval mode and returns the (N, len(risks), n_dists) mixture
+        parameters, by default for the K events (states 1..K).
         """
-        t = list(time_bins.cpu().numpy())
-        params = self.model.forward(x_test)
+        if risks is None:
+            risks = list(range(1, self.n_states))
+        self.model.eval()
+        shape, scale, gate = self.model.forward_stacked(x_test.to(self.device))
+        idx = torch.as_tensor(risks, dtype=torch.long, device=shape.device)
+        return shape[:, idx], scale[:, idx], gate[:, idx]
+
+    def survival_at(self, x_test, t, risks=None, output='survival', as_numpy=True):
+        """
+        Evaluates the curves only at one time per sample and state, e.g., at the observed
+        times, without forming the (N, len(risks), len(time_bins)) grid.
+        t: (N,) time shared by all states, or (N, len(risks)) time per state.
+        risks: state indices, defaults to the K events (states 1..K).
+        output: 'survival', 'density', 'hazard', 'log_survival' or 'log_density'.
+        Returns values with shape (N, len(risks)).
+        """
+        with torch.no_grad():
+            shape, scale, gate = self.predict_params(x_test, risks)
+            f, s = weibull_mixture_log_risks(shape, scale, gate, torch.as_tensor(t, device=shape.device))
+            if output == 'survival':
+                values = torch.exp(s)
+            elif output == 'density':
+                values = torch.exp(f)
+            elif output == 'hazard':
+                values = torch.exp(f - s)
+            elif output == 'log_survival':
+                values = s
+            elif output == 'log_density':
+                values = f
+            else:
+                raise ValueError(f"Unknown output: {output}")
+
+        if as_numpy:
+            return values.cpu().numpy()
+        return values
+
+    def predict_survival(self, x_test, time_bins, risks=None, output='survival', as_numpy=True):
+        """
+        Predicts the curves of several states on all time bins with a single forward pass.
+        risks: state indices to predict, defaults to the K events (states 1..K).
+        output: 'survival', 'cdf', 'hazard' or 'log_survival'.
+        as_numpy: return a numpy array instead of a tensor.
+        Returns curves with shape (N, len(risks), len(time_bins)).
+        """
+        with torch.no_grad():
+            shape, scale, gate = self.predict_params(x_test, risks)
+            t = torch.as_tensor(time_bins, device=shape.device)
+            
+            log_s = weibull_mixture_log_survival(shape, scale, gate, t)
+            if output == 'survival':
+                curves = torch.exp(log_s)
+            elif output == 'log_survival':
+                curves = log_s
+            elif output == 'cdf':
+                curves = -torch.expm1(log_s)
+            elif output == 'hazard':
+                curves = torch.exp(weibull_mixture_log_density(shape, scale, gate, t) - log_s)
+            else:
+                raise ValueError(f"Unknown output: {output}")
         
-        shape, scale, logits = params[risk][0], params[risk][1], params[risk][2]
-        k_ = shape
-        b_ = scale
+        if as_numpy:
+            return curves.cpu().numpy()
+        return curves
 
-        squish = nn.LogSoftmax(dim=1)
-        logits = squish(logits)
+    def predict_survival_to_file(self, x_source, time_bins, path, n_samples=None, chunk_size=10000,
+                                 risks=None, output='survival', dtype=np.float64, resume=True, verbose=False):
+        """
+        Streams predictions chunk by chunk into a memory-mapped .npy file, so peak memory
+        is bounded by chunk_size. Progress is stored next to the file, and an interrupted
+        run continues from the last written chunk when resume=True.
+        x_source: sliceable array (numpy, memmap, tensor) or iterable of row blocks.
+        n_samples: number of rows, required when x_source has no length.
+        Returns the memory-mapped curves (N, len(risks), len(time_bins)) and rows/sec.
+        """
+        if risks is None:
+            risks = list(range(1, self.n_states))
+        if n_samples is None:
+            n_samples = len(x_source)
+        out_shape = (n_samples, len(risks), len(time_bins))
+        progress_path = f"{path}.progress"
         
-        t_horz = torch.tensor(time_bins).double().to(logits.device)
-        t_horz = t_horz.repeat(shape.shape[0], 1)
+        start = 0
+        if resume and os.path.exists(path) and os.path.exists(progress_path):
+            curves = np.lib.format.open_memmap(path, mode='r+')
+            if curves.shape != out_shape:
+                raise ValueError(f"Existing file has shape {curves.shape}, expected {out_shape}")
+            with open(progress_path, 'r') as f:
+                start = int(f.read())
+        else:
+            curves = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=out_shape)
         
-        cdfs = []
-        for j in range(len(time_bins)):
-
-            t = t_horz[:, j]
-            lcdfs = []
+        x_dtype = next(self.model.parameters()).dtype
+        row = start
+        pbar = tqdm(total=n_samples, initial=start, unit='rows', disable=not verbose)
+        start_time = time.perf_counter()
+        for chunk in iterate_chunks(x_source, chunk_size, start):
+            x = torch.as_tensor(np.asarray(chunk), dtype=x_dtype)
+            curves[row:row+len(x)] = self.predict_survival(x, time_bins, risks=risks, output=output)
+            row += len(x)
+            curves.flush()
+            with open(f"{progress_path}.tmp", 'w') as f:
+                f.write(str(row))
+            os.replace(f"{progress_path}.tmp", progress_path)
+            pbar.update(len(x))
+        pbar.close()
+        elapsed = time.perf_counter() - start_time
+        
+        if row != n_samples:
+            raise ValueError(f"Source yielded {row} rows, expected {n_samples}")
+        os.remove(progress_path)
+        
+        rows_per_sec = (row - start) / elapsed if elapsed > 0 else float('inf')
+        if verbose:
+            print(f"Scored {row - start} rows in {elapsed:.2f}s ({rows_per_sec:.0f} rows/sec)")
+        return curves, rows_per_sec
 
-            for g in range(self.model.n_dists):
+    def predict_quantiles(self, x_test, q=0.5, risks=None, as_numpy=True):
+        """
+        Predicts the survival-time quantiles S^-1(q) directly from the mixture parameters.
+        q: survival probability or list of probabilities, q=0.5 gives the median.
+        Returns times with shape (N, len(risks), len(q)).
+        """
+        with torch.no_grad():
+            shape, scale, gate = self.predict_params(x_test, risks)
+            times = weibull_mixture_quantiles(shape, scale, gate, q)
+        if as_numpy:
+            return times.cpu().numpy()
+        return times
 
-                k = k_[:, g]
-                b = b_[:, g]
-                s = - (torch.pow(torch.exp(b)*t, torch.exp(k)))
-                lcdfs.append(s)
+    def predict_rmst(self, x_test, horizon, risks=None, method='analytic', as_numpy=True):
+        """
+        Predicts the restricted mean survival time up to horizon.
+        method: 'analytic' or 'quadrature'.
+        Returns times with shape (N, len(risks)).
+        """
+        with torch.no_grad():
+            shape, scale, gate = self.predict_params(x_test, risks)
+            rmst = weibull_mixture_rmst(shape, scale, gate, float(horizon), method=method)
+        if as_numpy:
+            return rmst.cpu().numpy()
+        return rmst
 
-            lcdfs = torch.stack(lcdfs, dim=1)
-            lcdfs = lcdfs+logits
-            lcdfs = torch.logsumexp(lcdfs, dim=1)
-            cdfs.append(lcdfs.detach().cpu().numpy())
-        
-        return np.exp(np.array(cdfs)).T
\ No newline at end of file
+    def predict(self, x_test, time_bins, risk=0):
+        """
+        Courtesy of https://github.com/autonlab/DeepSurvivalMachines
+        """
+        return self.predict_survival(x_test, time_bins, risks=[risk])[:, 0]
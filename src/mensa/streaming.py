@@ -0,0 +1,143 @@
+import os
+import glob
+import numpy as np
+import torch
+
+class StreamingSource:
+    """
+    Base class for training data that is read from disk in blocks instead of being
+    held in memory. Subclasses implement _blocks(rng), which yields (X, T, E) numpy
+    row blocks in (optionally shuffled) storage order.
+    shuffle_buffer: number of rows that are collected and permuted before batching.
+    """
+    def __init__(self, shuffle_buffer=100000, seed=0):
+        self.shuffle_buffer = shuffle_buffer
+        self.rng = np.random.default_rng(seed)
+
+    @property
+    def multi_event(self):
+        raise NotImplementedError
+
+    def _blocks(self, rng):
+        raise NotImplementedError
+
+    def iterate(self, batch_size, shuffle=False):
+        """
+        Yields (X, T, E) tensors of batch_size rows. Without shuffle the rows come in storage order,
+        with shuffle the blocks are visited in random order and mixed in the shuffle buffer.
+        """
+        rng = self.rng if shuffle else None
+        buffer = []
+        n_buffered = 0
+        for block in self._blocks(rng):
+            buffer.append(block)
+            n_buffered += len(block[0])
+            if n_buffered < (self.shuffle_buffer if shuffle else batch_size):
+                continue
+            X, T, E = (np.concatenate(arrays) for arrays in zip(*buffer))
+            if shuffle:
+                idx = rng.permutation(len(X))
+                X, T, E = X[idx], T[idx], E[idx]
+            n_full = len(X) - len(X) % batch_size
+            for i in range(0, n_full, batch_size):
+                yield self._to_tensors(X[i:i+batch_size], T[i:i+batch_size], E[i:i+batch_size])
+            buffer = [(X[n_full:], T[n_full:], E[n_full:])]
+            n_buffered = len(X) - n_full
+        if n_buffered > 0:
+            X, T, E = (np.concatenate(arrays) for arrays in zip(*buffer))
+            if shuffle:
+                idx = rng.permutation(len(X))
+                X, T, E = X[idx], T[idx], E[idx]
+            for i in range(0, len(X), batch_size):
+                yield self._to_tensors(X[i:i+batch_size], T[i:i+batch_size], E[i:i+batch_size])
+
+    def _to_tensors(self, X, T, E):
+        # T keeps its stored dtype like the in-memory dicts, float times must not be truncated
+        return (torch.as_tensor(np.ascontiguousarray(X), dtype=torch.get_default_dtype()),
+                torch.as_tensor(np.ascontiguousarray(T)),
+                torch.as_tensor(np.ascontiguousarray(E), dtype=torch.int64))
+
+class ShardedArraySource(StreamingSource):
+    """
+    Reads X, T and E from sharded .npy files as memmaps, so only the rows of the
+    current shuffle buffer are in memory.
+    shards: list of (X_path, T_path, E_path) tuples, see also from_directory().
+    block_size: number of contiguous rows read at a time.
+    """
+    def __init__(self, shards, block_size=4096, shuffle_buffer=100000, seed=0):
+        super(ShardedArraySource, self).__init__(shuffle_buffer, seed)
+        self.shards = [tuple(np.load(path, mmap_mode='r') for path in shard) for shard in shards]
+        self.block_size = block_size
+
+    @classmethod
+    def from_directory(cls, path, **kwargs):
+        """
+        Loads the shards written by save_array_shards(), i.e., X_00000.npy, T_00000.npy, E_00000.npy, ...
+        """
+        x_paths = sorted(glob.glob(os.path.join(path, 'X_*.npy')))
+        shards = [tuple(os.path.join(path, name + os.path.basename(x_path)[1:]) for name in ['X', 'T', 'E'])
+                  for x_path in x_paths]
+        if len(shards) == 0:
+            raise FileNotFoundError(f"No shards found in {path}")
+        return cls(shards, **kwargs)
+
+    @property
+    def multi_event(self):
+        return self.shards[0][1].ndim > 1
+
+    def __len__(self):
+        return sum(len(shard[0]) for shard in self.shards)
+
+    def _blocks(self, rng):
+        blocks = [(s, i) for s, shard in enumerate(self.shards)
+                  for i in range(0, len(shard[0]), self.block_size)]
+        if rng is not None:
+            blocks = [blocks[i] for i in rng.permutation(len(blocks))]
+        for s, i in blocks:
+            yield tuple(np.asarray(array[i:i+self.block_size]) for array in self.shards[s])
+
+class ParquetSource(StreamingSource):
+    """
+    Reads X, T and E from the row groups of parquet files. Needs pyarrow.
+    paths: list of parquet files.
+    feature_columns, time_columns, event_columns: column names, pass lists with one
+    time and event column per event for multi-event data, or single names otherwise.
+    """
+    def __init__(self, paths, feature_columns, time_columns, event_columns,
+                 shuffle_buffer=100000, seed=0):
+        super(ParquetSource, self).__init__(shuffle_buffer, seed)
+        import pyarrow.parquet as pq
+        self.files = [pq.ParquetFile(path) for path in paths]
+        self.feature_columns = list(feature_columns)
+        self.time_columns = time_columns
+        self.event_columns = event_columns
+
+    @property
+    def multi_event(self):
+        return isinstance(self.time_columns, (list, tuple))
+
+    def __len__(self):
+        return sum(f.metadata.num_rows for f in self.files)
+
+    def _blocks(self, rng):
+        groups = [(f, g) for f in range(len(self.files)) for g in range(self.files[f].num_row_groups)]
+        if rng is not None:
+            groups = [groups[i] for i in rng.permutation(len(groups))]
+        for f, g in groups:
+            df = self.files[f].read_row_group(g).to_pandas()
+            yield (df[self.feature_columns].to_numpy(),
+                   df[self.time_columns].to_numpy(),
+                   df[self.event_columns].to_numpy())
+
+def save_array_shards(path, X, T, E, shard_size=100000):
+    """
+    Writes X, T and E as .npy shards of shard_size rows for ShardedArraySource.
+    X, T and E can be arrays, memmaps or tensors.
+    """
+    os.makedirs(path, exist_ok=True)
+    for s, i in enumerate(range(0, len(X), shard_size)):
+        for name, array in zip(['X', 'T', 'E'], [X, T, E]):
+            block = array[i:i+shard_size]
+            if isinstance(block, torch.Tensor):
+                block = block.cpu().numpy()
+            np.save(os.path.join(path, f"{name}_{s:05d}.npy"), np.asarray(block))
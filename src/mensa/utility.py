@@ -1,4 +1,6 @@
 import torch
+import contextlib
+import numpy as np
 
 def safe_log(x):
     return torch.log(x+1e-6*(x<1e-6))
@@ -11,3 +13,174 @@ def weibull_log_cdf(t, k, lam):
 
 def weibull_log_survival(t, k, lam):
     return - (t / lam) ** k
+
+def weibull_mixture_log_survival(shape, scale, gate, t):
+    """
+    Log-survival of the Weibull mixtures on a grid of times.
+    shape, scale, gate: (N, n_states, n_dists), t: (T,)
+    Returns a tensor with shape (N, n_states, T).
+    """
+    t = t.reshape(1, 1, 1, -1).to(shape.dtype)
+    log_gate = torch.log_softmax(gate, dim=2).unsqueeze(3)
+    s = -torch.pow(torch.exp(scale).unsqueeze(3)*t, torch.exp(shape).unsqueeze(3))
+    return torch.logsumexp(s + log_gate, dim=2)
+
+def weibull_mixture_log_density(shape, scale, gate, t):
+    """
+    Log-density of the Weibull mixtures on a grid of times.
+    shape, scale, gate: (N, n_states, n_dists), t: (T,)
+    Returns a tensor with shape (N, n_states, T).
+    """
+    t = t.reshape(1, 1, 1, -1).to(shape.dtype)
+    log_gate = torch.log_softmax(gate, dim=2).unsqueeze(3)
+    k, b = shape.unsqueeze(3), scale.unsqueeze(3)
+    s = -torch.pow(torch.exp(b)*t, torch.exp(k))
+    f = k + b + ((torch.exp(k)-1)*(b+safe_log(t))) + s
+    return torch.logsumexp(f + log_gate, dim=2)
+
+def iterate_chunks(source, chunk_size, start=0):
+    """
+    Yields row chunks of at most chunk_size rows, skipping the first start rows.
+    source: a sliceable array (numpy, memmap, tensor) or an iterable of row blocks.
+    """
+    if hasattr(source, '__getitem__') and hasattr(source, '__len__'):
+        for i in range(start, len(source), chunk_size):
+            yield source[i:i+chunk_size]
+    else:
+        seen = 0
+        for block in source:
+            n_rows = len(block)
+            offset = max(start - seen, 0)
+            seen += n_rows
+            for i in range(offset, n_rows, chunk_size):
+                yield block[i:i+chunk_size]
+
+def weibull_mixture_quantiles(shape, scale, gate, q, n_iter=50, tol=1e-10):
+    """
+    Survival-time quantiles of the Weibull mixtures, i.e., the times t where S(t) = q.
+    The root is bracketed by the component quantiles and refined with a safeguarded
+    Newton iteration in log-time.
+    shape, scale, gate: (N, n_states, n_dists), q: (Q,) survival probabilities in (0, 1).
+    Returns a tensor with shape (N, n_states, Q).
+    """
+    q = torch.as_tensor(q, dtype=shape.dtype, device=shape.device).reshape(-1)
+    log_q = torch.log(q).reshape(1, 1, -1)
+    log_k = shape.unsqueeze(3)
+    k = torch.exp(log_k)
+    b = scale.unsqueeze(3)
+    log_w = torch.log_softmax(gate, dim=2).unsqueeze(3)
+    
+    # Component quantiles bracket the mixture quantile
+    log_td = torch.log(-torch.log(q)).reshape(1, 1, 1, -1) / k - b
+    lo = log_td.min(dim=2).values
+    hi = log_td.max(dim=2).values
+    u = (lo + hi) / 2
+    
+    for _ in range(n_iter):
+        z = k*(b + u.unsqueeze(2)) # log (lambda*t)^k
+        log_sd = -torch.exp(z)
+        log_s = torch.logsumexp(log_w + log_sd, dim=2)
+        g = log_s - log_q
+        log_ft = torch.logsumexp(log_w + log_k + z + log_sd, dim=2) # log f(t)*t
+        dg = -torch.exp(log_ft - log_s)
+        
+        lo = torch.where(g > 0, u, lo)
+        hi = torch.where(g > 0, hi, u)
+        u_new = u - g/dg
+        outside = ~((u_new >= lo) & (u_new <= hi)) | ~torch.isfinite(u_new)
+        u_new = torch.where(outside, (lo + hi) / 2, u_new)
+        
+        converged = torch.max(torch.abs(u_new - u)) < tol
+        u = u_new
+        if converged:
+            break
+    return torch.exp(u)
+
+def weibull_mixture_rmst(shape, scale, gate, horizon, method='analytic', n_nodes=64):
+    """
+    Restricted mean survival time, the integral of S(t) from 0 to horizon.
+    method: 'analytic' uses the regularized incomplete gamma function,
+    'quadrature' uses Gauss-Legendre quadrature with n_nodes nodes.
+    shape, scale, gate: (N, n_states, n_dists)
+    Returns a tensor with shape (N, n_states).
+    """
+    log_w = torch.log_softmax(gate, dim=2)
+    if method == 'analytic':
+        # int_0^tau exp(-(lambda*t)^k) dt = Gamma(1 + 1/k)/lambda * P(1/k, (lambda*tau)^k)
+        inv_k = torch.exp(-shape)
+        x = torch.pow(torch.exp(scale)*horizon, torch.exp(shape))
+        log_rmst = torch.lgamma(1 + inv_k) - scale + torch.log(torch.igamma(inv_k, x))
+        return torch.exp(torch.logsumexp(log_w + log_rmst, dim=2))
+    elif method == 'quadrature':
+        nodes, weights = np.polynomial.legendre.leggauss(n_nodes)
+        nodes = torch.as_tensor(nodes, dtype=shape.dtype, device=shape.device)
+        weights = torch.as_tensor(weights, dtype=shape.dtype, device=shape.device)
+        t = horizon / 2 * (nodes + 1)
+        surv = torch.exp(weibull_mixture_log_survival(shape, scale, gate, t))
+        return horizon / 2 * torch.sum(surv * weights, dim=2)
+    else:
+        raise ValueError(f"Unknown method: {method}")
+
+def iterate_batches(tensors, batch_size, shuffle=False):
+    """
+    Yields mini-batches by slicing device-resident tensors, optionally after
+    applying one random permutation, without any per-sample collation.
+    """
+    n_samples = tensors[0].shape[0]
+    if shuffle:
+        idx = torch.randperm(n_samples, device=tensors[0].device)
+        tensors = [t[idx] for t in tensors]
+    for i in range(0, n_samples, batch_size):
+        yield tuple(t[i:i+batch_size] for t in tensors)
+
+class PrecisionPolicy:
+    """
+    Precision policy for MENSA.
+    compute_dtype: dtype of the MLP body (matmuls and activations). bfloat16 keeps
+    float32 weights and runs the body under autocast.
+    reduce_dtype: dtype of the numerically sensitive parts, i.e., the mixture
+    logsumexp, safe_log and the loss reductions.
+    """
+    PRESETS = {'float64': ('float64', 'float64'),
+               'float32': ('float32', 'float32'),
+               'mixed': ('float32', 'float64'),
+               'bfloat16': ('bfloat16', 'float64')}
+    
+    def __init__(self, compute_dtype=None, reduce_dtype=None):
+        default_dtype = torch.get_default_dtype()
+        self.compute_dtype = self._to_dtype(compute_dtype) if compute_dtype is not None else default_dtype
+        self.reduce_dtype = self._to_dtype(reduce_dtype) if reduce_dtype is not None else default_dtype
+    
+    @staticmethod
+    def _to_dtype(dtype):
+        return getattr(torch, dtype) if isinstance(dtype, str) else dtype
+    
+    @classmethod
+    def from_config(cls, precision):
+        """
+        Creates a policy from None (default dtype), a preset name, a dict or a policy.
+        """
+        if precision is None:
+            return cls()
+        elif isinstance(precision, PrecisionPolicy):
+            return precision
+        elif isinstance(precision, str):
+            if precision not in cls.PRESETS:
+                raise ValueError(f"Unknown precision preset: {precision}")
+            return cls(*cls.PRESETS[precision])
+        elif isinstance(precision, dict):
+            return cls(**precision)
+        raise TypeError(f"Invalid precision policy: {precision}")
+    
+    def get_config(self):
+        return {'compute_dtype': str(self.compute_dtype).replace('torch.', ''),
+                'reduce_dtype': str(self.reduce_dtype).replace('torch.', '')}
+    
+    @property
+    def param_dtype(self):
+        return torch.float32 if self.compute_dtype == torch.bfloat16 else self.compute_dtype
+    
+    def autocast(self, device_type):
+        if self.compute_dtype == torch.bfloat16:
+            return torch.autocast(device_type=device_type, dtype=torch.bfloat16)
+        return contextlib.nullcontext()
@@ -19,7 +19,6 @@ import warnings
 import argparse
 import os
 from scipy.interpolate import interp1d
-from SurvivalEVAL.Evaluator import LifelinesEvaluator
 
 # Local
 from utility.survival import (make_time_bins, preprocess_data)
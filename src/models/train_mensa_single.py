@@ -15,14 +15,13 @@ import warnings
 import argparse
 import os
 from scipy.interpolate import interp1d
-from SurvivalEVAL.Evaluator import LifelinesEvaluator
 
 # Local
 from utility.survival import (make_time_bins, preprocess_data)
 from utility.data import dotdict
 from utility.config import load_config
 from utility.data import (format_data_deephit_competing, format_hierarchical_data_cr, calculate_layer_size_hierarch)
-from utility.evaluation import global_C_index, local_C_index
+from utility.evaluation import global_C_index, local_C_index, MultiEventEvaluator
 from data_loader import get_data_loader
 from mensa.model import MENSA
 
@@ -94,27 +93,19 @@ if __name__ == "__main__":
     
     # Make predictions
     all_preds = []
+    model_preds = model.predict_survival(test_dict['X'].to(device), time_bins)
     for i in range(n_events):
-        model_preds = model.predict(test_dict['X'].to(device), time_bins, risk=i+1)
-        model_preds = pd.DataFrame(model_preds, columns=time_bins.cpu().numpy())
-        all_preds.append(model_preds)
+        all_preds.append(pd.DataFrame(model_preds[:, i], columns=time_bins.cpu().numpy()))
             
-    # Make evaluation for each event
+    # Make evaluation for all events in one pass
+    y_test_event = np.stack([(test_dict['E'].cpu().numpy() == i+1)*1.0 for i in range(n_events)], axis=1)
+    y_train_event = np.stack([(train_dict['E'].cpu().numpy() == i+1)*1.0 for i in range(n_events)], axis=1)
+    evaluator = MultiEventEvaluator([df.to_numpy() for df in all_preds], all_preds[0].columns.to_numpy(dtype=float),
+                                    test_dict['T'].cpu().numpy(), y_test_event,
+                                    train_dict['T'].cpu().numpy(), y_train_event)
+    event_metrics = evaluator.evaluate()[['CI', 'IBS', 'MAEM', 'DCalib']]
     model_results = pd.DataFrame()
-    for event_id, surv_preds in enumerate(all_preds):
-        n_train_samples = len(train_dict['X'])
-        n_test_samples= len(test_dict['X'])
-        y_train_time = train_dict['T']
-        y_train_event = (train_dict['E'] == event_id+1)*1.0
-        y_test_time = test_dict['T']
-        y_test_event = (test_dict['E'] == event_id+1)*1.0
-        lifelines_eval = LifelinesEvaluator(surv_preds.T, y_test_time, y_test_event,
-                                            y_train_time, y_train_event)
-        
-        ci = lifelines_eval.concordance()[0]
-        ibs = lifelines_eval.integrated_brier_score()
-        mae = lifelines_eval.mae(method="Margin")
-        d_calib = lifelines_eval.d_calibration()[0]
+    for event_id, (ci, ibs, mae, d_calib) in enumerate(event_metrics.to_numpy()):
         
         metrics = [ci, ibs, mae, d_calib]
         print(metrics)
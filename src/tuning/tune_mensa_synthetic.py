@@ -2,7 +2,7 @@ import numpy as np
 import os
 import config as cfg
 import torch
-from utility.tuning import get_mensa_sweep_cfg
+from utility.tuning import get_mensa_sweep_cfg, run_local_sweep, ASHAPruner
 from utility.config import load_config
 from data_loader import SingleEventSyntheticDataLoader
 from mensa.model import MENSA
@@ -15,11 +15,10 @@ np.random.seed(0)
 torch.manual_seed(0)
 random.seed(0)
 
-os.environ["WANDB_SILENT"] = "true"
-import wandb
-
 N_RUNS = 10
-PROJECT_NAME = "mensa"
+N_WORKERS = 4
+THREADS_PER_TRIAL = 1
+DATASET_NAME = "synthetic"
 
 # Setup precision
 dtype = torch.float64
@@ -29,20 +28,16 @@ torch.set_default_dtype(dtype)
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
 def main():
-    global dataset_name
-    
-    dataset_name = "synthetic"
     sweep_config = get_mensa_sweep_cfg()
-
-    sweep_id = wandb.sweep(sweep_config, project=f'{PROJECT_NAME}')
-    wandb.agent(sweep_id, train_mensa_model, count=N_RUNS)
-
-def train_mensa_model():
-    # Initialize a new wandb run
-    config_defaults = cfg.MENSA_PARAMS
-    wandb.init(config=config_defaults, group=dataset_name)
-    config = wandb.config
-    
+    db_path = os.path.join(cfg.RESULTS_DIR, f"tuning_mensa_{DATASET_NAME}.db")
+    pruner = ASHAPruner(min_epochs=10, reduction_factor=3,
+                        max_epochs=max(sweep_config['parameters']['n_epochs']['values']))
+    best_trial = run_local_sweep(train_mensa_model, sweep_config, N_RUNS, db_path,
+                                 n_workers=N_WORKERS, threads_per_trial=THREADS_PER_TRIAL,
+                                 pruner=pruner)
+    print(f"Best trial: {best_trial}")
+
+def train_mensa_model(config, valid_callback):
     # Load data
     linear = False
     k_tau = 0.25
@@ -59,10 +54,10 @@ def train_mensa_model():
     n_epochs = config['n_epochs']
     batch_size = config['batch_size']
     k = config['k']
-    lr_dict = {'network': lr, 'copula': 0.01}
     model = MENSA(n_features, n_events=2, n_dists=k, layers=layers, device=device)
-    model.fit(train_dict, valid_dict, n_epochs=n_epochs, lr_dict=lr_dict,
-              batch_size=batch_size, use_wandb=True)
+    history = model.fit(train_dict, valid_dict, n_epochs=n_epochs, learning_rate=lr,
+                        batch_size=batch_size, valid_callback=valid_callback)
+    return min(history['valid_loss'])
     
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,361 @@
+'''
+Bootstrap confidence intervals of survival metrics. A replicate is a weight vector over the test
+samples (multinomial counts, optionally per stratum, or Poisson(1) counts) instead of a resampled
+copy of the data, so every metric is prepared once and evaluated for a whole batch of replicates.
+The concordance metrics sum the weights of the partners of every anchor with cumulative sums over
+sorted predictions, the proposed metric keeps one pair matrix per event, and the metrics over samples
+are weighted means of per-sample terms. With multinomial weights the concordance, MAE and hierarchical
+metrics equal those of the resampled test set (the MAE surrogate times come from the training set).
+IBS keeps the grid of censored times of the full test set, so it is a weighted mean over a fixed grid
+rather than the IBS of the resampled test set.
+'''
+
+import numpy as np
+import pandas as pd
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from utility.evaluation import (MultiEventEvaluator, predict_median_times, _harrell_pairs, _harrell_plan,
+                                _weighted_harrell_pairs)
+
+BOOTSTRAP_METRICS = {}
+
+def register_metric(name):
+    '''
+    Registers a metric for bootstrap_metrics(). The decorated function takes the data dict and
+    returns (labels, evaluate), evaluate(W) maps weights (B, N) to the metric values (B, len(labels)).
+    '''
+    def decorator(fn):
+        BOOTSTRAP_METRICS[name] = fn
+        return fn
+    return decorator
+
+def bootstrap_weights(n_samples, n_boots, rng, strata=None, method='multinomial'):
+    '''
+    Returns bootstrap weights (n_boots, n_samples).
+    multinomial: every stratum keeps its size, e.g., strata from get_trajectory_labels()
+    poisson: independent Poisson(1) counts, the strata are not used
+    '''
+    if method == 'poisson':
+        return rng.poisson(1.0, (n_boots, n_samples)).astype(float)
+    elif method != 'multinomial':
+        raise ValueError(f"Unknown bootstrap method: {method}")
+    strata = np.zeros(n_samples) if strata is None else np.asarray(strata)
+    weights = np.zeros((n_boots, n_samples))
+    for stratum in np.unique(strata):
+        members = np.flatnonzero(strata == stratum)
+        weights[:, members] = rng.multinomial(len(members), np.full(len(members), 1 / len(members)), size=n_boots)
+    return weights
+
+def _chunk_size(n_columns, budget=2**24):
+    return max(1, budget // max(n_columns, 1))
+
+def _harrell_sums(weights, plan):
+    # Weighted concordant pairs and comparable pairs without tied predictions, per replicate
+    concordant, ties, total = _weighted_harrell_pairs(plan, weights)
+    return (weights * concordant).sum(axis=1), (weights * (total - ties)).sum(axis=1)
+
+def _ratio(numerator, denominator):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return numerator / denominator
+
+def _multi_event_data(data):
+    surv_preds = np.asarray(data['surv_preds'], dtype=float)
+    time_bins = np.asarray(data['time_bins'], dtype=float)
+    test_time = np.asarray(data['test_time'], dtype=float)
+    test_event = np.asarray(data['test_event']).astype(bool)
+    if test_time.ndim == 1:
+        test_time = np.repeat(test_time.reshape(-1, 1), surv_preds.shape[0], axis=1)
+    return surv_preds, time_bins, test_time, test_event
+
+@register_metric('CI')
+def _ci_metric(data):
+    # Per-event Harrell's concordance as in MultiEventEvaluator
+    surv_preds, time_bins, test_time, test_event = _multi_event_data(data)
+    pred_times = predict_median_times(np.clip(surv_preds, 0, None), time_bins)
+    plans = [_harrell_plan(pred_times[k], test_time[:, k], test_event[:, k]) for k in range(len(surv_preds))]
+
+    def evaluate(weights):
+        return np.stack([_ratio(*_harrell_sums(weights, plan)) for plan in plans], axis=1)
+    return [f"CI {k+1}" for k in range(len(surv_preds))], evaluate
+
+@register_metric('GlobalCI')
+def _global_ci_metric(data):
+    # global_C_index() with weight=True, the pairs of all events pooled
+    surv_preds, time_bins, test_time, test_event = _multi_event_data(data)
+    pred_times = predict_median_times(surv_preds, data.get('ci_time_bins'))
+    plans = [_harrell_plan(pred_times[k], test_time[:, k], test_event[:, k]) for k in range(len(surv_preds))]
+
+    def evaluate(weights):
+        concordant, total = (sum(sums) for sums in zip(*[_harrell_sums(weights, plan) for plan in plans]))
+        return _ratio(concordant, total)[:, None]
+    return ['GlobalCI'], evaluate
+
+@register_metric('LocalCI')
+def _local_ci_metric(data):
+    # local_C_index() with weight=True, the pairs are within a patient so the terms are per sample
+    surv_preds, time_bins, test_time, test_event = _multi_event_data(data)
+    pred_times = predict_median_times(surv_preds, data.get('ci_time_bins')).T
+    n_patients, n_events = pred_times.shape
+    patients = np.repeat(np.arange(n_patients), n_events)
+    concordant, ties, total = _harrell_pairs(pred_times.reshape(-1), test_time.reshape(-1),
+                                             test_event.reshape(-1), patients)
+    numerator = np.bincount(patients, weights=concordant, minlength=n_patients)
+    denominator = np.bincount(patients, weights=total - ties, minlength=n_patients)
+
+    def evaluate(weights):
+        return _ratio(weights @ numerator, weights @ denominator)[:, None]
+    return ['LocalCI'], evaluate
+
+def _loss_metric(name):
+    def prepare(data):
+        surv_preds, time_bins, test_time, test_event = _multi_event_data(data)
+        evaluator = MultiEventEvaluator(surv_preds, time_bins, test_time, test_event,
+                                        data['train_time'], data['train_event'])
+        losses = np.stack([event_losses[name] for event_losses in evaluator.sample_losses()], axis=1)
+
+        def evaluate(weights):
+            return (weights @ losses) / weights.sum(axis=1, keepdims=True)
+        return [f"{name} {k+1}" for k in range(losses.shape[1])], evaluate
+    return prepare
+
+# IBS on the fixed grid of the censored test times, the surrogate times come from the training set
+for _name in ['IBS', 'MAEH', 'MAEM', 'MAEPO']:
+    register_metric(_name)(_loss_metric(_name))
+
+def _hierarchical_data(data):
+    mod_out = [np.asarray(out, dtype=float) for out in data['mod_out']]
+    event_times = np.asarray(data['event_times'], dtype=float)
+    labs = np.asarray(data['labs'])
+    return mod_out, event_times, labs, data['num_bins'] + data['num_extra_bin']
+
+def _hierarchical_compare(event_times, labs, anchor_times):
+    # f_compare of hierarchical.util: later times, or censored at the anchor's time
+    return ((event_times[None, :] > anchor_times[:, None] - 1) |
+            ((event_times[None, :] == anchor_times[:, None] - 1) & (labs[None, :] == 0)))
+
+def _hierarchical_anchors(times, labs, max_bin):
+    '''
+    The anchors (observed events) of one event with their time bins. Anchors of the same bin are
+    compared with the same samples, so the bins are returned with their compare masks (G, N) and the
+    bin index of every anchor.
+    '''
+    anchors = np.flatnonzero(labs == 1)
+    anchor_times = np.minimum(np.floor(times[anchors]).astype(int) + 1, max_bin)
+    bins, anchor_bins = np.unique(anchor_times, return_inverse=True)
+    return anchors, anchor_times, bins, anchor_bins.reshape(-1), _hierarchical_compare(times, labs, bins)
+
+def _compared_pairs(weights, anchors, anchor_bins, compare):
+    # Weighted number of compared pairs, the anchors of a bin share their compared samples
+    bin_weights = np.zeros((len(weights), len(compare)))
+    for b in range(len(compare)):
+        bin_weights[:, b] = weights[:, anchors[anchor_bins == b]].sum(axis=1)
+    return (bin_weights * (weights @ compare.T)).sum(axis=1)
+
+@register_metric('C index')
+def _hierarchical_c_metric(data):
+    # hierarchical.util.get_basic_c, per event and their average
+    mod_out, event_times, labs, max_bin = _hierarchical_data(data)
+    n_events = event_times.shape[1]
+    events = []
+    for i in range(n_events):
+        event_out = mod_out[i]
+        anchors, _, bins, anchor_bins, compare = _hierarchical_anchors(event_times[:, i], labs[:, i], max_bin)
+        groups = []
+        for b, anchor_time in enumerate(bins):
+            # The compared samples sorted by their output at the anchor time, each anchor finds its
+            # greater and tied outputs by binary search
+            column = anchor_time if event_out.shape[1] > 1 else 0
+            members = anchors[anchor_bins == b]
+            partners = np.flatnonzero(compare[b])
+            partners = partners[np.argsort(event_out[partners, column], kind='stable')]
+            outputs = event_out[partners, column]
+            groups.append((members, partners, np.searchsorted(outputs, event_out[members, column], side='left'),
+                           np.searchsorted(outputs, event_out[members, column], side='right')))
+        events.append(groups)
+
+    def evaluate(weights):
+        values = np.zeros((len(weights), n_events))
+        for i, groups in enumerate(events):
+            numerator, denominator = np.zeros(len(weights)), np.zeros(len(weights))
+            for members, partners, lower, upper in groups:
+                cumulative = np.hstack([np.zeros((len(weights), 1)), np.cumsum(weights[:, partners], axis=1)])
+                greater = cumulative[:, -1:] - cumulative[:, upper]
+                ties = cumulative[:, upper] - cumulative[:, lower]
+                numerator += (weights[:, members] * (greater + ties / 2)).sum(axis=1)
+                denominator += weights[:, members].sum(axis=1) * cumulative[:, -1]
+            denominator[denominator == 0] = 1
+            values[:, i] = numerator / denominator
+        return np.hstack([values, values.mean(axis=1, keepdims=True)])
+    return [f"C index {i+1}" for i in range(n_events)] + ['C index mean'], evaluate
+
+def _included_times(event_out, times, labs):
+    # Time points at which every sample is still compared, a prefix of the columns
+    k = np.arange(event_out.shape[1])
+    return (times[:, None] > k[None, :] - 1) | ((times[:, None] == k[None, :] - 1) & (labs[:, None] == 0))
+
+def _proposed_values(event_out, times, labs, anchors, anchor_times, first_times, last_times, partners):
+    '''
+    Pair values of hierarchical.util.get_proposed_metric between the anchors and the partners, zero
+    for the pairs that are not compared. The time points from first_times to last_times (exclusive)
+    of every anchor are compared.
+    '''
+    k = np.arange(event_out.shape[1])
+    in_range = (k[None, :] >= first_times[:, None]) & (k[None, :] < last_times[:, None])
+    included = _included_times(event_out, times[partners], labs[partners])
+    values = np.zeros((len(anchors), len(partners)), dtype=np.float32)
+    chunk = _chunk_size(len(partners) * event_out.shape[1])
+    for start in range(0, len(anchors), chunk):
+        rows = slice(start, start + chunk)
+        counted = in_range[rows, None, :] & included[None, :, :]
+        reference = event_out[anchors[rows], None, :]
+        pair_values = (event_out[None, partners, :] > reference) + (event_out[None, partners, :] == reference) / 2
+        comp_d = counted.sum(axis=2)
+        comp_n = (counted * pair_values).sum(axis=2)
+        compare = _hierarchical_compare(times[partners], labs[partners], anchor_times[rows])
+        values[rows] = compare * np.where(comp_d > 0, comp_n / np.maximum(comp_d, 1), 0.5)
+    return values
+
+def _last_times(anchor_times, max_time, n_columns):
+    # End of the compared time points for a replicate whose latest time is max_time
+    last_times = np.full(len(anchor_times), int(max_time + 1))
+    last_times[(last_times == anchor_times) & (last_times + 1 < n_columns)] += 1
+    return last_times if n_columns > 1 else np.ones_like(last_times)
+
+@register_metric('Proposed')
+def _proposed_metric(data):
+    # hierarchical.util.get_proposed_metric, per event and their average
+    mod_out, event_times, labs, max_bin = _hierarchical_data(data)
+    n_samples, n_events = event_times.shape
+    events = []
+    for i in range(n_events):
+        event_out, times = mod_out[i], event_times[:, i]
+        n_columns = event_out.shape[1]
+        anchors, anchor_times, bins, anchor_bins, compare = _hierarchical_anchors(times, labs[:, i], max_bin)
+        first_times = anchor_times if n_columns > 1 else np.zeros_like(anchor_times)
+        # One pair matrix per event, built for all time points: the latest time of a replicate only
+        # cuts the pairs with the samples still compared after it, corrected per replicate group below
+        values = _proposed_values(event_out, times, labs[:, i], anchors, anchor_times, first_times,
+                                  np.full(len(anchors), n_columns), np.arange(n_samples))
+        ends = _included_times(event_out, times, labs[:, i]).sum(axis=1)
+        events.append((anchors, anchor_times, first_times, anchor_bins, compare, values, ends))
+    corrections = {}
+    lock = threading.Lock()
+
+    def correction(i, max_time):
+        # Pairs whose partner is compared after the last time point of the replicates with max_time
+        with lock:
+            if (i, max_time) not in corrections:
+                anchors, anchor_times, first_times, _, _, values, ends = events[i]
+                times = event_times[:, i]
+                last_times = _last_times(anchor_times, max_time, mod_out[i].shape[1])
+                cut_off = last_times.min() if len(anchors) else np.inf
+                partners = np.flatnonzero((times <= max_time) & (ends > cut_off))
+                cut = _proposed_values(mod_out[i], times, labs[:, i], anchors, anchor_times, first_times,
+                                       last_times, partners)
+                corrections[(i, max_time)] = (partners, cut - values[:, partners])
+            return corrections[(i, max_time)]
+
+    def evaluate(weights):
+        values = np.zeros((len(weights), n_events))
+        for i, (anchors, _, _, anchor_bins, compare, pair_values, _) in enumerate(events):
+            # The replicates are grouped by their latest time, each group has its own correction
+            max_times = np.where(weights > 0, event_times[:, i], -np.inf).max(axis=1)
+            for max_time in np.unique(max_times):
+                group = weights[max_times == max_time]
+                partners, cut = correction(i, max_time)
+                numerator = np.zeros(len(group))
+                chunk = _chunk_size(n_samples)
+                for start in range(0, len(anchors), chunk):
+                    rows = slice(start, start + chunk)
+                    partner_sums = (group.astype(np.float32) @ pair_values[rows].T +
+                                    group[:, partners].astype(np.float32) @ cut[rows].T)
+                    numerator += (group[:, anchors[rows]] * partner_sums).sum(axis=1)
+                denominator = _compared_pairs(group, anchors, anchor_bins, compare)
+                denominator[denominator == 0] = 1
+                values[max_times == max_time, i] = numerator / denominator
+        return np.hstack([values, values.mean(axis=1, keepdims=True)])
+    return [f"Proposed {i+1}" for i in range(n_events)] + ['Proposed mean'], evaluate
+
+def _local_proposed_terms(sample_out, event_times, labs, max_bin):
+    # Sum of the anchor values and number of anchors of every patient
+    n_columns = sample_out.shape[2]
+    anchor_times = np.minimum(np.floor(event_times).astype(int) + 1, max_bin)
+    compare = ((event_times[:, None, :] > anchor_times[:, :, None] - 1) |
+               ((event_times[:, None, :] == anchor_times[:, :, None] - 1) & (labs[:, None, :] == 0)))
+    has_anchor = (labs == 1) & compare.any(axis=2)
+    stops = np.minimum(np.where(compare, event_times[:, None, :], -np.inf).max(axis=2) + 1, max_bin - 1)
+    stops = np.where(has_anchor, stops, 0).astype(int)
+    if n_columns == 1:
+        anchor_times, stops = np.zeros_like(anchor_times), np.zeros_like(stops)
+    k = np.arange(n_columns)
+    in_range = (k >= anchor_times[:, :, None]) & (k <= stops[:, :, None])
+    included = (event_times[:, :, None] > k - 1) | ((event_times[:, :, None] == k - 1) & (labs[:, :, None] == 0))
+    counted = in_range[:, :, None, :] & included[:, None, :, :]
+    reference = sample_out[:, :, None, :]
+    pair_values = (sample_out[:, None, :, :] > reference) + (sample_out[:, None, :, :] == reference) / 2
+    comp_d = counted.sum(axis=3)
+    comp_n = (counted * pair_values).sum(axis=3)
+    ratios = np.where(comp_d > 0, comp_n / np.maximum(comp_d, 1), 0.5)
+    anchor_values = (ratios * compare).sum(axis=2) / np.maximum(compare.sum(axis=2), 1)
+    return np.where(has_anchor, anchor_values, 0).sum(axis=1), has_anchor.sum(axis=1)
+
+@register_metric('Local proposed')
+def _local_proposed_metric(data):
+    # hierarchical.util.get_local_eval(..., 'proposed'), the pairs are within a patient
+    mod_out, event_times, labs, max_bin = _hierarchical_data(data)
+    n_samples, n_events = event_times.shape
+    sample_out = np.stack(mod_out, axis=1)  # (N, K, C)
+    chunk = _chunk_size(n_events * n_events * sample_out.shape[2])
+    terms = [_local_proposed_terms(sample_out[start:start + chunk], event_times[start:start + chunk],
+                                   labs[start:start + chunk], max_bin) for start in range(0, n_samples, chunk)]
+    numerator, denominator = (np.concatenate(t) for t in zip(*terms))
+
+    def evaluate(weights):
+        return _ratio(weights @ numerator, weights @ denominator)[:, None]
+    return ['Local proposed'], evaluate
+
+def _prepare_metrics(data, metrics):
+    prepared = [BOOTSTRAP_METRICS[name](data) for name in metrics]
+    labels = [label for metric_labels, _ in prepared for label in metric_labels]
+    return labels, [evaluate for _, evaluate in prepared]
+
+def _evaluate_batch(evaluators, seed, n_boots, n_samples, strata, method):
+    weights = bootstrap_weights(n_samples, n_boots, np.random.default_rng(seed), strata, method)
+    return np.hstack([evaluate(weights) for evaluate in evaluators])
+
+def bootstrap_replicates(data, metrics, n_boots=1000, strata=None, method='multinomial',
+                         n_workers=None, batch_size=100, seed=0):
+    '''
+    Returns (labels, full-sample values (L,), bootstrap values (n_boots, L)) of the registered metrics.
+    data: dict with surv_preds (K, N, T), time_bins, test_time, test_event, train_time, train_event
+    for the multi-event metrics, or mod_out, event_times, labs, num_bins, num_extra_bin for the
+    hierarchical ones. ci_time_bins are passed to GlobalCI/LocalCI like time_bins to global_C_index().
+    strata: labels to resample within, e.g., get_trajectory_labels(labs)
+    n_workers: evaluate the batches in a thread pool of that size, by default in this thread. The
+    threads share the prepared metrics, numpy releases the GIL in the array operations.
+    Every batch has its own seed spawned from seed, so the result does not depend on n_workers.
+    '''
+    n_samples = len(np.asarray(data['test_event'] if 'test_event' in data else data['labs']))
+    labels, evaluators = _prepare_metrics(data, metrics)
+    estimate = np.hstack([evaluate(np.ones((1, n_samples))) for evaluate in evaluators])[0]
+
+    sizes = [min(batch_size, n_boots - start) for start in range(0, n_boots, batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    if n_workers is None or n_workers <= 1:
+        batches = [_evaluate_batch(evaluators, s, size, n_samples, strata, method) for s, size in zip(seeds, sizes)]
+    else:
+        with ThreadPoolExecutor(max_workers=n_workers) as pool:
+            batches = list(pool.map(_evaluate_batch, [evaluators] * len(sizes), seeds, sizes,
+                                    [n_samples] * len(sizes), [strata] * len(sizes), [method] * len(sizes)))
+    return labels, estimate, np.vstack(batches)
+
+def bootstrap_metrics(data, metrics, n_boots=1000, alpha=0.05, **kwargs):
+    '''
+    Percentile bootstrap confidence intervals of the registered metrics, see bootstrap_replicates().
+    Returns a DataFrame with the full-sample estimate, the bootstrap mean and the interval per metric.
+    '''
+    labels, estimate, replicates = bootstrap_replicates(data, metrics, n_boots, **kwargs)
+    lower, upper = np.nanpercentile(replicates, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0)
+    return pd.DataFrame({'Estimate': estimate, 'Mean': np.nanmean(replicates, axis=0),
+                         'Lower': lower, 'Upper': upper}, index=labels)
@@ -0,0 +1,143 @@
+'''
+Binary cache for the real-data loaders. The attributes that load_data() sets on a loader
+(X, y_t, y_e, feature lists, ...) are stored once as .npy files, one per array or data frame
+column, and are memory-mapped on the next call instead of parsing and filtering the CSV again.
+Data frames are built on the memory-mapped columns without copying them, except for object and
+category columns and the index, which are read into memory.
+
+Entries are keyed by loader name and load_data() arguments. Each entry also records a stamp
+of the source files (path, size, mtime) and the source code of the module that defines
+load_data(), so edits to load_data() or to the helpers it calls from that module (e.g., the
+BaseDataLoader methods) rebuild the entry. Helpers imported from other modules are not
+stamped, clear cfg.DATA_CACHE_DIR after changing them.
+'''
+import os
+import json
+import pickle
+import shutil
+import hashlib
+import inspect
+import tempfile
+import functools
+import numpy as np
+import pandas as pd
+import config as cfg
+
+def _digest(obj):
+    return hashlib.sha1(json.dumps(obj, sort_keys=True, default=repr).encode()).hexdigest()[:16]
+
+def _source_stamp(paths, code):
+    stamps = []
+    for path in paths:
+        stat = os.stat(path)
+        stamps.append([str(path), stat.st_size, stat.st_mtime_ns])
+    return _digest({'sources': stamps, 'code': code})
+
+def _save_frame(path, name, frame):
+    for i, column in enumerate(frame.columns):
+        np.save(os.path.join(path, f'{name}_{i:04d}.npy'), frame[column].to_numpy(), allow_pickle=True)
+    np.save(os.path.join(path, f'{name}_index.npy'), frame.index.to_numpy(), allow_pickle=True)
+    return {'columns': list(frame.columns), 'dtypes': [str(dtype) for dtype in frame.dtypes],
+            'index_name': frame.index.name}
+
+def _load_array(path):
+    try:
+        return np.load(path, mmap_mode='c')
+    except ValueError:
+        # Python objects (e.g., object and category columns) can't be memory-mapped
+        return np.load(path, allow_pickle=True)
+
+def _load_frame(path, name, meta):
+    columns = {i: _load_array(os.path.join(path, f'{name}_{i:04d}.npy')) for i in range(len(meta['dtypes']))}
+    index = pd.Index(np.load(os.path.join(path, f'{name}_index.npy'), allow_pickle=True), name=meta['index_name'])
+    # copy=False keeps every column on its memory-mapped array
+    frame = pd.DataFrame(columns, index=index, copy=False)
+    frame.columns = meta['columns']
+    # Only the dtypes that .npy does not keep (e.g., category) are converted, which loads those columns
+    converted = {column: dtype for column, loaded, dtype in zip(meta['columns'], frame.dtypes, meta['dtypes'])
+                 if str(loaded) != dtype}
+    return frame.astype(converted) if converted else frame
+
+def save_dataset(path, attrs, stamp):
+    """
+    Writes the loader attributes attrs to the directory path. Arrays and data frames are
+    stored as .npy files, everything else is pickled together with the stamp.
+    """
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(dir=parent, prefix='.tmp_')
+    meta = {'stamp': stamp, 'arrays': {}, 'frames': {}, 'series': {}, 'objects': {}}
+    for name, value in attrs.items():
+        if isinstance(value, pd.Series):
+            meta['series'][name] = dict(_save_frame(tmp_path, name, value.to_frame()), name=value.name)
+        elif isinstance(value, pd.DataFrame):
+            meta['frames'][name] = _save_frame(tmp_path, name, value)
+        elif isinstance(value, np.ndarray) and value.dtype != object:
+            np.save(os.path.join(tmp_path, f'{name}.npy'), value)
+            meta['arrays'][name] = str(value.dtype)
+        else:
+            meta['objects'][name] = value
+    with open(os.path.join(tmp_path, 'meta.pkl'), 'wb') as f:
+        pickle.dump(meta, f)
+    # Swap the entry in place, another process may have written it in the meantime
+    shutil.rmtree(path, ignore_errors=True)
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+def load_dataset(path, stamp=None):
+    """
+    Reads the loader attributes written by save_dataset(). Returns None if there is no entry
+    at path or if it was written with a different stamp.
+    """
+    try:
+        with open(os.path.join(path, 'meta.pkl'), 'rb') as f:
+            meta = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+    if stamp is not None and meta['stamp'] != stamp:
+        return None
+    attrs = dict(meta['objects'])
+    for name in meta['arrays']:
+        attrs[name] = _load_array(os.path.join(path, f'{name}.npy'))
+    for name, frame_meta in meta['frames'].items():
+        attrs[name] = _load_frame(path, name, frame_meta)
+    for name, series_meta in meta['series'].items():
+        attrs[name] = _load_frame(path, name, series_meta).iloc[:, 0].rename(series_meta['name'])
+    return attrs
+
+def cached_dataset(*sources):
+    """
+    Decorator for load_data() of the real-data loaders. sources are the files the loader
+    depends on, relative to cfg.DATA_DIR unless absolute. Set cfg.USE_DATA_CACHE to False
+    to always run load_data().
+    """
+    def decorator(load_data):
+        signature = inspect.signature(load_data)
+        try:
+            with open(inspect.getsourcefile(load_data)) as f:
+                code = f.read()
+        except (OSError, TypeError):
+            code = load_data.__qualname__
+
+        @functools.wraps(load_data)
+        def wrapper(self, *args, **kwargs):
+            if not cfg.USE_DATA_CACHE:
+                return load_data(self, *args, **kwargs)
+            bound = signature.bind(self, *args, **kwargs)
+            bound.apply_defaults()
+            params = {key: value for key, value in bound.arguments.items() if key != 'self'}
+            paths = [source if os.path.isabs(source) else os.path.join(cfg.DATA_DIR, source)
+                     for source in sources]
+            stamp = _source_stamp(paths, code)
+            path = os.path.join(cfg.DATA_CACHE_DIR, type(self).__name__, _digest(params))
+            attrs = load_dataset(path, stamp)
+            if attrs is not None:
+                self.__dict__.update(attrs)
+                return self
+            result = load_data(self, *args, **kwargs)
+            save_dataset(path, vars(self), stamp)
+            return result
+        return wrapper
+    return decorator
@@ -1,6 +1,7 @@
-from SurvivalEVAL import LifelinesEvaluator
 import pandas as pd
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from scipy.stats import chisquare
 
 def sort_by_time(surv_pred_event, temp_test_time, temp_test_event):
     '''
@@ -18,77 +19,478 @@ def sort_by_time(surv_pred_event, temp_test_time, temp_test_event):
     surv_pred_event = surv_pred_event.drop(['time', 'event'], axis=1)
     return surv_pred_event, temp_test_time, temp_test_event
 
-def all_events_ci(mod_out, test_time, test_event):
+def predict_median_times(surv_preds, time_bins=None):
+    '''
+    Median survival times of a stack of curves, same rules as SurvivalEVAL: linear
+    interpolation at the 0.5 crossing, else the line through (0, 1) and the last point.
+    surv_preds: np.array (..., T)
+    time_bins: np.array (T,), defaults to the bin indices like an evaluator built on a plain DataFrame
+    Returns np.array (...)
+    '''
+    surv_preds = np.asarray(surv_preds, dtype=float)
+    n_bins = surv_preds.shape[-1]
+    time_bins = np.arange(n_bins, dtype=float) if time_bins is None else np.asarray(time_bins, dtype=float)
+    curves = surv_preds.reshape(-1, n_bins)
+
+    below = curves <= 0.5
+    crosses = below.any(axis=1)
+    idx = np.argmax(below, axis=1)
+    prev_idx = np.maximum(idx - 1, 0)
+    rows = np.arange(len(curves))
+    t1, t2 = time_bins[prev_idx], time_bins[idx]
+    p1, p2 = curves[rows, prev_idx], curves[rows, idx]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        interpolated = np.where((idx == 0) | (p2 == 0.5), t2, t1 + (0.5 - p1) * (t2 - t1) / (p2 - p1))
+        extrapolated = 0.5 * time_bins.max() / (1 - curves.min(axis=1))
+    median_times = np.where(crosses, interpolated, extrapolated)
+    return median_times.reshape(surv_preds.shape[:-1])
+
+def _greater_before_plan(values, queries, groups=None, before=None):
+    '''
+    Sort orders to count, for every position i, the positions j < before[i] (by default i) in the
+    same group with values[j] > queries[i] (values, queries: non-negative int arrays). Radix over the
+    bits of the values, each level is one stable sort, so the cost is O(N log N log V) without Python
+    loops over samples. The plan is shared by every weighting of the samples.
+    Returns (N, levels), see _weighted_greater_before().
+    '''
+    n = len(values)
+    if n == 0:
+        return n, []
+    groups = np.zeros(n, dtype=np.int64) if groups is None else np.asarray(groups, dtype=np.int64)
+    n_bits = max(int(max(values.max(), queries.max())).bit_length(), 1)
+    pos = np.arange(n)
+    before = pos if before is None else np.asarray(before)
+    # Stores and queries merged, a query at the same position comes first so j = before[i] is not counted
+    is_query = np.concatenate([np.zeros(n, dtype=np.int64), np.ones(n, dtype=np.int64)])
+    all_pos = np.concatenate([pos, before])
+    all_index = np.concatenate([pos, pos])
+    levels = []
+    for b in range(n_bits):
+        # values[j] > queries[i] iff they agree above the highest differing bit b, where j has a 1
+        keys = np.concatenate([groups << n_bits | values >> (b + 1), groups << n_bits | queries >> (b + 1)])
+        bits = np.concatenate([(values >> b) & 1, (queries >> b) & 1])
+        order = np.lexsort((1 - is_query, all_pos, keys))
+        keys, bits, query = keys[order], bits[order], is_query[order]
+        new_key = np.r_[True, keys[1:] != keys[:-1]]
+        start = np.flatnonzero(new_key)[np.cumsum(new_key) - 1]
+        stores = np.flatnonzero((bits == 1) & (query == 0))
+        queried = np.flatnonzero((bits == 0) & (query == 1))
+        levels.append((stores, all_index[order][stores], queried, start[queried], all_index[order][queried]))
+    return n, levels
+
+def _weighted_greater_before(plan, weights):
+    '''
+    For every row of weights (B, N) and position i, sums the weights of the positions counted by the
+    plan of _greater_before_plan(). Returns np.array (B, N).
+    '''
+    n, levels = plan
+    sums = np.zeros((len(weights), n))
+    for stores, store_pos, queried, query_start, query_pos in levels:
+        # Cumulative weight of the stores with a 1 along the sorted keys, per key from its start
+        stored = np.zeros((len(weights), 2 * n + 1))
+        stored[:, stores + 1] = weights[:, store_pos]
+        stored = np.cumsum(stored, axis=1)
+        sums[:, query_pos] += stored[:, queried + 1] - stored[:, query_start]
+    return sums
+
+def _harrell_plan(pred_times, test_time, test_event, groups=None):
+    '''
+    Sorted order and counting plans of Harrell's comparable pairs (see _harrell_pairs()), shared by
+    every weighting of the samples, e.g., the bootstrap replicates.
+    '''
+    test_time = np.asarray(test_time)
+    test_event = np.asarray(test_event).astype(bool)
+    n = len(test_time)
+    groups = np.zeros(n, dtype=np.int64) if groups is None else np.asarray(groups, dtype=np.int64)
+    # Censored samples come first within a time, so they are before the events at that time
+    order = np.lexsort((test_event, -test_time, groups))
+    group, times, events = groups[order], test_time[order], test_event[order]
+    ranks = np.unique(np.asarray(pred_times)[order], return_inverse=True)[1].reshape(-1).astype(np.int64) + 1
+    new_group = np.r_[True, group[1:] != group[:-1]]
+    new_block = new_group | np.r_[True, times[1:] != times[:-1]] | np.r_[True, events[1:] != events[:-1]]
+    block_start = np.flatnonzero(new_block)[np.cumsum(new_block) - 1]
+    group_start = np.flatnonzero(new_group)[np.cumsum(new_group) - 1]
+    # Longer and not shorter predicted times among the positions of the group before the anchor's block
+    plans = [_greater_before_plan(ranks, queries, group, block_start) for queries in (ranks, ranks - 1)]
+    return order, events, block_start, group_start, plans
+
+def _weighted_harrell_pairs(plan, weights):
+    '''
+    Harrell's pairs of every anchor weighted by the partners: for every row of weights (B, N), the
+    summed weights of the concordant, tied and all comparable samples of each anchor.
+    Returns np.arrays (B, N) in the original order, zero for the censored samples.
+    '''
+    order, events, block_start, group_start, plans = plan
+    weights = weights[:, order]
+    greater, greater_equal = (_weighted_greater_before(p, weights) for p in plans)
+    cumulative = np.hstack([np.zeros((len(weights), 1)), np.cumsum(weights, axis=1)])
+    pairs = []
+    for counts in (greater, greater_equal - greater,
+                   cumulative[:, block_start] - cumulative[:, group_start]):
+        anchor_counts = np.zeros_like(counts)
+        anchor_counts[:, order] = np.where(events, counts, 0)
+        pairs.append(anchor_counts)
+    return tuple(pairs)
+
+def _harrell_pairs(pred_times, test_time, test_event, groups=None):
+    '''
+    Harrell's comparable pairs with the rules of SurvivalEVAL 0.2: anchors are the observed events,
+    compared with every sample with a strictly later time and with the censored samples at the same time.
+    A longer predicted time for the other sample is concordant. With groups, only samples of the same
+    group are paired (e.g., the events of one patient).
+    Returns np.arrays (N,) of concordant pairs, tied predictions and total pairs per anchor.
+    '''
+    plan = _harrell_plan(pred_times, test_time, test_event, groups)
+    pairs = _weighted_harrell_pairs(plan, np.ones((1, len(plan[0]))))
+    return tuple(np.rint(counts[0]).astype(np.int64) for counts in pairs)
+
+def _harrell_counts(pred_times, test_time, test_event):
+    '''
+    Harrell's concordance of one event like LifelinesEvaluator.concordance() (ties="None"), the pairs
+    with tied predictions are left out.
+    Returns (concordant pairs, total pairs).
+    '''
+    concordant, ties, total = _harrell_pairs(pred_times, test_time, test_event)
+    return concordant.sum(), total.sum() - ties.sum()
+
+def _antolini_counts(surv_pred, test_time, test_event, time_bins):
+    '''
+    Time-dependent concordance of one event: every anchor compares S_i(t_i) < S_j(t_i) with the
+    samples of strictly later time. All anchors with the same time share one sorted candidate set.
+    '''
+    test_time = np.asarray(test_time, dtype=float)
+    test_event = np.asarray(test_event).astype(bool)
+    concordant, total = 0.0, 0.0
+    for t in np.unique(test_time[test_event]):
+        # Curves at t by linear interpolation on the time bins
+        j = np.clip(np.searchsorted(time_bins, t, side='right') - 1, 0, len(time_bins) - 2)
+        w = np.clip((t - time_bins[j]) / (time_bins[j + 1] - time_bins[j]), 0, 1)
+        surv_t = (1 - w) * surv_pred[:, j] + w * surv_pred[:, j + 1]
+        candidates = np.sort(surv_t[test_time > t])
+        anchors = surv_t[(test_time == t) & test_event]
+        n_greater = len(candidates) - np.searchsorted(candidates, anchors, side='right')
+        n_ties = np.searchsorted(candidates, anchors, side='right') - np.searchsorted(candidates, anchors, side='left')
+        concordant += n_greater.sum() + n_ties.sum() / 2
+        total += len(candidates) * len(anchors)
+    return concordant, total
+
+def concordance_counts(surv_preds, test_time, test_event, time_bins=None, method='Harrell'):
+    '''
+    Concordance of every event from a (K, N, T) survival array.
+    method: 'Harrell' on the predicted median times (see _harrell_counts), or 'Antolini' on the curves
+    at the anchor times (tied curves as half).
+    Returns np.arrays (K,) of concordant pairs and total pairs.
+    '''
+    surv_preds = np.asarray(surv_preds, dtype=float)
+    n_events = surv_preds.shape[0]
+    time_bins = np.arange(surv_preds.shape[-1], dtype=float) if time_bins is None else np.asarray(time_bins, dtype=float)
+    if method == 'Harrell':
+        pred_times = predict_median_times(surv_preds, time_bins)
+        counts = [_harrell_counts(pred_times[k], test_time[:, k], test_event[:, k]) for k in range(n_events)]
+    elif method == 'Antolini':
+        counts = [_antolini_counts(surv_preds[k], test_time[:, k], test_event[:, k], time_bins)
+                  for k in range(n_events)]
+    else:
+        raise ValueError(f"Unknown concordance method: {method}")
+    concordant, total = (np.array(c, dtype=float) for c in zip(*counts))
+    return concordant, total
+
+def all_events_ci(mod_out, test_time, test_event, time_bins=None):
     '''
     all events
-    mod_out: List of surv pred
+    mod_out: List of surv pred or np.array (K, N, T)
     test_time: np.array of float/int #patient, #event
     test_event: np.array of binary #patient, #event
     '''
-    surv_pred_event = pd.concat([pd.DataFrame(surv_pred) for surv_pred in mod_out])
-    surv_pred_event = surv_pred_event.reset_index(drop=True)
-    temp_test_time = np.concatenate([test_time[:, event_id] for event_id in range(test_time.shape[1])])
-    temp_test_event = np.concatenate([test_event[:, event_id] for event_id in range(test_event.shape[1])])
+    surv_preds = np.asarray(mod_out, dtype=float)
+    pred_times = predict_median_times(surv_preds, time_bins).reshape(-1)
+    concordant, total = _harrell_counts(pred_times, np.asarray(test_time).T.reshape(-1),
+                                        np.asarray(test_event).T.reshape(-1))
+    return concordant / total
 
-    surv_pred_event, temp_test_time, temp_test_event = sort_by_time(surv_pred_event, temp_test_time, temp_test_event)
-    evaluator = LifelinesEvaluator(surv_pred_event.T, temp_test_time, temp_test_event)
-
-    cindex, _, _ = evaluator.concordance()
-    return cindex
-
-def global_C_index(mod_out, test_time, test_event, weight=True):
+def global_C_index(mod_out, test_time, test_event, weight=True, time_bins=None, method='Harrell'):
     '''
     each events
-    mod_out: List of surv pred
+    mod_out: List of surv pred or np.array (K, N, T)
     test_time: np.array of float/int #patient, #event
     test_event: np.array of binary #patient, #event
     '''
-    cindex_list = []
-    global_total_pairs = 0.0
-    global_concordant_pairs = 0.0
-    for event_id in range(len(mod_out)):
-        surv_pred_event = pd.DataFrame(mod_out[event_id])
-        temp_test_time = test_time[:,event_id]
-        temp_test_event = test_event[:,event_id]
-
-        surv_pred_event, temp_test_time, temp_test_event = sort_by_time(surv_pred_event, temp_test_time, temp_test_event)
-        evaluator = LifelinesEvaluator(surv_pred_event.T, temp_test_time, temp_test_event)
-
-        cindex, concordant_pairs, total_pairs = evaluator.concordance()
-        cindex_list.append(cindex)
-        global_total_pairs += total_pairs
-        global_concordant_pairs += concordant_pairs
+    concordant, total = concordance_counts(mod_out, np.asarray(test_time), np.asarray(test_event),
+                                           time_bins, method)
     if weight:
-        return global_concordant_pairs/global_total_pairs
+        return concordant.sum() / total.sum()
     else:
-        return np.mean(cindex_list)
+        return np.mean(concordant / total)
 
-def local_C_index(mod_out, test_time, test_event, weight=True):
+def local_C_index(mod_out, test_time, test_event, weight=True, time_bins=None):
     '''
-    each patient
-    mod_out: List of surv pred
+    each patient, the K events of a patient are compared with each other
+    mod_out: List of surv pred or np.array (K, N, T)
     test_time: np.array of float/int #patient, #event
     test_event: np.array of binary #patient, #event
     '''
-    cindex_list = []
-    global_total_pairs = 0.0
-    global_concordant_pairs = 0.0
-    for patient_id in range(test_time.shape[0]):
-        surv_pred_patient = np.column_stack([mod_out[event_index][patient_id, :] for event_index in range(len(mod_out))]).T
-
-        surv_pred_event = pd.DataFrame(surv_pred_patient)
-        temp_test_time = test_time[patient_id,:]
-        temp_test_event = test_event[patient_id,:]
-        if np.sum(temp_test_event) != 0:
-            try:
-                evaluator = LifelinesEvaluator(surv_pred_event.T, temp_test_time, temp_test_event)
-                cindex, concordant_pairs, total_pairs = evaluator.concordance()
-                cindex_list.append(cindex)
-                global_total_pairs += total_pairs
-                global_concordant_pairs += concordant_pairs
-            except:
-                continue    
+    pred_times = predict_median_times(mod_out, time_bins).T # (N, K)
+    n_patients, n_events = pred_times.shape
+    patients = np.repeat(np.arange(n_patients), n_events)
+    concordant, ties, total = _harrell_pairs(pred_times.reshape(-1), np.asarray(test_time).reshape(-1),
+                                             np.asarray(test_event).reshape(-1), patients)
+    patient_concordant = np.bincount(patients, weights=concordant, minlength=n_patients)
+    patient_total = np.bincount(patients, weights=total - ties, minlength=n_patients)
     if weight:
-        return global_concordant_pairs/global_total_pairs
+        return patient_concordant.sum() / patient_total.sum()
     else:
-        return np.mean(cindex_list)
+        # Patients without comparable pairs (or only tied ones) have no local C-index
+        has_pairs = patient_total > 0
+        return np.mean(patient_concordant[has_pairs] / patient_total[has_pairs])
+
+def _kaplan_meier(unique_times, inverse, counts, event):
+    '''
+    Kaplan-Meier estimate from the unique decomposition of the times, so fits that share the
+    times (e.g., the event and the censoring curve, or competing events) share the sort.
+    Returns (number at risk, number of events, survival probabilities) at the unique times.
+    '''
+    n_events = np.bincount(inverse, weights=event, minlength=len(unique_times))
+    population = np.cumsum(counts[::-1])[::-1]
+    return population, n_events, np.cumprod(1 - n_events / population)
+
+def _step_predict(times, probs, target_times):
+    # Kaplan-Meier step function, 1 before the first time
+    return np.append(1, probs)[np.digitize(target_times, times)]
+
+def _interpolation_weights(time_bins, target_times):
+    '''
+    Linear interpolation of curves on time_bins at target_times, like SurvivalEVAL: extrapolated with
+    the first segment before the first bin and with the line through (0, 1) and the last point after the last bin.
+    '''
+    j = np.clip(np.searchsorted(time_bins, target_times, side='right') - 1, 0, len(time_bins) - 2)
+    w = (target_times - time_bins[j]) / (time_bins[j + 1] - time_bins[j])
+    return j, w, target_times / time_bins[-1]
+
+def _interpolate(surv_pred, weights):
+    j, w, ratio = weights
+    values = (1 - w) * surv_pred[:, j] + w * surv_pred[:, j + 1]
+    extrapolated = np.maximum(1 - (1 - surv_pred[:, -1:]) * ratio, 0)
+    return np.where(ratio > 1, extrapolated, values)
+
+def _km_means(times, probs):
+    '''
+    SurvivalEVAL's km_mean() of several curves on the same times, probs: (M, U).
+    Trapezoid area from (0, 1) plus the linear tail to zero, divided by the probability at time 0.
+    '''
+    area_times = np.append(0, times)
+    area_probs = np.hstack([np.ones((len(probs), 1)), probs])
+    area = (np.diff(area_times) * (area_probs[:, :-1] + area_probs[:, 1:]) / 2).sum(axis=1)
+    last_probs = probs[:, -1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tail = np.where(last_probs != 0, (times[-1] / (1 - last_probs) - times[-1]) * last_probs / 2, 0)
+    return (area + tail) / area_probs[:, np.digitize(0, times)]
+
+def _margin_best_guess(km_times, km_probs, censor_times):
+    '''
+    Residual mean life of the censored samples on the training KM curve, SurvivalEVAL's KaplanMeierArea.best_guess().
+    '''
+    area_times = np.append(0, km_times)
+    area_probs = np.append(1, km_probs)
+    km_linear_zero = -1 / ((area_probs[-1] - 1) / area_times[-1])
+    if km_probs[-1] != 0:
+        area_times = np.append(area_times, km_linear_zero)
+        area_probs = np.append(area_probs, 0)
+    area = np.append(np.cumsum((np.diff(area_times) * (area_probs[:-1] + area_probs[1:]) / 2)[::-1])[::-1], 0)
+    area_times = np.append(area_times, np.inf)
+
+    slope = (1 - km_probs.min()) / (0 - km_times.max())
+    surv_prob = np.where(censor_times <= km_times.max(), _step_predict(km_times, km_probs, censor_times),
+                         1 + censor_times * slope)
+    surv_prob = np.clip(surv_prob, 1e-10, None)
+    idx = np.digitize(censor_times, area_times)
+    beyond = idx > len(area_times) - 2
+    idx = np.minimum(idx, len(area_probs) - 1)
+    censor_area = (area_times[idx] - censor_times) * (area_probs[idx] + surv_prob) * 0.5 + area[idx]
+    best_guess = censor_times + np.where(beyond, 0, censor_area) / surv_prob
+
+    if np.isinf(km_linear_zero):
+        km_linear_zero = km_times.max()
+    return np.where(censor_times > km_linear_zero, censor_times, best_guess)
+
+def _pseudo_obs_best_guess(km_times, population, n_events, n_train, censor_times, chunk_size=2**22):
+    '''
+    Pseudo-observations of the censored samples: (n + 1) * mean of the KM curve with the sample added
+    minus n * mean of the KM curve, SurvivalEVAL's MAE Pseudo_obs. Adding a censored sample at c only
+    raises the number at risk at the times <= c, so all samples with the same insert position share one
+    curve and the curves of all positions are built as one (chunked) cumprod.
+    '''
+    rows = np.flatnonzero(n_events != 0)
+    if rows[-1] != len(n_events) - 1:
+        rows = np.append(rows, len(n_events) - 1)
+    times, population, n_events = km_times[rows], population[rows], n_events[rows]
+    multiplier = 1 - n_events / population
+    multiplier_total = 1 - n_events / (population + 1)
+    sub_expect_time = _km_means(times, np.cumprod(multiplier)[None])[0]
+
+    insert_index = np.searchsorted(times, censor_times, side='right')
+    positions, position_inverse = np.unique(insert_index, return_inverse=True)
+    n_times = len(times)
+    total_expect_time = np.empty(len(positions))
+    chunk = max(1, chunk_size // n_times)
+    for start in range(0, len(positions), chunk):
+        block = positions[start:start + chunk]
+        probs = np.cumprod(np.where(np.arange(n_times) < block[:, None], multiplier_total, multiplier), axis=1)
+        total_expect_time[start:start + chunk] = _km_means(times, probs)
+    total_expect_time = total_expect_time[position_inverse]
+
+    # Censored after the last time: the curve is extended flat to c before the linear tail
+    after = insert_index == n_times
+    if after.any():
+        c = censor_times[after]
+        probs = np.cumprod(multiplier_total)
+        last_prob = probs[-1]
+        area = np.sum(np.diff(np.append(0, times)) * (np.append(1, probs[:-1]) + probs) / 2)
+        area = area + (c - times[-1]) * last_prob
+        if last_prob != 0:
+            area = area + (c / (1 - last_prob) - c) * last_prob / 2
+        total_expect_time[after] = area / np.append(1, probs)[np.digitize(0, times)]
+    return (n_train + 1) * total_expect_time - n_train * sub_expect_time
+
+def _d_calibration(surv_probs, event, num_bins=10):
+    '''
+    D-calibration histogram of the survival probabilities at the observed times and the p-value of
+    its chi-square test. Censored samples are split over their bin and all later bins.
+    '''
+    quantile = np.linspace(1, 0, num_bins + 1)
+    event_position = np.clip(np.digitize(surv_probs[event], quantile), 1, num_bins)
+    hist = np.bincount(event_position - 1, minlength=num_bins).astype(float)
+
+    probs = surv_probs[~event]
+    hist += 1 / num_bins * (probs == 1).sum()
+    probs = probs[(probs >= 0) & (probs < 1)]
+    position = np.digitize(probs, quantile) - 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        first_bin = np.where(probs != 0, (probs - quantile[position + 1]) / probs, 1)
+        rest_bins = np.where(probs != 0, 1 / (num_bins * probs), 0)
+    hist += np.bincount(position, weights=first_bin, minlength=num_bins)
+    hist[1:] += np.cumsum(np.bincount(position, weights=rest_bins, minlength=num_bins))[:-1]
+    return chisquare(hist)[1], hist
+
+def _event_losses(inputs):
+    '''
+    Per-sample terms of one event whose means are the IBS and the MAEs, with the survival probabilities
+    at the observed times. The Brier scores use the fixed grid of distinct censored test times.
+    '''
+    (surv_pred, pred_times, test_time, test_event, grid, grid_inverse, weights, train_km, n_train) = inputs
+    km_times, population, n_events, n_censored, km_probs = train_km
+
+    # Curves at every distinct test time, shared by the D-calibration and the Brier scores
+    surv_grid = _interpolate(surv_pred, weights)
+    surv_at_time = surv_grid[np.arange(len(test_time)), grid_inverse]
+
+    # IPCW Brier scores at the distinct censored test times
+    target_times = np.unique(test_time[~test_event])
+    if target_times.size == 0:
+        raise ValueError("You don't have censor data in the testset, "
+                         "please provide \"num_points\" for calculating IBS")
+    preds = surv_grid[:, np.searchsorted(grid, target_times)]
+    censor_probs = np.cumprod(1 - n_censored / population)
+    ipc_time = _step_predict(km_times, censor_probs, test_time)
+    ipc_target = _step_predict(km_times, censor_probs, target_times)
+    ipc_time[ipc_time == 0] = np.inf
+    ipc_target[ipc_target == 0] = np.inf
+    weight_cat1 = ((test_time[:, None] <= target_times) & test_event[:, None]) / ipc_time[:, None]
+    weight_cat2 = (test_time[:, None] > target_times) / ipc_target
+    brier_losses = preds ** 2 * weight_cat1 + (1 - preds) ** 2 * weight_cat2
+    integral = np.sum(np.diff(target_times) * (brier_losses[:, 1:] + brier_losses[:, :-1]) / 2, axis=1)
+
+    errors = test_time - pred_times
+    censor_times = test_time[~test_event]
+    margin_times = test_time.astype(float)
+    margin_times[~test_event] = _margin_best_guess(km_times, km_probs, censor_times)
+    pseudo_times = test_time.astype(float)
+    pseudo_times[~test_event] = _pseudo_obs_best_guess(km_times, population, n_events, n_train, censor_times)
+    return {'IBS': integral / (target_times.max() - target_times.min()),
+            'MAEH': np.abs(np.where(test_event, errors, np.maximum(errors, 0))),
+            'MAEM': np.abs(margin_times - pred_times),
+            'MAEPO': np.abs(pseudo_times - pred_times),
+            'surv_at_time': surv_at_time}
+
+def _evaluate_event(inputs):
+    '''
+    All metrics of one event, see MultiEventEvaluator. Top-level so it can run in a process pool.
+    '''
+    pred_times, test_time, test_event = inputs[1:4]
+    losses = _event_losses(inputs)
+    concordant, total = _harrell_counts(pred_times, test_time, test_event)
+    ci = concordant / total
+    d_calib = _d_calibration(losses['surv_at_time'], test_event)[0]
+    return [ci] + [np.mean(losses[name]) for name in ['IBS', 'MAEH', 'MAEM', 'MAEPO']] + [d_calib]
+
+class MultiEventEvaluator:
+    '''
+    Evaluates the survival curves of all K events in one pass, with the metrics and default arguments of
+    SurvivalEVAL's LifelinesEvaluator: CI (Harrell on the median times, tied predictions excluded), IBS
+    (IPCW, at the censored test times), MAE Hinge, Margin and Pseudo_obs (unweighted) and the
+    D-calibration p-value. The median times of all events are computed at once, and the interpolation at
+    the test times and the sort of the training times are computed once per distinct time column, so
+    competing risks with shared times share them. The events can be evaluated in a process pool.
+    mod_out: List of surv pred or np.array (K, N, T)
+    time_bins: np.array (T,)
+    test_time, train_time: np.array of float/int #patient, #event or #patient if all events share the times
+    test_event, train_event: np.array of binary #patient, #event
+    '''
+    metrics = ["CI", "IBS", "MAEH", "MAEM", "MAEPO", "DCalib"]
+
+    def __init__(self, mod_out, time_bins, test_time, test_event, train_time, train_event):
+        self.surv_preds = np.clip(np.asarray(mod_out, dtype=float), 0, None)
+        self.time_bins = np.asarray(time_bins, dtype=float)
+        self.n_events = self.surv_preds.shape[0]
+        self.test_time, self.test_event, self.train_time, self.train_event = \
+            (self._as_columns(a) for a in [test_time, test_event, train_time, train_event])
+        self.test_event = self.test_event.astype(bool)
+        self._unique_times = {}
+        self._weights = {}
+
+    def _as_columns(self, a):
+        a = np.asarray(a)
+        return np.repeat(a.reshape(-1, 1), self.n_events, axis=1) if a.ndim == 1 else a
+
+    def _unique(self, times):
+        key = times.tobytes()
+        if key not in self._unique_times:
+            unique_times, inverse, counts = np.unique(times, return_inverse=True, return_counts=True)
+            self._unique_times[key] = (unique_times, inverse.reshape(-1), counts)
+        return self._unique_times[key]
+
+    def _interpolation(self, grid):
+        key = grid.tobytes()
+        if key not in self._weights:
+            self._weights[key] = _interpolation_weights(self.time_bins, grid)
+        return self._weights[key]
+
+    def _event_inputs(self, k, pred_times):
+        test_time = self.test_time[:, k].astype(float)
+        grid, grid_inverse, _ = self._unique(test_time)
+        unique_times, inverse, counts = self._unique(self.train_time[:, k].astype(float))
+        train_event = self.train_event[:, k].astype(float)
+        population, n_events, km_probs = _kaplan_meier(unique_times, inverse, counts, train_event)
+        train_km = (unique_times, population, n_events, counts - n_events, km_probs)
+        return (self.surv_preds[k], pred_times, test_time, self.test_event[:, k], grid, grid_inverse,
+                self._interpolation(grid), train_km, len(train_event))
+
+    def evaluate(self, n_workers=None):
+        '''
+        Returns a DataFrame with one row of metrics per event.
+        n_workers: evaluate the events in a process pool of that size, by default in this process
+        '''
+        pred_times = predict_median_times(self.surv_preds, self.time_bins)
+        inputs = [self._event_inputs(k, pred_times[k]) for k in range(self.n_events)]
+        if n_workers is None or n_workers <= 1:
+            rows = [_evaluate_event(event_inputs) for event_inputs in inputs]
+        else:
+            with ProcessPoolExecutor(max_workers=n_workers) as pool:
+                rows = list(pool.map(_evaluate_event, inputs))
+        return pd.DataFrame(rows, columns=self.metrics)
+
+    def sample_losses(self):
+        '''
+        Returns the per-sample terms of every event (see _event_losses), e.g., for weighted bootstraps.
+        '''
+        pred_times = predict_median_times(self.surv_preds, self.time_bins)
+        return [_event_losses(self._event_inputs(k, pred_times[k])) for k in range(self.n_events)]
@@ -98,6 +98,71 @@ def argmax_approx(
         return nominator.squeeze() / denominator
 
 
+def cox_log_risk_set(
+        risk_pred: torch.Tensor,
+        true_times: torch.Tensor,
+        true_indicator: torch.Tensor,
+        ties: str = 'breslow'
+) -> torch.Tensor:
+    """Computes the log-denominator of the Cox partial likelihood for every sample
+    by sorting once, in O(N log N) time and O(N) memory.
+
+    Parameters
+    ----------
+    risk_pred : torch.Tensor, shape (num_samples, )
+        Risk prediction from Cox-based model.
+    true_times : torch.Tensor, shape (num_samples, )
+        Tensor with the censor/event time.
+    true_indicator : torch.Tensor, shape (num_samples, )
+        Tensor with the censor indicator.
+    ties
+        'breslow' uses the full risk set for tied times, 'efron' removes
+        the tied events from the risk set in equal fractions.
+
+    Returns
+    -------
+    torch.Tensor, shape (num_samples, )
+        log sum_{j: t_j >= t_i} exp(risk_j), with the Efron correction for tied events.
+    """
+    risk_pred = risk_pred.reshape(-1)
+    true_times = true_times.reshape(-1)
+    true_indicator = true_indicator.reshape(-1).to(risk_pred.dtype)
+
+    # Descending times, so the risk set of a sample is a prefix
+    order = torch.argsort(true_times, descending=True)
+    risk = risk_pred[order]
+    times = true_times[order]
+    events = true_indicator[order]
+
+    # All samples with the same time share the risk set up to the last of them
+    _, counts = torch.unique_consecutive(times, return_counts=True)
+    group = torch.repeat_interleave(torch.arange(len(counts), device=risk.device), counts)
+    last = torch.cumsum(counts, dim=0) - 1
+    log_risk_set = torch.logcumsumexp(risk, dim=0)[last]
+
+    if ties == 'breslow':
+        log_denominator = log_risk_set[group]
+    elif ties == 'efron':
+        # log(R - l/d * D) for the l-th of the d tied events, with D their summed exp(risk)
+        n_groups = len(counts)
+        max_risk = risk.max().detach()
+        tied_sum = torch.zeros(n_groups, dtype=risk.dtype, device=risk.device).index_add(
+            0, group, torch.exp(risk - max_risk) * events)
+        n_tied = torch.zeros(n_groups, dtype=risk.dtype, device=risk.device).index_add(0, group, events)
+        log_tied = torch.log(torch.where(n_tied > 0, tied_sum, torch.ones_like(tied_sum))) + max_risk
+        cum_events = torch.cumsum(events, dim=0) - events
+        first = last - counts + 1
+        rank = cum_events - cum_events[first][group]
+        # Censored samples are not corrected, their denominators are not used by the likelihood
+        fraction = rank / torch.clamp_min(n_tied, 1)[group] * events
+        log_denominator = log_risk_set[group] + torch.log1p(
+            -fraction * torch.exp(log_tied[group] - log_risk_set[group]))
+    else:
+        raise ValueError(f"Unknown ties method: {ties}")
+
+    # Back to the input order
+    return log_denominator[torch.argsort(order)]
+
 def cox_nll(
         risk_pred: torch.Tensor,
         precision: torch.Tensor,
@@ -105,7 +170,8 @@ def cox_nll(
         true_times: torch.Tensor,
         true_indicator: torch.Tensor,
         model: torch.nn.Module,
-        C1: float
+        C1: float,
+        ties: str = 'breslow'
 ) -> torch.Tensor:
     """Computes the negative log-likelihood of a batch of model predictions.
 
@@ -121,22 +187,17 @@ def cox_nll(
         PyTorch Module with at least `MTLR` layer.
     C1
         The L2 regularization strength.
+    ties
+        Handling of tied event times, 'breslow' or 'efron'.
 
     Returns
     -------
     torch.Tensor
         The negative log likelihood.
     """
-    eps = 1e-20
     risk_pred = risk_pred.reshape(-1, 1)
-    true_times = true_times.reshape(-1, 1)
+    log_loss = cox_log_risk_set(risk_pred, true_times, true_indicator, ties).reshape(-1, 1)
     true_indicator = true_indicator.reshape(-1, 1)
-    mask = torch.ones(true_times.shape[0], true_times.shape[0]).to(true_times.device)
-    mask[(true_times.T - true_times) > 0] = 0
-    max_risk = risk_pred.max()
-    log_loss = torch.exp(risk_pred - max_risk) * mask
-    log_loss = torch.sum(log_loss, dim=0)
-    log_loss = torch.log(log_loss + eps).reshape(-1, 1) + max_risk
     # Sometimes in the batch we got all censoring data, so the denominator gets 0 and throw nan.
     # Solution: Consider increase the batch size. Afterall the nll should performed on the whole dataset.
     # Based on equation 2&3 in https://arxiv.org/pdf/1606.00931.pdf
@@ -176,16 +237,9 @@ def cox_nll2(
     torch.Tensor
         The negative log likelihood.
     """
-    eps = 1e-20
     risk_pred = risk_pred.reshape(-1, 1)
-    true_times = true_times.reshape(-1, 1)
+    log_loss = cox_log_risk_set(risk_pred, true_times, true_indicator).reshape(-1, 1)
     true_indicator = true_indicator.reshape(-1, 1)
-    mask = torch.ones(true_times.shape[0], true_times.shape[0]).to(true_times.device)
-    mask[(true_times.T - true_times) > 0] = 0
-    max_risk = risk_pred.max()
-    log_loss = torch.exp(risk_pred - max_risk) * mask
-    log_loss = torch.sum(log_loss, dim=0)
-    log_loss = torch.log(log_loss + eps).reshape(-1, 1) + max_risk
     # Sometimes in the batch we got all censoring data, so the denominator gets 0 and throw nan.
     # Solution: Consider increase the batch size. Afterall the nll should performed on the whole dataset.
     # Based on equation 2&3 in https://arxiv.org/pdf/1606.00931.pdf
@@ -159,14 +159,11 @@ def cox_survival(
     :return:
     The invidual survival distributions. shape = (n_samples, n_time_bins)
     """
-    n_sample = linear_predictor.shape[0]
-    n_data = linear_predictor.shape[1]
-    risk_score = torch.exp(linear_predictor)
-    survival_curves = torch.empty((n_sample, n_data, baseline_survival.shape[0]), dtype=dtype).to(linear_predictor.device)
-    for i in range(n_sample):
-        for j in range(n_data):
-            survival_curves[i, j, :] = torch.pow(baseline_survival, risk_score[i, j])
-    return survival_curves
+    risk_score = torch.exp(linear_predictor).unsqueeze(-1)
+    baseline_survival = baseline_survival.to(linear_predictor.device)
+    # S_i(t) = S_0(t) ** exp(eta_i), broadcast over all samples and time bins
+    survival_curves = torch.pow(baseline_survival, risk_score)
+    return survival_curves.to(dtype)
 
 def calculate_baseline_hazard(
         logits: torch.Tensor,
@@ -183,22 +180,16 @@ def calculate_baseline_hazard(
     cum_baseline_hazard: cumulative baseline hazard
     baseline_survival: baseline survival curve.
     """
-    risk_score = torch.exp(logits)
+    risk_score = torch.exp(logits).reshape(-1)
     order = torch.argsort(time)
     risk_score = risk_score[order]
     uniq_times, n_events, n_at_risk, _ = compute_unique_counts(event, time, order)
 
-    divisor = torch.empty(n_at_risk.shape, dtype=torch.float, device=n_at_risk.device)
-    value = torch.sum(risk_score)
-    divisor[0] = value
-    k = 0
-    for i in range(1, len(n_at_risk)):
-        d = n_at_risk[i - 1] - n_at_risk[i]
-        value -= risk_score[k:(k + d)].sum()
-        k += d
-        divisor[i] = value
-
-    assert k == n_at_risk[0] - n_at_risk[-1]
+    # The risk set of a unique time is the sorted tail starting at its first sample,
+    # so its summed risk score is a reverse cumulative sum
+    reverse_cumsum = torch.flip(torch.cumsum(torch.flip(risk_score, dims=(0,)), dim=0), dims=(0,))
+    first_index = (len(risk_score) - n_at_risk).long()
+    divisor = reverse_cumsum[first_index]
 
     hazard = n_events / divisor
     # Make sure the survival curve always starts at 1
@@ -270,9 +261,13 @@ def make_time_bins(
 def make_monotonic(
         array: Union[torch.Tensor, np.ndarray, list]
 ):
-    for i in range(len(array) - 1):
-        if not array[i] >= array[i + 1]:
-            array[i + 1] = array[i]
+    # Running minimum, i.e., the closest non-increasing curve from above
+    if isinstance(array, torch.Tensor):
+        array[:] = torch.cummin(array, dim=0).values
+    elif isinstance(array, np.ndarray):
+        array[:] = np.minimum.accumulate(array)
+    else:
+        array[:] = np.minimum.accumulate(np.asarray(array)).tolist()
     return array
 
 def multilabel_train_test_split(X, y, test_size, random_state=None):
@@ -552,36 +547,12 @@ def compute_unique_counts(
     if order is None:
         order = torch.argsort(time)
 
-    uniq_times = torch.empty(n_samples, dtype=time.dtype, device=time.device)
-    uniq_events = torch.empty(n_samples, dtype=torch.int, device=time.device)
-    uniq_counts = torch.empty(n_samples, dtype=torch.int, device=time.device)
-
-    i = 0
-    prev_val = time[order[0]]
-    j = 0
-    while True:
-        count_event = 0
-        count = 0
-        while i < n_samples and prev_val == time[order[i]]:
-            if event[order[i]]:
-                count_event += 1
-
-            count += 1
-            i += 1
-
-        uniq_times[j] = prev_val
-        uniq_events[j] = count_event
-        uniq_counts[j] = count
-        j += 1
-
-        if i == n_samples:
-            break
-
-        prev_val = time[order[i]]
-
-    uniq_times = uniq_times[:j]
-    uniq_events = uniq_events[:j]
-    uniq_counts = uniq_counts[:j]
+    # Runs of equal values in the sorted times are the unique time points
+    uniq_times, inverse, uniq_counts = torch.unique_consecutive(time[order], return_inverse=True,
+                                                                return_counts=True)
+    uniq_counts = uniq_counts.int()
+    uniq_events = torch.zeros(len(uniq_times), dtype=torch.int, device=time.device).index_add(
+        0, inverse, (event[order] != 0).int())
     n_censored = uniq_counts - uniq_events
 
     # offset cumulative sum by one
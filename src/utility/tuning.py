@@ -1,3 +1,10 @@
+import contextlib
+import json
+import sqlite3
+import numpy as np
+import torch
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 def get_mensa_sweep_cfg():
     return {
         "method": "bayes",
@@ -25,3 +32,149 @@ def get_mensa_sweep_cfg():
             }
         }
     }
+
+def sample_mensa_config(sweep_cfg, rng):
+    """
+    Samples one configuration from the "values" lists of a sweep config.
+    """
+    config = {}
+    for name, param in sweep_cfg['parameters'].items():
+        values = param['values']
+        config[name] = values[rng.integers(len(values))]
+    return config
+
+class TrialDatabase:
+    """
+    Local SQLite store of tuning trials and their rung results, shared by the
+    worker processes. Reopening the same file resumes the sweep.
+    """
+    def __init__(self, path):
+        self.path = str(path)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS trials (trial_id INTEGER PRIMARY KEY, config TEXT, "
+                         "status TEXT, valid_loss REAL, n_epochs INTEGER)")
+            conn.execute("CREATE TABLE IF NOT EXISTS rungs (trial_id INTEGER, rung INTEGER, valid_loss REAL, "
+                         "PRIMARY KEY (trial_id, rung))")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=60)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def add_trial(self, config):
+        with self._connect() as conn:
+            cursor = conn.execute("INSERT INTO trials (config, status) VALUES (?, 'pending')",
+                                  (json.dumps(config),))
+            return cursor.lastrowid
+
+    def n_trials(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM trials").fetchone()[0]
+
+    def get_unfinished_trials(self):
+        # Trials left 'running' by an interrupted sweep are run again
+        with self._connect() as conn:
+            rows = conn.execute("SELECT trial_id, config FROM trials "
+                                "WHERE status IN ('pending', 'running') ORDER BY trial_id").fetchall()
+            conn.execute("DELETE FROM rungs WHERE trial_id IN "
+                         "(SELECT trial_id FROM trials WHERE status = 'running')")
+        return [(trial_id, json.loads(config)) for trial_id, config in rows]
+
+    def set_status(self, trial_id, status, valid_loss=None, n_epochs=None):
+        with self._connect() as conn:
+            conn.execute("UPDATE trials SET status = ?, valid_loss = ?, n_epochs = ? WHERE trial_id = ?",
+                         (status, valid_loss, n_epochs, trial_id))
+
+    def report(self, trial_id, rung, valid_loss):
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO rungs (trial_id, rung, valid_loss) VALUES (?, ?, ?)",
+                         (trial_id, rung, valid_loss))
+            rows = conn.execute("SELECT valid_loss FROM rungs WHERE rung = ?", (rung,)).fetchall()
+        return [row[0] for row in rows]
+
+    def get_trials(self):
+        with self._connect() as conn:
+            rows = conn.execute("SELECT trial_id, config, status, valid_loss, n_epochs FROM trials "
+                                "ORDER BY trial_id").fetchall()
+        return [{'trial_id': trial_id, 'config': json.loads(config), 'status': status,
+                 'valid_loss': valid_loss, 'n_epochs': n_epochs}
+                for trial_id, config, status, valid_loss, n_epochs in rows]
+
+    def get_best_trial(self):
+        trials = [t for t in self.get_trials() if t['status'] == 'completed' and t['valid_loss'] is not None]
+        return min(trials, key=lambda t: t['valid_loss']) if trials else None
+
+class ASHAPruner:
+    """
+    Asynchronous successive halving on the validation loss. At every rung
+    (min_epochs * reduction_factor^i epochs) a trial continues only if its loss
+    is within the best 1/reduction_factor of all trials that reached the rung.
+    """
+    def __init__(self, min_epochs=10, reduction_factor=3, max_epochs=10000):
+        self.rungs = []
+        rung = min_epochs
+        while rung < max_epochs:
+            self.rungs.append(rung)
+            rung *= reduction_factor
+        self.reduction_factor = reduction_factor
+
+    def should_stop(self, db, trial_id, epoch, valid_loss):
+        if epoch not in self.rungs:
+            return False
+        losses = db.report(trial_id, epoch, valid_loss)
+        n_promote = len(losses) // self.reduction_factor
+        if n_promote == 0:
+            return False
+        return valid_loss > sorted(losses)[n_promote - 1]
+
+def _init_tuning_worker(n_threads):
+    torch.set_num_threads(n_threads)
+
+def _run_trial(train_fn, db_path, trial_id, config, pruner):
+    db = TrialDatabase(db_path)
+    db.set_status(trial_id, 'running')
+    state = {'pruned': False, 'n_epochs': 0}
+
+    def valid_callback(epoch, valid_loss):
+        state['n_epochs'] = epoch + 1
+        if pruner is not None and pruner.should_stop(db, trial_id, epoch + 1, valid_loss):
+            state['pruned'] = True
+            return True
+        return False
+
+    valid_loss = train_fn(config, valid_callback)
+    status = 'pruned' if state['pruned'] else 'completed'
+    db.set_status(trial_id, status, valid_loss=float(valid_loss), n_epochs=state['n_epochs'])
+    return trial_id, status, valid_loss
+
+def run_local_sweep(train_fn, sweep_cfg, n_trials, db_path, n_workers=1,
+                    threads_per_trial=1, pruner=None, random_state=0):
+    """
+    Runs a random-search sweep locally in a process pool without any external service.
+    train_fn(config, valid_callback) must be a top-level function that trains a model,
+    passes valid_callback on to MENSA.fit and returns the best validation loss.
+    Trials are stored in the SQLite file db_path; rerunning with the same file resumes
+    the sweep and only runs the missing or unfinished trials.
+    Returns the best completed trial.
+    """
+    db = TrialDatabase(db_path)
+    n_existing = db.n_trials()
+    rng = np.random.default_rng(random_state + n_existing)
+    for _ in range(n_trials - n_existing):
+        db.add_trial(sample_mensa_config(sweep_cfg, rng))
+
+    trials = db.get_unfinished_trials()
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_tuning_worker,
+                             initargs=(threads_per_trial,)) as pool:
+        futures = [pool.submit(_run_trial, train_fn, db.path, trial_id, config, pruner)
+                   for trial_id, config in trials]
+        for future in as_completed(futures):
+            trial_id, status, valid_loss = future.result()
+            print(f"Trial {trial_id} {status}, valid loss: {valid_loss:.4f}")
+
+    return db.get_best_trial()
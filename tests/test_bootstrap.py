@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from utility.bootstrap import bootstrap_replicates, bootstrap_weights, _prepare_metrics
+from utility.evaluation import MultiEventEvaluator, global_C_index, local_C_index
+
+def make_data(rng, n_test=120, n_train=200, n_events=3, n_bins=12):
+    time_bins = np.linspace(1, 60, n_bins)
+    surv_preds = np.round(np.exp(-rng.uniform(0.005, 0.05, (n_events, n_test, 1)) * time_bins), 2)
+    return dict(surv_preds=surv_preds, time_bins=time_bins,
+                test_time=rng.integers(1, 70, (n_test, n_events)).astype(float),
+                test_event=rng.integers(0, 2, (n_test, n_events)),
+                train_time=rng.integers(1, 70, (n_train, n_events)).astype(float),
+                train_event=rng.integers(0, 2, (n_train, n_events)))
+
+def make_hierarchical_data(rng, n_samples=80, n_events=2, num_bins=9, num_extra_bin=1):
+    n_columns = num_bins + num_extra_bin + 1
+    mod_out = [np.round(np.sort(rng.uniform(0, 1, (n_samples, n_columns)), axis=1)[:, ::-1], 1)
+               for _ in range(n_events)]
+    # Integer bins and a few times between them
+    event_times = rng.integers(0, num_bins, (n_samples, n_events)) + (rng.uniform(size=(n_samples, n_events)) < 0.2) / 2
+    return dict(mod_out=mod_out, event_times=event_times, labs=rng.integers(0, 2, (n_samples, n_events)),
+                num_bins=num_bins, num_extra_bin=num_extra_bin)
+
+@pytest.mark.parametrize('method', ['multinomial', 'poisson'])
+def test_weights_match_resampling(method):
+    # Every metric except IBS (fixed grid of censored test times) equals the metric of the resampled test set
+    rng = np.random.default_rng(0)
+    data = make_data(rng)
+    labels, evaluators = _prepare_metrics(data, ['CI', 'GlobalCI', 'LocalCI', 'MAEH', 'MAEM', 'MAEPO'])
+    weights = bootstrap_weights(len(data['test_time']), 6, rng, strata=data['test_event'][:, 0], method=method)
+    values = np.hstack([evaluate(weights) for evaluate in evaluators])
+    for b in range(len(weights)):
+        idx = np.repeat(np.arange(len(weights[b])), weights[b].astype(int))
+        surv_preds, test_time, test_event = data['surv_preds'][:, idx], data['test_time'][idx], data['test_event'][idx]
+        results = MultiEventEvaluator(surv_preds, data['time_bins'], test_time, test_event,
+                                      data['train_time'], data['train_event']).evaluate()
+        expected = np.concatenate([results['CI'], [global_C_index(surv_preds, test_time, test_event),
+                                                   local_C_index(surv_preds, test_time, test_event)],
+                                   results['MAEH'], results['MAEM'], results['MAEPO']])
+        np.testing.assert_allclose(values[b], expected, rtol=1e-10)
+
+def test_hierarchical_weights_match_resampling():
+    util = pytest.importorskip('hierarchical.util')
+    rng = np.random.default_rng(1)
+    data = make_hierarchical_data(rng)
+    n_events = data['labs'].shape[1]
+    labels, evaluators = _prepare_metrics(data, ['C index', 'Proposed', 'Local proposed'])
+    weights = bootstrap_weights(len(data['labs']), 10, rng)
+    values = np.hstack([evaluate(weights) for evaluate in evaluators])
+    args = (n_events, data['num_bins'], data['num_extra_bin'])
+    for b in range(len(weights)):
+        idx = np.repeat(np.arange(len(weights[b])), weights[b].astype(int))
+        mod_out, event_times, labs = [out[idx] for out in data['mod_out']], data['event_times'][idx], data['labs'][idx]
+        expected = np.concatenate([util.get_basic_c(mod_out, event_times, labs, *args, None, None),
+                                   util.get_proposed_metric(mod_out, event_times, labs, *args, None, None),
+                                   [util.get_local_eval(mod_out, event_times, labs, *args, 'proposed')]])
+        # The proposed pair values are stored in float32
+        np.testing.assert_allclose(values[b], expected, rtol=1e-6)
+
+def test_thread_pool():
+    data = make_hierarchical_data(np.random.default_rng(2))
+    metrics = ['C index', 'Proposed', 'Local proposed']
+    labels, estimate, replicates = bootstrap_replicates(data, metrics, n_boots=50, batch_size=10)
+    _, pooled_estimate, pooled = bootstrap_replicates(data, metrics, n_boots=50, batch_size=10, n_workers=3)
+    assert replicates.shape == (50, len(labels))
+    np.testing.assert_array_equal(estimate, pooled_estimate)
+    np.testing.assert_array_equal(replicates, pooled)
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from utility.evaluation import (predict_median_times, global_C_index, local_C_index, all_events_ci,
+                                _harrell_counts)
+
+def brute_force_counts(pred_times, test_time, test_event):
+    # SurvivalEVAL 0.2 comparable pairs, tied predictions left out
+    concordant, total = 0, 0
+    for i in range(len(test_time)):
+        if not test_event[i]:
+            continue
+        for j in range(len(test_time)):
+            if test_time[j] > test_time[i] or (test_time[j] == test_time[i] and not test_event[j]):
+                if pred_times[j] > pred_times[i]:
+                    concordant += 1
+                    total += 1
+                elif pred_times[j] < pred_times[i]:
+                    total += 1
+    return concordant, total
+
+def make_data(rng, n_events=3, n_samples=40, n_bins=8):
+    # Curves with many tied median times, integer times with ties
+    surv_preds = np.sort(rng.integers(0, 5, (n_events, n_samples, n_bins)) / 4, axis=-1)[..., ::-1]
+    test_time = rng.integers(0, 10, (n_samples, n_events)).astype(float)
+    test_event = rng.integers(0, 2, (n_samples, n_events))
+    return surv_preds, test_time, test_event
+
+@pytest.mark.parametrize('seed', range(10))
+def test_harrell_counts(seed):
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(2, 60))
+    pred_times = rng.integers(0, 6, n).astype(float)
+    test_time = rng.integers(0, 8, n).astype(float)
+    test_event = rng.integers(0, 2, n)
+    assert _harrell_counts(pred_times, test_time, test_event) == brute_force_counts(pred_times, test_time, test_event)
+
+@pytest.mark.parametrize('seed', range(10))
+def test_global_C_index(seed):
+    surv_preds, test_time, test_event = make_data(np.random.default_rng(seed))
+    pred_times = predict_median_times(surv_preds)
+    counts = np.array([brute_force_counts(pred_times[k], test_time[:, k], test_event[:, k])
+                       for k in range(len(surv_preds))], dtype=float)
+    assert global_C_index(list(surv_preds), test_time, test_event) == pytest.approx(counts[:, 0].sum() / counts[:, 1].sum())
+    assert global_C_index(surv_preds, test_time, test_event, weight=False) == pytest.approx(np.mean(counts[:, 0] / counts[:, 1]))
+    concordant, total = brute_force_counts(pred_times.reshape(-1), test_time.T.reshape(-1), test_event.T.reshape(-1))
+    assert all_events_ci(surv_preds, test_time, test_event) == pytest.approx(concordant / total)
+
+@pytest.mark.parametrize('seed', range(10))
+def test_local_C_index(seed):
+    surv_preds, test_time, test_event = make_data(np.random.default_rng(seed))
+    pred_times = predict_median_times(surv_preds).T
+    counts = np.array([brute_force_counts(pred_times[i], test_time[i], test_event[i])
+                       for i in range(len(test_time))], dtype=float)
+    assert local_C_index(list(surv_preds), test_time, test_event) == pytest.approx(counts[:, 0].sum() / counts[:, 1].sum())
+    # Patients whose comparable pairs all have tied predictions are left out
+    has_pairs = counts[:, 1] > 0
+    assert local_C_index(surv_preds, test_time, test_event, weight=False) == \
+        pytest.approx(np.mean(counts[has_pairs, 0] / counts[has_pairs, 1]))
+
+@pytest.mark.parametrize('seed', range(5))
+def test_matches_lifelines_evaluator(seed):
+    SurvivalEVAL = pytest.importorskip('SurvivalEVAL')
+    pd = pytest.importorskip('pandas')
+    rng = np.random.default_rng(seed)
+    surv_preds = np.sort(rng.random((2, 50, 10)), axis=-1)[..., ::-1]
+    surv_preds[..., 0] = 1
+    test_time = rng.integers(1, 12, (50, 2)).astype(float)
+    test_event = rng.integers(0, 2, (50, 2))
+    concordant, total = 0.0, 0.0
+    for k in range(2):
+        evaluator = SurvivalEVAL.LifelinesEvaluator(pd.DataFrame(surv_preds[k]).T, test_time[:, k], test_event[:, k])
+        _, event_concordant, event_total = evaluator.concordance()
+        concordant += event_concordant
+        total += event_total
+    assert global_C_index(surv_preds, test_time, test_event) == pytest.approx(concordant / total)
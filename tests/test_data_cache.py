@@ -0,0 +1,86 @@
+import importlib.util
+import numpy as np
+import pandas as pd
+import pytest
+
+import config as cfg
+
+LOADER_SOURCE = '''
+import pandas as pd
+import config as cfg
+from utility.data_cache import cached_dataset
+
+calls = []
+
+def get_label(df):
+    return (df['x'] > {threshold}).astype(int).to_numpy()
+
+class ToyDataLoader:
+    @cached_dataset('toy.csv')
+    def load_data(self, n_samples=None):
+        calls.append(n_samples)
+        df = pd.read_csv(f'{{cfg.DATA_DIR}}/toy.csv')
+        df['group'] = df['group'].astype('category')
+        self.X = df[['x', 'group']]
+        self.y_t = df['time']
+        self.y_e = get_label(df)
+        self.columns = list(self.X.columns)
+        return self
+'''
+
+def import_loader(path, threshold):
+    # A fresh module from the current source, like a new session after editing the loader
+    path.write_text(LOADER_SOURCE.format(threshold=threshold))
+    spec = importlib.util.spec_from_file_location('toy_loader', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(cfg, 'DATA_DIR', tmp_path)
+    monkeypatch.setattr(cfg, 'DATA_CACHE_DIR', tmp_path / 'cache')
+    monkeypatch.setattr(cfg, 'USE_DATA_CACHE', True)
+    pd.DataFrame({'x': [0.5, 1.5, 2.5, 3.5], 'group': ['a', 'b', 'a', 'c'],
+                  'time': [1.0, 2.0, 3.0, 4.0]}).to_csv(tmp_path / 'toy.csv', index=False)
+    return tmp_path
+
+def test_round_trip(data_dir):
+    module = import_loader(data_dir / 'toy_loader.py', threshold=1)
+    expected = module.ToyDataLoader().load_data()
+    assert module.calls == [None]
+
+    loaded = module.ToyDataLoader().load_data()
+    assert module.calls == [None]
+    pd.testing.assert_frame_equal(loaded.X, expected.X)
+    pd.testing.assert_series_equal(loaded.y_t, expected.y_t)
+    np.testing.assert_array_equal(loaded.y_e, expected.y_e)
+    assert loaded.columns == expected.columns
+    assert isinstance(loaded.X['group'].dtype, pd.CategoricalDtype)
+    # The numeric columns stay on the memory-mapped files
+    assert isinstance(loaded.X['x'].to_numpy().base, np.memmap)
+
+    # Other arguments are another entry
+    module.ToyDataLoader().load_data(n_samples=2)
+    assert module.calls == [None, 2]
+
+def test_source_file_change(data_dir):
+    module = import_loader(data_dir / 'toy_loader.py', threshold=1)
+    module.ToyDataLoader().load_data()
+    module = import_loader(data_dir / 'toy_loader.py', threshold=1)
+    module.ToyDataLoader().load_data()
+    assert module.calls == []
+
+    # A helper of load_data() changed, not load_data() itself
+    module = import_loader(data_dir / 'toy_loader.py', threshold=2)
+    loaded = module.ToyDataLoader().load_data()
+    assert module.calls == [None]
+    np.testing.assert_array_equal(loaded.y_e, [0, 0, 1, 1])
+
+def test_data_file_change(data_dir):
+    module = import_loader(data_dir / 'toy_loader.py', threshold=1)
+    module.ToyDataLoader().load_data()
+    pd.DataFrame({'x': [5.0], 'group': ['d'], 'time': [9.0]}).to_csv(data_dir / 'toy.csv', index=False)
+    loaded = module.ToyDataLoader().load_data()
+    assert module.calls == [None, None]
+    assert len(loaded.X) == 1
@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+data_loader = pytest.importorskip('data_loader')
+
+# The row-wise rules that load_data() used before np.select
+def rotterdam_get_event(row):
+    if row['recur'] == 0 and row['death'] == 0:
+        return 0
+    elif row['rtime'] <= row['dtime'] and row['recur'] == 1:
+        return 2
+    elif row['dtime'] <= row['rtime'] and row['death'] == 1:
+        return 1
+    elif row['death'] == 1 and row['recur'] == 0:
+        return 1
+    else:
+        raise ValueError("error in event")
+
+def rotterdam_get_time(row):
+    if row['event'] == 0:
+        return min(row['rtime'], row['dtime'])
+    elif row['event'] == 1:
+        return row['dtime']
+    elif row['event'] == 2:
+        return row['rtime']
+    else:
+        raise ValueError("error in time")
+
+def mimic_get_event(row):
+    if row['ARF_event'] == 0 and row['shock_event'] == 0 and row['death_event'] == 0:
+        return 0
+    elif row['death_event'] == 1 and min([row['ARF_time'], row['death_time'], row['shock_time']]) == row['death_time']:
+        return 3
+    elif row['shock_event'] == 1 and min([row['ARF_time'], row['shock_time']]) == row['shock_time']:
+        return 2
+    elif row['ARF_event'] == 1:
+        return 1
+    else:
+        raise ValueError("error in event")
+
+def mimic_get_time(row):
+    if row['event'] == 0:
+        return max([row['ARF_time'], row['death_time'], row['shock_time']])
+    elif row['event'] == 3:
+        return row['death_time']
+    elif row['event'] == 2:
+        return row['shock_time']
+    elif row['event'] == 1:
+        return row['ARF_time']
+    else:
+        raise ValueError("error in time")
+
+def row_wise(df, get_event, get_time):
+    df = df.copy()
+    df['event'] = df.apply(get_event, axis=1)
+    df['time'] = df.apply(get_time, axis=1)
+    return df['event'].to_numpy(), df['time'].to_numpy()
+
+ROTTERDAM_COLUMNS = ['recur', 'death', 'rtime', 'dtime']
+ROTTERDAM_ROWS = [
+    (0, 0, 5.0, 7.0),   # censored, the earlier time
+    (1, 0, 3.0, 7.0),   # recurrence first
+    (1, 1, 3.0, 3.0),   # recurrence and death at the same time
+    (1, 1, 8.0, 4.0),   # death first
+    (0, 1, 2.0, 6.0),   # death after a censored recurrence time
+    (0, 1, 9.0, 6.0),   # death before the censored recurrence time
+]
+MIMIC_COLUMNS = ['ARF_event', 'shock_event', 'death_event', 'ARF_time', 'shock_time', 'death_time']
+MIMIC_ROWS = [
+    (0, 0, 0, 5.0, 6.0, 7.0),   # censored, the latest time
+    (1, 1, 1, 5.0, 6.0, 3.0),   # death first
+    (1, 0, 1, 3.0, 9.0, 3.0),   # death tied with ARF
+    (0, 1, 1, 9.0, 2.0, 5.0),   # shock before death
+    (1, 1, 0, 4.0, 4.0, 8.0),   # shock tied with ARF
+    (1, 1, 0, 2.0, 5.0, 8.0),   # ARF before shock
+    (1, 0, 1, 3.0, 5.0, 6.0),   # ARF before death
+]
+
+def test_rotterdam_matches_row_wise():
+    df = pd.DataFrame(ROTTERDAM_ROWS, columns=ROTTERDAM_COLUMNS)
+    expected_event, expected_time = row_wise(df, rotterdam_get_event, rotterdam_get_time)
+    event, time = data_loader.get_rotterdam_competing_events(df)
+    np.testing.assert_array_equal(event, expected_event)
+    np.testing.assert_array_equal(time, expected_time)
+    np.testing.assert_array_equal(event, [0, 2, 2, 1, 1, 1])
+
+def test_mimic_matches_row_wise():
+    df = pd.DataFrame(MIMIC_ROWS, columns=MIMIC_COLUMNS)
+    expected_event, expected_time = row_wise(df, mimic_get_event, mimic_get_time)
+    event, time = data_loader.get_mimic_competing_events(df)
+    np.testing.assert_array_equal(event, expected_event)
+    np.testing.assert_array_equal(time, expected_time)
+    np.testing.assert_array_equal(event, [0, 3, 3, 2, 2, 1, 1])
+
+@pytest.mark.parametrize('get_events, get_event, columns, rows', [
+    # Recurrence after the death time without a death
+    ('get_rotterdam_competing_events', rotterdam_get_event, ROTTERDAM_COLUMNS, ROTTERDAM_ROWS + [(1, 0, 8.0, 4.0)]),
+    # Shock after the censored ARF time
+    ('get_mimic_competing_events', mimic_get_event, MIMIC_COLUMNS, MIMIC_ROWS + [(0, 1, 0, 2.0, 5.0, 8.0)]),
+    # Death after the censored ARF time
+    ('get_mimic_competing_events', mimic_get_event, MIMIC_COLUMNS, MIMIC_ROWS + [(0, 0, 1, 2.0, 5.0, 8.0)]),
+])
+def test_invalid_rows_raise(get_events, get_event, columns, rows):
+    df = pd.DataFrame(rows, columns=columns)
+    with pytest.raises(ValueError, match="error in event"):
+        df.apply(get_event, axis=1)
+    with pytest.raises(ValueError, match="error in event"):
+        getattr(data_loader, get_events)(df)
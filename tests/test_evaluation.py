@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from utility.evaluation import MultiEventEvaluator
+
+def make_data(seed, n_test=150, n_train=250, n_events=3, n_bins=15, shared_times=False):
+    rng = np.random.default_rng(seed)
+    time_bins = np.sort(rng.choice(np.arange(1, 200), n_bins, replace=False)).astype(float)
+    surv_preds = np.exp(-rng.uniform(0.001, 0.02, (n_events, n_test, 1)) * time_bins)
+    if seed % 2:
+        # Tied median times
+        surv_preds = np.round(surv_preds, 2)
+    def labels(n):
+        if shared_times:
+            # Competing risks, one time and one of K events (or censoring) per sample
+            times = rng.integers(1, 250, n)
+            events = rng.integers(0, n_events + 1, n)
+            return times, np.stack([(events == k + 1) * 1.0 for k in range(n_events)], axis=1)
+        return rng.integers(1, 250, (n, n_events)), rng.integers(0, 2, (n, n_events)) * 1.0
+    return (surv_preds, time_bins) + labels(n_test) + labels(n_train)
+
+@pytest.mark.parametrize('seed', range(4))
+@pytest.mark.parametrize('shared_times', [False, True])
+def test_matches_lifelines_evaluator(seed, shared_times):
+    # The metrics with LifelinesEvaluator's default arguments, e.g., unweighted MAE
+    SurvivalEVAL = pytest.importorskip('SurvivalEVAL')
+    surv_preds, time_bins, test_time, test_event, train_time, train_event = make_data(seed, shared_times=shared_times)
+    expected = []
+    for k in range(len(surv_preds)):
+        event_test_time = test_time if shared_times else test_time[:, k]
+        event_train_time = train_time if shared_times else train_time[:, k]
+        evaluator = SurvivalEVAL.LifelinesEvaluator(pd.DataFrame(surv_preds[k], columns=time_bins).T,
+                                                    event_test_time, test_event[:, k],
+                                                    event_train_time, train_event[:, k])
+        expected.append([evaluator.concordance()[0], evaluator.integrated_brier_score(),
+                         evaluator.mae(method="Hinge"), evaluator.mae(method="Margin"),
+                         evaluator.mae(method="Pseudo_obs"), evaluator.d_calibration()[0]])
+    results = MultiEventEvaluator(list(surv_preds), time_bins, test_time, test_event,
+                                  train_time, train_event).evaluate()
+    assert list(results.columns) == MultiEventEvaluator.metrics
+    np.testing.assert_allclose(results.to_numpy(), np.array(expected), rtol=1e-7, atol=1e-9)
+
+def test_process_pool():
+    surv_preds, time_bins, test_time, test_event, train_time, train_event = make_data(0)
+    evaluator = MultiEventEvaluator(surv_preds, time_bins, test_time, test_event, train_time, train_event)
+    pd.testing.assert_frame_equal(evaluator.evaluate(), evaluator.evaluate(n_workers=2))
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+from mensa.model import MENSA
+from mensa.streaming import ShardedArraySource, save_array_shards
+
+def make_data(seed, n_samples=64, n_features=4):
+    rng = np.random.default_rng(seed)
+    return {'X': torch.tensor(rng.normal(size=(n_samples, n_features)), dtype=torch.float32),
+            'T': torch.tensor(rng.exponential(0.8, n_samples), dtype=torch.float32),
+            'E': torch.tensor(rng.integers(0, 2, n_samples), dtype=torch.int64)}
+
+def fit_one_epoch(train, valid):
+    torch.manual_seed(0)
+    model = MENSA(n_features=4, n_events=1, dropout_rate=0.0)
+    return model.fit(train, valid, batch_size=64, n_epochs=1, patience=10)
+
+def test_float_times_keep_their_dtype(tmp_path):
+    data = make_data(0)
+    save_array_shards(tmp_path, data['X'], data['T'], data['E'], shard_size=32)
+    batches = list(ShardedArraySource.from_directory(tmp_path).iterate(64))
+    assert len(batches) == 1
+    X, T, E = batches[0]
+    assert T.dtype == torch.float32 and E.dtype == torch.int64
+    torch.testing.assert_close(T, data['T'])
+
+def test_streamed_fit_matches_in_memory(tmp_path):
+    train, valid = make_data(0), make_data(1)
+    for name, data in [('train', train), ('valid', valid)]:
+        save_array_shards(tmp_path / name, data['X'], data['T'], data['E'], shard_size=32)
+    # One batch per epoch, so the shuffled order does not change the loss
+    in_memory = fit_one_epoch(train, valid)
+    streamed = fit_one_epoch(ShardedArraySource.from_directory(tmp_path / 'train'),
+                             ShardedArraySource.from_directory(tmp_path / 'valid'))
+    assert np.isfinite(streamed['train_loss']).all() and np.isfinite(streamed['valid_loss']).all()
+    np.testing.assert_allclose(streamed['train_loss'], in_memory['train_loss'], rtol=1e-5)
+    np.testing.assert_allclose(streamed['valid_loss'], in_memory['valid_loss'], rtol=1e-5)